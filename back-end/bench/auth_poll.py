@@ -0,0 +1,104 @@
+"""
+Microbenchmark of the auth dependency (main.get_user_from_token) under
+polling: many clients, one token each, hitting status endpoints in turn.
+
+    python bench/auth_poll.py                         500 pollers, 20000 calls
+    python bench/auth_poll.py --pollers 50 --calls 5000
+
+Each configuration runs the same round-robin sequence against a throwaway
+SQLite database. A new request session is opened every --session-every calls,
+as a request would. Reported per call, in microseconds:
+
+- no caches          jwt.decode and a SELECT on every call
+- user cache         UserCache (AUTH_USER_CACHE_TTL_SECONDS) only
+- user + claims      UserCache and TokenClaimsCache (AUTH_TOKEN_CACHE_SIZE)
+
+Run from back-end/.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='bench-auth-')}/bench.db")
+
+import main  # noqa: E402
+from database import SessionLocal, init_db  # noqa: E402
+from jwt_cache import token_claims_cache  # noqa: E402
+from models import User  # noqa: E402
+from user_cache import user_cache  # noqa: E402
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def _run(tokens, calls: int, session_every: int):
+    samples = []
+    db = SessionLocal()
+    try:
+        for i in range(calls):
+            if i and i % session_every == 0:
+                db.close()
+                db = SessionLocal()
+            token = tokens[i % len(tokens)]
+            started = time.perf_counter()
+            main.get_user_from_token(token, db)
+            samples.append((time.perf_counter() - started) * 1e6)
+    finally:
+        db.close()
+    return _percentiles(samples)
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pollers", type=int, default=500)
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--session-every", type=int, default=50)
+    args = parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    users = [User(email=f"poller{i}@bench.local", hashed_password="x") for i in range(args.pollers)]
+    db.add_all(users)
+    db.commit()
+    tokens = [main.create_access_token({"sub": str(u.id)}) for u in users]
+    db.close()
+
+    user_ttl, claims_size = user_cache.ttl_seconds, token_claims_cache.max_entries
+    configs = [
+        ("no caches", 0, 0),
+        ("user cache", user_ttl or 60, 0),
+        ("user + claims cache", user_ttl or 60, claims_size or 10000),
+    ]
+    print(f"get_user_from_token: {args.pollers} pollers, {args.calls} calls round-robin, "
+          f"new session every {args.session_every} calls (us per call)")
+    for name, ttl, size in configs:
+        user_cache.ttl_seconds, token_claims_cache.max_entries = ttl, size
+        user_cache.clear()
+        token_claims_cache.clear()
+        _run(tokens, min(args.calls, 2 * args.pollers), args.session_every)  # warm up
+        p50, p99 = _run(tokens, args.calls, args.session_every)
+        print(f"  {name:22} p50 {p50:7.1f}   p99 {p99:7.1f}")
+
+    token = tokens[0]
+    token_claims_cache.put(token, main.jwt.decode(token, main.SECRET_KEY, algorithms=[main.ALGORITHM]))
+    n = 20000
+    started = time.perf_counter()
+    for _ in range(n):
+        main.jwt.decode(token, main.SECRET_KEY, algorithms=[main.ALGORITHM])
+    decode_us = (time.perf_counter() - started) / n * 1e6
+    started = time.perf_counter()
+    for _ in range(n):
+        token_claims_cache.get(token)
+    hit_us = (time.perf_counter() - started) / n * 1e6
+    print(f"  jwt.decode alone {decode_us:.1f} us, claims cache hit {hit_us:.1f} us")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,121 @@
+"""
+Benchmark of media_fetch.download_to_temp() against a local range-capable
+stand-in server with a bandwidth cap per connection (like a provider CDN).
+
+    python bench/fetch_ranges.py                      200 MB, 10 MB/s per connection, 1/2/4/8 connections
+    python bench/fetch_ranges.py --size-mb 50 --rate-mb 5 --connections 1 4
+    python bench/fetch_ranges.py --no-ranges          server ignores Range: single-stream fallback
+    python bench/fetch_ranges.py --rate-mb 0          unthrottled
+
+Run from back-end/. Downloads go to a throwaway directory.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import requests  # noqa: E402
+
+import media_fetch  # noqa: E402
+
+SEND_CHUNK = 64 * 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        size = len(server.body)
+        start, end = 0, size - 1
+        rng = self.headers.get("Range")
+        if rng and server.ranges:
+            first, _, last = rng[len("bytes="):].partition("-")
+            start, end = int(first), int(last) if last else size - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end + 1 - start))
+        self.send_header("ETag", server.etag)
+        if server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+        # Per-connection cap: each chunk is sent no earlier than its share of the rate allows
+        started = time.monotonic()
+        sent = 0
+        view = memoryview(server.body)[start:end + 1]
+        try:
+            while sent < len(view):
+                chunk = view[sent:sent + SEND_CHUNK]
+                if server.rate:
+                    delay = started + sent / server.rate - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                self.wfile.write(chunk)
+                sent += len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def start_server(body: bytes, rate: float, ranges: bool) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    server.body = body
+    server.rate = rate
+    server.ranges = ranges
+    server.etag = f'"{hashlib.sha256(body[:1024]).hexdigest()[:16]}"'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=200)
+    parser.add_argument("--rate-mb", type=float, default=10.0, help="cap per connection in MB/s, 0 for none")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--no-ranges", action="store_true", help="server ignores Range and sends 200")
+    args = parser.parse_args()
+
+    body = os.urandom(args.size_mb * 1024 * 1024)
+    expected = hashlib.sha256(body).hexdigest()
+    server = start_server(body, args.rate_mb * 1024 * 1024, ranges=not args.no_ranges)
+    url = f"http://127.0.0.1:{server.server_address[1]}/video.mp4"
+    scratch = Path(tempfile.mkdtemp(prefix="bench-fetch-"))
+    media_fetch.temp_dir = lambda: scratch
+    os.environ["MEDIA_FETCH_MIN_PARALLEL_MB"] = "1"
+
+    rate = f"{args.rate_mb:g} MB/s per connection" if args.rate_mb else "unthrottled"
+    ranges = "ranges ignored" if args.no_ranges else "ranges honoured"
+    print(f"{args.size_mb} MB from a local server, {rate}, {ranges}")
+    try:
+        for n in args.connections:
+            os.environ["MEDIA_FETCH_CONNECTIONS"] = str(n)
+            started = time.monotonic()
+            path, sha256, size = media_fetch.download_to_temp(requests.get(url, stream=True, timeout=30))
+            seconds = time.monotonic() - started
+            path.unlink()
+            assert sha256 == expected and size == len(body), "downloaded content differs"
+            mode = media_fetch.metrics()["last_download"]["mode"]
+            print(f"  {n} connection{'s' if n > 1 else ' '}  {seconds:6.2f} s  {size / seconds / 1024 ** 2:6.1f} MB/s  ({mode})")
+    finally:
+        server.shutdown()
+        server.server_close()
+        for leftover in scratch.iterdir():
+            leftover.unlink()
+        scratch.rmdir()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark of image_preprocess.fit_exact() (header probe, JPEG draft decode,
+reduce() pre-shrink, fast PNG encode) against the previous full-resolution
+path (full decode, one LANCZOS resize, default PNG encode) over a corpus of
+typical reference image uploads.
+
+    python bench/image_fit.py                      generated corpus, median of 5 runs
+    python bench/image_fit.py --corpus ~/photos    every image file in a directory
+    python bench/image_fit.py --runs 9
+
+Each image is fitted to 1280x720 and 720x1280 on one core, in process. The
+last column is the mean absolute pixel difference between the two outputs
+(0-255). Run from back-end/ (needs Pillow).
+"""
+import argparse
+import io
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageStat  # noqa: E402
+
+from image_preprocess import fit_exact, probe  # noqa: E402
+
+TARGETS = [(1280, 720), (720, 1280)]
+
+
+def full_resolution_fit(data: bytes, width: int, height: int) -> bytes:
+    """The path before header probing and draft decoding."""
+    with Image.open(io.BytesIO(data)) as img:
+        if img.size == (width, height):
+            return data
+        resized = img.resize((width, height), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        resized.save(output, format="PNG")
+        return output.getvalue()
+
+
+def _photo(width: int, height: int, seed: int) -> Image.Image:
+    """Photo-like content: smooth gradients, shapes with soft edges and sensor noise."""
+    base = Image.radial_gradient("L").resize((width, height))
+    img = Image.merge("RGB", (base, base.rotate(90 + seed * 30).resize((width, height)), base.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    draw = ImageDraw.Draw(img)
+    for i in range(12):
+        x, y = (width * ((i * 37 + seed * 11) % 100)) // 100, (height * ((i * 53 + seed * 7) % 100)) // 100
+        r = min(width, height) // (4 + i % 5)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=((i * 40) % 256, (i * 90 + seed) % 256, (i * 20) % 256))
+    img = img.filter(ImageFilter.GaussianBlur(radius=max(1, width // 800)))
+    noise = Image.effect_noise((width, height), 12).convert("RGB")
+    return ImageChops.add(img, noise, scale=1.0, offset=-64)
+
+
+def _screenshot(width: int, height: int) -> Image.Image:
+    img = Image.new("RGB", (width, height), (245, 245, 247))
+    draw = ImageDraw.Draw(img)
+    for row in range(0, height, 48):
+        draw.rectangle((40, row + 8, width - 40, row + 36), fill=(255, 255, 255), outline=(210, 210, 215))
+        draw.text((56, row + 16), f"Row {row // 48}: settings, toggles and some text", fill=(30, 30, 30))
+    return img
+
+
+def _encode(img: Image.Image, fmt: str) -> bytes:
+    out = io.BytesIO()
+    img.save(out, format=fmt, **({"quality": 90} if fmt in ("JPEG", "WEBP") else {}))
+    return out.getvalue()
+
+
+def generated_corpus() -> List[Tuple[str, bytes]]:
+    return [
+        ("phone_48mp.jpg", _encode(_photo(8000, 6000, 1), "JPEG")),
+        ("phone_12mp.jpg", _encode(_photo(4032, 3024, 2), "JPEG")),
+        ("phone_12mp_portrait.jpg", _encode(_photo(3024, 4032, 3), "JPEG")),
+        ("fullhd.jpg", _encode(_photo(1920, 1080, 4), "JPEG")),
+        ("screenshot.png", _encode(_screenshot(2560, 1600), "PNG")),
+        ("camera.webp", _encode(_photo(2048, 1536, 5), "WEBP")),
+        ("ready_1280x720.jpg", _encode(_photo(1280, 720, 6), "JPEG")),
+        ("ready_720x1280.png", _encode(_photo(720, 1280, 7), "PNG")),
+    ]
+
+
+def directory_corpus(path: Path) -> List[Tuple[str, bytes]]:
+    corpus = []
+    for file in sorted(path.iterdir()):
+        if file.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp", ".gif"):
+            corpus.append((file.name, file.read_bytes()))
+    return corpus
+
+
+def _median_ms(fn, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def _difference(a: bytes, b: bytes) -> float:
+    with Image.open(io.BytesIO(a)) as img_a, Image.open(io.BytesIO(b)) as img_b:
+        diff = ImageChops.difference(img_a.convert("RGB"), img_b.convert("RGB"))
+        return sum(ImageStat.Stat(diff).mean) / 3
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=Path, help="directory of images (default: generated corpus)")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = directory_corpus(args.corpus) if args.corpus else generated_corpus()
+    print(f"{len(corpus)} images, median of {args.runs} runs per target, ms")
+    print(f"  {'image':26} {'size':>11} {'target':>9} {'before':>8} {'after':>8} {'diff':>6}")
+    totals = [0.0, 0.0]
+    for name, data in corpus:
+        fmt, w, h = probe(data)
+        for width, height in TARGETS:
+            before = _median_ms(lambda: full_resolution_fit(data, width, height), args.runs)
+            after = _median_ms(lambda: fit_exact(data, width, height), args.runs)
+            totals[0] += before
+            totals[1] += after
+            diff = _difference(full_resolution_fit(data, width, height), fit_exact(data, width, height).data)
+            print(f"  {name:26} {w:>5}x{h:<5} {width:>4}x{height:<4} {before:8.1f} {after:8.1f} {diff:6.2f}")
+    print(f"  {'corpus total':54} {totals[0]:8.0f} {totals[1]:8.0f}")
+
+
+if __name__ == "__main__":
+    main()
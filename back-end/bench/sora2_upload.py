@@ -0,0 +1,122 @@
+"""
+Per-request latency of preparing a Sora2 image-to-video upload: the
+in-memory multipart path in main._sora2_create_task() against the old
+temp-file round trip (write a NamedTemporaryFile, reopen it for the upload,
+reopen it with PIL to check the size, unlink it).
+
+The upload itself is stubbed: requests.post builds the real multipart body
+and returns a fake job, so the numbers cover everything up to the network.
+The prepared-image cache is off, so every request processes its image.
+
+    python bench/sora2_upload.py                  40 runs per case
+    python bench/sora2_upload.py --runs 100
+
+Run from back-end/ (needs Pillow).
+"""
+import argparse
+import base64
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='bench-sora2-')}/bench.db")
+os.environ["MEDIA_IMAGE_CACHE_MEMORY_MB"] = "0"
+os.environ["MEDIA_IMAGE_CACHE_DISK_MB"] = "0"
+os.environ.setdefault("SORA2_API_KEY", "bench")
+
+import requests  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import main  # noqa: E402
+from image_preprocess import image_pool  # noqa: E402
+
+
+class _Response:
+    status_code = 200
+    content = b'{"id": "video_bench"}'
+
+    def json(self):
+        return {"id": "video_bench"}
+
+
+def _fake_post(url, headers=None, data=None, files=None, json=None, timeout=None):
+    # Build the body exactly as requests would before sending it
+    requests.Request("POST", url, headers=headers, data=data, files=files, json=json).prepare()
+    return _Response()
+
+
+def _temp_file_upload(image_url: str, width: int, height: int) -> None:
+    """The removed path: processed bytes -> temp file -> reopen for upload and for a PIL size check."""
+    prepared = image_pool.fit_exact(base64.b64decode(image_url.split(",", 1)[1]), width, height)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
+        tmp_file.write(prepared.data)
+        temp_file_path = tmp_file.name
+    image_file = open(temp_file_path, "rb")
+    try:
+        verify_img = Image.open(temp_file_path)
+        actual_size = verify_img.size
+        verify_img.close()
+        assert actual_size == (width, height)
+        _fake_post(
+            "https://api.openai.com/v1/videos",
+            data={"prompt": "bench", "model": "sora-2", "seconds": "4", "size": f"{width}x{height}"},
+            files={"input_reference": ("image.png", image_file, "image/png")},
+        )
+    finally:
+        image_file.close()
+        os.unlink(temp_file_path)
+
+
+def _data_url(width: int, height: int, fmt: str) -> str:
+    out = io.BytesIO()
+    Image.radial_gradient("L").resize((width, height)).convert("RGB").save(out, format=fmt, quality=90)
+    mime = "jpeg" if fmt == "JPEG" else fmt.lower()
+    return f"data:image/{mime};base64," + base64.b64encode(out.getvalue()).decode("ascii")
+
+
+def _timed(fns, runs: int):
+    """(p50, p90) in ms per function; runs are interleaved so drift hits both alike."""
+    samples = [[] for _ in fns]
+    for _ in range(runs):
+        for fn, out in zip(fns, samples):
+            # The [Sora2] log lines are the same for both paths; keep them off the terminal
+            with contextlib.redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                fn()
+                out.append((time.perf_counter() - started) * 1000)
+    return [(statistics.median(s), sorted(s)[int(len(s) * 0.9) - 1]) for s in samples]
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=40)
+    args = parser.parse_args()
+
+    main.requests.post = _fake_post
+    cases = [
+        ("1280x720 PNG, no resize", _data_url(1280, 720, "PNG")),
+        ("1920x1080 JPEG, resized", _data_url(1920, 1080, "JPEG")),
+    ]
+    print(f"Sora2 upload preparation, 1280x720 target, {args.runs} runs (ms)")
+    print(f"  {'case':28} {'temp file p50/p90':>20} {'in memory p50/p90':>20}")
+    try:
+        # Warm the worker pool so process start-up isn't counted
+        image_pool.fit_exact(base64.b64decode(cases[1][1].split(",", 1)[1]), 1280, 720)
+        for name, url in cases:
+            before, after = _timed([
+                lambda: _temp_file_upload(url, 1280, 720),
+                lambda: main._sora2_create_task("bench", "16:9", "sd", [url], None, None),
+            ], args.runs)
+            print(f"  {name:28} {before[0]:9.2f} / {before[1]:7.2f} {after[0]:11.2f} / {after[1]:7.2f}")
+    finally:
+        image_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main_()
@@ -89,6 +89,7 @@ def init_db():
     print(f"[DB] Found {len(Base.metadata.tables)} table(s) to create: {list(Base.metadata.tables.keys())}")
     try:
         Base.metadata.create_all(bind=engine)
+        add_missing_columns()
         print("[DB] Tables ready")
     except Exception as e:
         print(f"[DB] Error creating tables: {e}")
@@ -97,6 +98,30 @@ def init_db():
         raise
 
 
+def add_missing_columns():
+    """
+    create_all() never alters existing tables, so columns added to a model later
+    are missing on databases created before them. Add those (nullable) columns in place.
+    """
+    from sqlalchemy import inspect, text
+
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            print(f"[DB] Adding missing column {table.name}.{column.name} ({column_type})")
+            with engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                if column.index:
+                    conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table.name}_{column.name} ON {table.name} ({column.name})'))
+
+
 # Note: init_db() should be called after all models are imported
 # It will be called from main.py after models are loaded
 
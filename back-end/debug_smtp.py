@@ -0,0 +1,166 @@
+"""
+Local SMTP stand-in for development and tests: accepts every message and
+prints it instead of delivering it.
+
+    python debug_smtp.py [port]        (default 1025)
+
+and point the backend at it in .env:
+
+    SMTP_SERVER=localhost
+    SMTP_PORT=1025
+    SMTP_STARTTLS=false
+
+Any SMTP_USERNAME / SMTP_PASSWORD is accepted. Tests can run it in-process:
+
+    server = DebugSMTPServer(port=0).start()   # port=0 picks a free port
+    ... server.port, server.messages ...
+    server.stop()
+"""
+import socket
+import socketserver
+import sys
+import threading
+from email import message_from_bytes
+from email.message import Message
+from typing import List, Optional
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    timeout = 300
+
+    def _reply(self, line: str) -> None:
+        self.wfile.write(line.encode("utf-8") + b"\r\n")
+
+    def _readline(self) -> Optional[str]:
+        line = self.rfile.readline(64 * 1024)
+        return line.decode("utf-8", "replace").rstrip("\r\n") if line else None
+
+    def _read_data(self) -> bytes:
+        lines = []
+        while True:
+            line = self.rfile.readline(1024 * 1024)
+            if not line or line.rstrip(b"\r\n") == b".":
+                return b"".join(lines)
+            lines.append(line[1:] if line.startswith(b"..") else line)
+
+    def handle(self) -> None:
+        server: "DebugSMTPServer" = self.server.owner
+        server.opened(self.connection)
+        sender, recipients = None, []
+        self._reply("220 debug-smtp ready")
+        while True:
+            line = self._readline()
+            if line is None:
+                return
+            verb, _, arg = line.partition(" ")
+            verb = verb.upper()
+            if verb == "EHLO":
+                self._reply("250-debug-smtp")
+                self._reply("250-8BITMIME")
+                self._reply("250 AUTH PLAIN LOGIN")
+            elif verb == "HELO":
+                self._reply("250 debug-smtp")
+            elif verb == "AUTH":
+                mechanism, _, initial = arg.partition(" ")
+                if mechanism.upper() == "LOGIN":
+                    for prompt in ("VXNlcm5hbWU6", "UGFzc3dvcmQ6"):  # "Username:", "Password:"
+                        if initial:
+                            initial = ""
+                            continue
+                        self._reply(f"334 {prompt}")
+                        if self._readline() is None:
+                            return
+                elif not initial:
+                    self._reply("334 ")
+                    if self._readline() is None:
+                        return
+                self._reply("235 Authentication successful")
+            elif verb == "MAIL":
+                sender, recipients = arg.partition(":")[2].strip().strip("<>"), []
+                self._reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(arg.partition(":")[2].strip().strip("<>"))
+                self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                server.received(sender, recipients, self._read_data())
+                sender, recipients = None, []
+                self._reply("250 OK: queued")
+            elif verb == "RSET":
+                sender, recipients = None, []
+                self._reply("250 OK")
+            elif verb == "NOOP":
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            elif verb == "STARTTLS":
+                self._reply("454 TLS not available (set SMTP_STARTTLS=false)")
+            else:
+                self._reply("502 Command not implemented")
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class DebugSMTPServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 1025, quiet: bool = False):
+        self._server = _TCPServer((host, port), _Handler)
+        self._server.owner = self
+        self.host = host
+        self.port = self._server.server_address[1]
+        self.quiet = quiet
+        self.messages: List[Message] = []
+        self.connections = 0
+        self._sockets: List[socket.socket] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def opened(self, sock: socket.socket) -> None:
+        with self._lock:
+            self.connections += 1
+            self._sockets.append(sock)
+
+    def received(self, sender: Optional[str], recipients: List[str], data: bytes) -> None:
+        message = message_from_bytes(data)
+        with self._lock:
+            self.messages.append(message)
+        if self.quiet:
+            return
+        payload = message.get_payload(decode=True)
+        body = payload.decode(message.get_content_charset() or "utf-8", "replace") if payload else message.get_payload()
+        print("-" * 60)
+        print(f"From: {sender}\nTo: {', '.join(recipients)}\nSubject: {message.get('Subject')}\n")
+        print(body)
+        sys.stdout.flush()
+
+    def start(self) -> "DebugSMTPServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="debug-smtp", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop listening and drop open connections, like a server going away."""
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            for sock in self._sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self._sockets.clear()
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1025
+    server = DebugSMTPServer(port=port)
+    print(f"[debug-smtp] Listening on {server.host}:{server.port}, Ctrl+C to stop")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
@@ -0,0 +1,436 @@
+"""
+Outgoing email: a persistent outbox (email_outbox table) drained by a
+background dispatcher.
+
+Request handlers only enqueue() a row in their own transaction and wake() the
+dispatcher, so provider latency and outages never reach the request. Each
+message goes out through the first configured transport that accepts it:
+
+1. Mailtrap API   MAILTRAP_API_TOKEN
+2. SendGrid API   SENDGRID_API_KEY
+3. SMTP           SMTP_SERVER, SMTP_PORT (default 587), SMTP_USERNAME and
+                  SMTP_PASSWORD (no login without them), SMTP_STARTTLS
+                  (default true)
+
+FROM_EMAIL is the sender. Without any transport, messages are printed to the
+console. The HTTP APIs share one pooled requests.Session; a batch goes over
+one SMTP connection, which stays open between batches for
+EMAIL_SMTP_IDLE_SECONDS (default 60) and is checked with NOOP before reuse.
+
+- EMAIL_BATCH_SIZE           messages claimed per round (default 20)
+- EMAIL_POLL_SECONDS         outbox poll interval when not woken (default 5)
+- EMAIL_MAX_ATTEMPTS         attempts before a message is marked failed (default 6)
+- EMAIL_RETRY_BASE_SECONDS   delay before the first retry, doubled on every
+                             further attempt, with jitter (default 15)
+- EMAIL_RETRY_MAX_SECONDS    longest retry delay (default 900)
+- EMAIL_CLAIM_LEASE_SECONDS  how long a claimed message is held by the round
+                             sending it (default 120)
+- EMAIL_RETENTION_HOURS      sent and failed rows are deleted after (default 72)
+
+A round claims due rows with one conditional UPDATE that moves their
+next_attempt_at past the lease, so several processes can drain the same outbox
+and rows held by a process that died are picked up again once the lease ends.
+
+debug_smtp.py is a local SMTP stand-in that prints what it receives.
+"""
+import random
+import secrets
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import delete, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from env_config import env_int, env_str
+from models import EmailOutbox
+
+MAILTRAP_URL = "https://sandbox.api.mailtrap.io/api/send"
+SENDGRID_URL = "https://api.sendgrid.com/v3/mail/send"
+HTTP_TIMEOUT_SECONDS = 30
+
+
+def enqueue(db: Session, to_email: str, subject: str, body: str, category: Optional[str] = None) -> EmailOutbox:
+    """Add a message to the outbox. It's sent after the caller commits (call wake() then)."""
+    message = EmailOutbox(
+        to_email=to_email,
+        subject=subject,
+        body=body,
+        category=category,
+        status="pending",
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(message)
+    return message
+
+
+class _Message:
+    """Plain copy of a claimed row, so no session is held while sending."""
+
+    def __init__(self, row: EmailOutbox):
+        self.id = row.id
+        self.to_email = row.to_email
+        self.subject = row.subject
+        self.body = row.body or ""
+        self.category = row.category
+        self.attempts = row.attempts
+        self.claim_token = row.claim_token
+
+
+class _HttpTransport:
+    def __init__(self, name: str, session: requests.Session, token: str, from_email: str):
+        self.name = name
+        self.session = session
+        self.token = token
+        self.from_email = from_email
+
+    def send(self, message: _Message) -> None:
+        headers = {"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"}
+        if self.name == "mailtrap":
+            url = MAILTRAP_URL
+            data = {
+                "to": [{"email": message.to_email}],
+                "from": {"email": self.from_email, "name": "PrimeStudio"},
+                "subject": message.subject,
+                "text": message.body,
+            }
+            if message.category:
+                data["category"] = message.category
+        else:
+            url = SENDGRID_URL
+            data = {
+                "personalizations": [{"to": [{"email": message.to_email}], "subject": message.subject}],
+                "from": {"email": self.from_email},
+                "content": [{"type": "text/plain", "value": message.body}],
+            }
+        response = self.session.post(url, headers=headers, json=data, timeout=HTTP_TIMEOUT_SECONDS)
+        response.raise_for_status()
+
+    def close(self) -> None:
+        pass
+
+
+class _SmtpTransport:
+    name = "smtp"
+
+    def __init__(self, server: str, port: int, username: Optional[str], password: Optional[str],
+                 starttls: bool, from_email: str, idle_seconds: int, stats: Dict[str, int],
+                 stats_lock: threading.Lock):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.from_email = from_email
+        self.idle_seconds = idle_seconds
+        self._stats = stats
+        self._stats_lock = stats_lock
+        self._conn: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self._checked = False
+
+    def begin_batch(self) -> None:
+        self._checked = False
+
+    def _connect(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(self.server, self.port, timeout=HTTP_TIMEOUT_SECONDS)
+        try:
+            if self.starttls:
+                conn.starttls()
+            if self.username and self.password:
+                conn.login(self.username, self.password)
+        except Exception:
+            conn.close()
+            raise
+        with self._stats_lock:
+            self._stats["smtp_connections"] += 1
+        return conn
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._conn is not None and not self._checked:
+            # Kept from an earlier batch: drop it when idle too long or the server hung up
+            alive = time.monotonic() - self._last_used < self.idle_seconds
+            if alive:
+                try:
+                    alive = self._conn.noop()[0] == 250
+                except (smtplib.SMTPException, OSError):
+                    alive = False
+            if not alive:
+                self.close()
+        if self._conn is None:
+            self._conn = self._connect()
+        self._checked = True
+        return self._conn
+
+    def send(self, message: _Message) -> None:
+        msg = MIMEText(message.body, "plain", "utf-8")
+        msg["From"] = self.from_email
+        msg["To"] = message.to_email
+        msg["Subject"] = message.subject
+        text = msg.as_string()
+        for retry in (False, True):
+            reused = self._conn is not None
+            conn = self._connection()
+            try:
+                conn.sendmail(self.from_email, [message.to_email], text)
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPResponseException:
+                # The server refused this message; the connection itself is still usable
+                try:
+                    conn.rset()
+                except (smtplib.SMTPException, OSError):
+                    self.close()
+                raise
+            except (smtplib.SMTPServerDisconnected, OSError):
+                self.close()
+                if retry or not reused:
+                    raise
+
+    def close(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._conn.quit()
+        except (smtplib.SMTPException, OSError):
+            self._conn.close()
+        self._conn = None
+
+
+class EmailDispatcher:
+    def __init__(self):
+        self.batch_size = max(1, env_int("EMAIL_BATCH_SIZE", 20))
+        self.poll_seconds = max(1, env_int("EMAIL_POLL_SECONDS", 5))
+        self.max_attempts = max(1, env_int("EMAIL_MAX_ATTEMPTS", 6))
+        self.retry_base_seconds = max(1, env_int("EMAIL_RETRY_BASE_SECONDS", 15))
+        self.retry_max_seconds = max(self.retry_base_seconds, env_int("EMAIL_RETRY_MAX_SECONDS", 900))
+        self.lease_seconds = max(10, env_int("EMAIL_CLAIM_LEASE_SECONDS", 120))
+        self.retention_seconds = max(1, env_int("EMAIL_RETENTION_HOURS", 72)) * 3600
+        self.smtp_idle_seconds = max(0, env_int("EMAIL_SMTP_IDLE_SECONDS", 60))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=2)
+        self.session.mount("https://", adapter)
+
+        self._run_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._transports: Optional[list] = None
+        self._last_purge = 0.0
+        self._stats = {
+            "sent": 0,
+            "retried": 0,
+            "failed": 0,
+            "batches": 0,
+            "smtp_connections": 0,
+        }
+        self.last_error: Optional[str] = None
+
+    def _build_transports(self) -> list:
+        transports = []
+        mailtrap_token = env_str("MAILTRAP_API_TOKEN")
+        if mailtrap_token:
+            transports.append(_HttpTransport("mailtrap", self.session, mailtrap_token,
+                                             env_str("FROM_EMAIL", "noreply@primestudio.ai")))
+        sendgrid_key = env_str("SENDGRID_API_KEY")
+        if sendgrid_key:
+            transports.append(_HttpTransport("sendgrid", self.session, sendgrid_key,
+                                             env_str("FROM_EMAIL", "noreply@primestudio.ai")))
+        smtp_server = env_str("SMTP_SERVER")
+        if smtp_server:
+            username = env_str("SMTP_USERNAME")
+            transports.append(_SmtpTransport(
+                smtp_server,
+                env_int("SMTP_PORT", 587),
+                username,
+                env_str("SMTP_PASSWORD"),
+                (env_str("SMTP_STARTTLS", "true") or "").lower() not in ("0", "false", "no", "off"),
+                env_str("FROM_EMAIL", username or "noreply@primestudio.ai"),
+                self.smtp_idle_seconds,
+                self._stats,
+                self._lock,
+            ))
+        if not transports:
+            print("[EMAIL] No email configuration found, messages are printed to the console.")
+            print("[EMAIL] To enable email sending, configure one of:")
+            print("[EMAIL] 1. Mailtrap: Set MAILTRAP_API_TOKEN and FROM_EMAIL in .env")
+            print("[EMAIL] 2. SendGrid: Set SENDGRID_API_KEY and FROM_EMAIL in .env")
+            print("[EMAIL] 3. SMTP: Set SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD in .env")
+        return transports
+
+    def _claim(self, db: Session) -> List[_Message]:
+        now = datetime.utcnow()
+        ids = [
+            row_id for (row_id,) in db.query(EmailOutbox.id)
+            .filter(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+            .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+            .limit(self.batch_size)
+        ]
+        if not ids:
+            return []
+        token = secrets.token_hex(8)
+        # Re-checks the due time, so a row another process claimed in the meantime is skipped
+        db.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.id.in_(ids), EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+            .values(
+                claim_token=token,
+                next_attempt_at=now + timedelta(seconds=self.lease_seconds),
+                attempts=EmailOutbox.attempts + 1,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        rows = db.query(EmailOutbox).filter(EmailOutbox.claim_token == token).order_by(EmailOutbox.id).all()
+        return [_Message(row) for row in rows]
+
+    def _send(self, message: _Message) -> Optional[str]:
+        """Name of the transport that took the message. Raises with every transport's error otherwise."""
+        if not self._transports:
+            print(f"[EMAIL] To {message.to_email}: {message.subject}\n{message.body}")
+            return "console"
+        errors = []
+        for transport in self._transports:
+            try:
+                transport.send(message)
+                return transport.name
+            except Exception as e:
+                errors.append(f"{transport.name}: {e}")
+        raise RuntimeError("; ".join(errors))
+
+    def _retry_delay(self, attempts: int) -> float:
+        delay = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** max(0, attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _purge(self, db: Session) -> None:
+        if time.monotonic() - self._last_purge < 600:
+            return
+        self._last_purge = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention_seconds)
+        db.execute(
+            delete(EmailOutbox)
+            .where(EmailOutbox.status.in_(("sent", "failed")), EmailOutbox.created_at < cutoff)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+
+    def run_once(self) -> int:
+        """Send one batch of due messages. Returns the number of messages claimed."""
+        with self._run_lock:
+            if self._transports is None:
+                self._transports = self._build_transports()
+            db = SessionLocal()
+            try:
+                self._purge(db)
+                messages = self._claim(db)
+                if not messages:
+                    return 0
+
+                for transport in self._transports:
+                    if isinstance(transport, _SmtpTransport):
+                        transport.begin_batch()
+                results = {}
+                for message in messages:
+                    try:
+                        results[message.id] = (self._send(message), None)
+                    except Exception as e:
+                        results[message.id] = (None, str(e)[:1000])
+
+                now = datetime.utcnow()
+                counts = {"sent": 0, "retried": 0, "failed": 0}
+                for message in messages:
+                    transport, error = results[message.id]
+                    if transport is not None:
+                        values = dict(status="sent", transport=transport, sent_at=now, body=None, last_error=None)
+                        outcome = "sent"
+                    elif message.attempts >= self.max_attempts:
+                        values = dict(status="failed", last_error=error)
+                        outcome = "failed"
+                    else:
+                        values = dict(
+                            next_attempt_at=now + timedelta(seconds=self._retry_delay(message.attempts)),
+                            last_error=error,
+                        )
+                        outcome = "retried"
+                    # Only while this round still holds the claim: once the lease ran out another
+                    # round may have claimed the row again, and its result is the one that counts
+                    result = db.execute(
+                        update(EmailOutbox)
+                        .where(EmailOutbox.id == message.id, EmailOutbox.claim_token == message.claim_token)
+                        .values(claim_token=None, **values)
+                        .execution_options(synchronize_session=False)
+                    )
+                    if result.rowcount != 1:
+                        print(f"[EMAIL] Claim on message {message.id} was lost before its result was saved")
+                        continue
+                    counts[outcome] += 1
+                    if outcome == "failed":
+                        print(f"[EMAIL] Giving up on message {message.id} to {message.to_email} "
+                              f"after {message.attempts} attempts: {error}")
+                    elif outcome == "retried":
+                        print(f"[EMAIL] Sending message {message.id} to {message.to_email} failed "
+                              f"(attempt {message.attempts}), will retry: {error}")
+                db.commit()
+
+                with self._lock:
+                    self._stats["batches"] += 1
+                    for name, n in counts.items():
+                        self._stats[name] += n
+                    if counts["retried"] or counts["failed"]:
+                        self.last_error = next(e for _, e in results.values() if e)
+                return len(messages)
+            finally:
+                db.close()
+
+    def wake(self) -> None:
+        """Look at the outbox now instead of at the next poll."""
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            claimed = 0
+            try:
+                claimed = self.run_once()
+            except Exception as e:
+                print(f"[EMAIL] Outbox dispatch failed: {e}")
+            if claimed < self.batch_size:
+                # A full batch means more may be due: go again right away
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+        with self._run_lock:
+            for transport in self._transports or ():
+                transport.close()
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="email-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        return dict(
+            stats,
+            transports=[t.name for t in self._transports] if self._transports is not None else None,
+            batch_size=self.batch_size,
+            max_attempts=self.max_attempts,
+            last_error=self.last_error,
+        )
+
+
+email_dispatcher = EmailDispatcher()
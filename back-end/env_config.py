@@ -0,0 +1,34 @@
+"""
+Settings read from the environment. Values may be quoted (KEY="value"), as
+they often are in .env files and hosting dashboards; unset, empty or
+unparsable values give the default.
+"""
+import os
+from typing import Optional
+
+
+def env_str(name: str, default: Optional[str] = None) -> Optional[str]:
+    v = os.getenv(name)
+    if v:
+        v = v.strip().strip('"').strip("'")
+    return v or default
+
+
+def env_int(name: str, default: int) -> int:
+    v = env_str(name)
+    if not v:
+        return default
+    try:
+        return int(v)
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    v = env_str(name)
+    if not v:
+        return default
+    try:
+        return float(v)
+    except ValueError:
+        return default
@@ -0,0 +1,163 @@
+"""
+Uploaded reference images ("assets").
+
+POST /assets/images streams a multipart upload into the blob store once and
+returns an asset ID. Generation requests then reference the image as
+"asset:<asset_id>" in image_urls / image_url / image_url2 instead of sending a
+base64 data URL every time.
+
+- MEDIA_ASSET_MAX_MB   largest accepted upload (default 20)
+
+Uploading the same content again returns the user's existing asset.
+Assets expire with the same max age as other stored media.
+"""
+import os
+import secrets
+from dataclasses import dataclass
+from datetime import datetime
+from typing import BinaryIO, Iterator, Optional
+
+from sqlalchemy.orm import Session
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    Image = None
+    PIL_AVAILABLE = False
+
+import media_blobs
+from env_config import env_int
+from media_cache import media_cache
+from media_storage import storage_for_location
+from models import ImageAsset
+
+ASSET_REF_PREFIX = "asset:"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+_FORMATS = {
+    "JPEG": (".jpg", "image/jpeg"),
+    "PNG": (".png", "image/png"),
+    "WEBP": (".webp", "image/webp"),
+    "GIF": (".gif", "image/gif"),
+}
+
+
+def max_upload_bytes() -> int:
+    return max(1, env_int("MEDIA_ASSET_MAX_MB", 20)) * 1024 * 1024
+
+
+class AssetError(ValueError):
+    """Upload rejected (too large, not an image, ...)."""
+
+
+class AssetTooLarge(AssetError):
+    pass
+
+
+@dataclass
+class ResolvedImage:
+    """An asset reference checked against its owner, ready to be read by the provider helpers."""
+    asset_id: str
+    sha256: str
+    location: str
+    content_type: Optional[str]
+    width: Optional[int]
+    height: Optional[int]
+
+    @property
+    def suffix(self) -> str:
+        return os.path.splitext(self.location)[1] or ".png"
+
+    def read(self) -> bytes:
+        with storage_for_location(self.location).open(self.location) as f:
+            return f.read()
+
+
+def is_asset_ref(value) -> bool:
+    return isinstance(value, str) and value.strip().startswith(ASSET_REF_PREFIX)
+
+
+def _chunks(fileobj: BinaryIO, limit: int) -> Iterator[bytes]:
+    total = 0
+    while True:
+        chunk = fileobj.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        total += len(chunk)
+        if total > limit:
+            raise AssetTooLarge(f"Image is larger than {limit // (1024 * 1024)} MB")
+        yield chunk
+
+
+def store_upload(db: Session, user_id: int, fileobj: BinaryIO) -> ImageAsset:
+    """
+    Stream an uploaded file into the blob store and return its ImageAsset.
+    Raises AssetError for oversized or non-image uploads.
+    """
+    tmp_path, sha256, size = media_blobs.write_temp_blob(_chunks(fileobj, max_upload_bytes()))
+    try:
+        if size == 0:
+            raise AssetError("Empty upload")
+        if not PIL_AVAILABLE:
+            raise AssetError("Image uploads need Pillow on the server")
+        try:
+            # Header only: Image.open doesn't decode the pixels
+            with Image.open(tmp_path) as img:
+                fmt = img.format
+                width, height = img.size
+        except Exception:
+            raise AssetError("Uploaded file is not a readable image")
+        if fmt not in _FORMATS:
+            raise AssetError(f"Unsupported image format {fmt}. Use JPEG, PNG, WEBP or GIF.")
+    except Exception:
+        media_blobs.discard_temp(tmp_path)
+        raise
+
+    existing = db.query(ImageAsset).filter(
+        ImageAsset.user_id == user_id,
+        ImageAsset.blob_sha256 == sha256,
+        ImageAsset.expires_at > datetime.utcnow(),
+    ).first()
+    if existing:
+        media_blobs.discard_temp(tmp_path)
+        return existing
+
+    ext, content_type = _FORMATS[fmt]
+    blob = media_blobs.commit_blob(db, tmp_path, sha256, size, ext=ext, content_type=content_type)
+    asset = ImageAsset(
+        asset_id=secrets.token_urlsafe(16),
+        user_id=user_id,
+        file_path=blob.file_path,
+        file_size=blob.file_size,
+        blob_sha256=blob.sha256,
+        content_type=content_type,
+        width=width,
+        height=height,
+        expires_at=media_cache.expires_at(),
+    )
+    db.add(asset)
+    db.commit()
+    db.refresh(asset)
+    print(f"[Assets] Stored {asset.asset_id} for user {user_id}: {fmt} {width}x{height}, {size} bytes")
+    return asset
+
+
+def resolve(db: Session, user_id: int, ref: str) -> Optional[ResolvedImage]:
+    """The user's non-expired asset for an "asset:<id>" reference, or None."""
+    asset_id = ref.strip()[len(ASSET_REF_PREFIX):]
+    asset = db.query(ImageAsset).filter(
+        ImageAsset.asset_id == asset_id,
+        ImageAsset.user_id == user_id,
+        ImageAsset.expires_at > datetime.utcnow(),
+    ).first()
+    if asset is None:
+        return None
+    return ResolvedImage(
+        asset_id=asset.asset_id,
+        sha256=asset.blob_sha256,
+        location=asset.file_path,
+        content_type=asset.content_type,
+        width=asset.width,
+        height=asset.height,
+    )
@@ -0,0 +1,230 @@
+"""
+Content-hash cache of preprocessed reference images.
+
+Users iterate on prompts with the same reference image, so the
+ready-to-upload bytes (resized PNG for Sora2, base64 for Kling) are cached
+under sha256(source) x variant, where the source is the image content or,
+for remote images, the URL:
+
+- memory tier: LRU bounded in bytes (MEDIA_IMAGE_CACHE_MEMORY_MB, default 64)
+- disk tier:   storage/cache/images, bounded in bytes (MEDIA_IMAGE_CACHE_DISK_MB,
+               default 512), least recently used files are removed first
+
+Entries keyed by content never go stale. Entries keyed by URL are kept for
+MEDIA_IMAGE_CACHE_URL_TTL_SECONDS (default 3600) since the remote image can
+change. Hit/miss counters are exposed through /debug/metrics.
+"""
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional
+from uuid import uuid4
+
+from env_config import env_int
+from media_storage import STORAGE_ROOT
+
+CACHE_DIR = STORAGE_ROOT / "cache" / "images"
+
+
+@dataclass
+class CachedImage:
+    data: bytes
+    meta: Dict[str, Any] = field(default_factory=dict)  # e.g. format, width, height
+    expires_at: Optional[float] = None  # unix time, None = never
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at < time.time()
+
+
+def content_source(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def url_source(url: str) -> str:
+    return "url:" + hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+class PreparedImageCache:
+    def __init__(self, cache_dir: Path = CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.memory_max_bytes = max(0, env_int("MEDIA_IMAGE_CACHE_MEMORY_MB", 64)) * 1024 * 1024
+        self.disk_max_bytes = max(0, env_int("MEDIA_IMAGE_CACHE_DISK_MB", 512)) * 1024 * 1024
+        self.url_ttl_seconds = max(0, env_int("MEDIA_IMAGE_CACHE_URL_TTL_SECONDS", 3600))
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, CachedImage]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes: Optional[int] = None  # computed on first disk write
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(source: str, variant: str) -> str:
+        """Cache key for a source (see content_source / url_source) prepared as `variant`."""
+        return hashlib.sha256(f"{source}|{variant}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.bin"
+
+    # ---- memory tier ----
+
+    def _remember(self, key: str, entry: CachedImage) -> None:
+        size = len(entry.data)
+        if size > self.memory_max_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= len(old.data)
+            self._memory[key] = entry
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_max_bytes and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted.data)
+                self.evictions += 1
+
+    # ---- disk tier ----
+    # File layout: 4-byte big-endian header length, JSON header, payload
+
+    def _read_disk(self, key: str) -> Optional[CachedImage]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                (header_len,) = struct.unpack(">I", f.read(4))
+                header = json.loads(f.read(header_len))
+                data = f.read()
+        except (OSError, ValueError, struct.error):
+            return None
+        entry = CachedImage(data, header.get("meta") or {}, header.get("expires_at"))
+        if entry.expired:
+            self._unlink(path)
+            return None
+        try:
+            os.utime(path)  # mtime doubles as the disk tier's LRU clock
+        except OSError:
+            pass
+        return entry
+
+    def _write_disk(self, key: str, entry: CachedImage) -> None:
+        if len(entry.data) > self.disk_max_bytes:
+            return
+        path = self._path(key)
+        header = json.dumps({"meta": entry.meta, "expires_at": entry.expires_at}).encode("utf-8")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{uuid4().hex}.tmp")
+            with open(tmp, "wb") as f:
+                f.write(struct.pack(">I", len(header)))
+                f.write(header)
+                f.write(entry.data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[ImageCache] Could not write {path}: {e}")
+            return
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_bytes()
+            else:
+                self._disk_bytes += path.stat().st_size
+            over = self._disk_bytes > self.disk_max_bytes
+        if over:
+            self._evict_disk()
+
+    def _scan_disk_bytes(self) -> int:
+        total = 0
+        for path in self.cache_dir.glob("*/*.bin"):
+            try:
+                total += path.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def _unlink(self, path: Path) -> int:
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except OSError:
+            return 0
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes -= size
+        return size
+
+    def _evict_disk(self) -> None:
+        """Remove least recently used files until the disk tier is below 90% of its budget."""
+        files = []
+        for path in self.cache_dir.glob("*/*.bin"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        target = int(self.disk_max_bytes * 0.9)
+        for _, size, path in files:
+            if total <= target:
+                break
+            if self._unlink(path):
+                total -= size
+                self.evictions += 1
+        with self._lock:
+            self._disk_bytes = total
+
+    # ---- public API ----
+
+    def get(self, key: str) -> Optional[CachedImage]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not entry.expired:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry
+        if entry is not None:
+            with self._lock:
+                if self._memory.get(key) is entry:
+                    del self._memory[key]
+                    self._memory_bytes -= len(entry.data)
+
+        entry = self._read_disk(key)
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, data: bytes, meta: Optional[Dict[str, Any]] = None, ttl_seconds: Optional[int] = None) -> None:
+        entry = CachedImage(data, dict(meta or {}), time.time() + ttl_seconds if ttl_seconds else None)
+        self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_max_bytes": self.memory_max_bytes,
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes,
+            }
+
+
+prepared_image_cache = PreparedImageCache()
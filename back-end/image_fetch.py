@@ -0,0 +1,184 @@
+"""
+Fetching of remote reference images (http/https image inputs).
+
+- one pooled requests.Session (MEDIA_IMAGE_FETCH_POOL_SIZE connections per
+  host, default 8), so repeated fetches reuse keep-alive connections
+- MEDIA_IMAGE_FETCH_MAX_MB           largest accepted image (default 20), checked
+                                     against Content-Length and while streaming
+- MEDIA_IMAGE_FETCH_TIMEOUT_SECONDS  connect / read timeout (default 30)
+
+fetch_base64() encodes the body to base64 while it streams in and keeps the
+result in the prepared-image cache together with the response's validators.
+It is reused for as long as the response's Cache-Control max-age / Expires
+allow (without either, MEDIA_IMAGE_CACHE_URL_TTL_SECONDS), then revalidated
+with If-None-Match / If-Modified-Since: a 304 only refreshes the entry.
+Responses marked no-store are not cached. Concurrent fetches of the same URL
+wait for the first one.
+"""
+import base64
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from env_config import env_int
+from image_cache import prepared_image_cache, url_source
+
+CHUNK_SIZE = 192 * 1024  # multiple of 3, so every chunk encodes to base64 without padding
+BASE64_VARIANT = "kling:base64"
+
+
+class ImageFetchError(ValueError):
+    """The image could not be fetched (upstream error, too large, ...)."""
+
+
+def _freshness_seconds(resp: requests.Response, default: int) -> Optional[int]:
+    """How long a response may be reused without revalidation; None = must not be stored."""
+    cache_control = [d.strip().lower() for d in resp.headers.get("Cache-Control", "").split(",")]
+    if "no-store" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return 0
+    for directive in cache_control:
+        if directive.startswith("max-age="):
+            value = directive[len("max-age="):].strip('"')
+            return int(value) if value.isdigit() else 0
+    expires = resp.headers.get("Expires")
+    if expires:
+        try:
+            return max(0, int(parsedate_to_datetime(expires).timestamp() - time.time()))
+        except (TypeError, ValueError):
+            return 0
+    return default
+
+
+class RemoteImageFetcher:
+    def __init__(self):
+        self.pool_size = max(1, env_int("MEDIA_IMAGE_FETCH_POOL_SIZE", 8))
+        self.max_bytes = max(1, env_int("MEDIA_IMAGE_FETCH_MAX_MB", 20)) * 1024 * 1024
+        self.timeout_seconds = max(1, env_int("MEDIA_IMAGE_FETCH_TIMEOUT_SECONDS", 30))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._url_locks: Dict[str, list] = {}  # key -> [lock, holders + waiters]
+        self._stats = {
+            "fresh_hits": 0,
+            "revalidated": 0,  # 304 Not Modified
+            "fetched": 0,
+            "bytes_fetched": 0,
+            "rejected_too_large": 0,
+            "errors": 0,
+        }
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += n
+
+    @contextmanager
+    def _url_lock(self, key: str):
+        """Per-URL lock, dropped when its last holder or waiter leaves (URLs are arbitrary user input)."""
+        with self._lock:
+            entry = self._url_locks.get(key)
+            if entry is None:
+                entry = self._url_locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._url_locks[key]
+
+    def _too_large(self) -> ImageFetchError:
+        self._count("rejected_too_large")
+        return ImageFetchError(f"Image at URL is larger than {self.max_bytes // (1024 * 1024)} MB")
+
+    def _get(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        try:
+            resp = self.session.get(url, headers=headers, timeout=self.timeout_seconds, stream=True)
+        except requests.exceptions.RequestException as e:
+            self._count("errors")
+            raise ImageFetchError(f"Failed to download image from URL: {e}")
+        if resp.status_code >= 400:
+            resp.close()
+            self._count("errors")
+            raise ImageFetchError(f"Failed to download image from URL: status {resp.status_code}")
+        length = resp.headers.get("Content-Length", "")
+        if length.isdigit() and int(length) > self.max_bytes:
+            resp.close()
+            raise self._too_large()
+        return resp
+
+    def _read_base64(self, resp: requests.Response) -> bytes:
+        parts = []
+        carry = b""
+        total = 0
+        try:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                total += len(chunk)
+                if total > self.max_bytes:
+                    raise self._too_large()
+                data = carry + chunk
+                cut = len(data) - len(data) % 3
+                parts.append(base64.b64encode(data[:cut]))
+                carry = data[cut:]
+        except requests.exceptions.RequestException as e:
+            self._count("errors")
+            raise ImageFetchError(f"Failed to download image from URL: {e}")
+        finally:
+            resp.close()
+        parts.append(base64.b64encode(carry))
+        self._count("fetched")
+        self._count("bytes_fetched", total)
+        return b"".join(parts)
+
+    def fetch_base64(self, url: str) -> str:
+        """The image at url as a base64 string, from the cache while it's fresh or still valid upstream."""
+        cache_key = prepared_image_cache.key(url_source(url), BASE64_VARIANT)
+        with self._url_lock(cache_key):
+            cached = prepared_image_cache.get(cache_key)
+            meta = cached.meta if cached is not None else {}
+            if cached is not None and meta.get("fresh_until", 0) > time.time():
+                self._count("fresh_hits")
+                return cached.data.decode("ascii")
+
+            headers = {}
+            if cached is not None and meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if cached is not None and meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+            resp = self._get(url, headers or None)
+
+            if resp.status_code == 304 and cached is not None:
+                resp.close()
+                self._count("revalidated")
+                data = cached.data
+            else:
+                data = self._read_base64(resp)
+                meta = {
+                    "etag": resp.headers.get("ETag"),
+                    "last_modified": resp.headers.get("Last-Modified"),
+                }
+
+            fresh_for = _freshness_seconds(resp, prepared_image_cache.url_ttl_seconds)
+            if fresh_for is not None and (fresh_for > 0 or meta.get("etag") or meta.get("last_modified")):
+                meta["fresh_until"] = time.time() + fresh_for
+                prepared_image_cache.put(cache_key, data, meta)
+            return data.decode("ascii")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, max_bytes=self.max_bytes, pool_size=self.pool_size, url_locks=len(self._url_locks))
+
+
+image_fetcher = RemoteImageFetcher()
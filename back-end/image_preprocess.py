@@ -0,0 +1,217 @@
+"""
+Reference-image preprocessing off the request threads.
+
+Decoding, resizing and re-encoding large uploads with Pillow is CPU bound
+and mostly runs under the GIL, so doing it inline stalls every other request
+in the worker. The work is shipped to a bounded ProcessPoolExecutor instead:
+
+- MEDIA_IMAGE_PROCESS_WORKERS          worker processes (default: CPU count, max 4)
+- MEDIA_IMAGE_PROCESS_MAX_PENDING      submitted-but-unfinished jobs before new
+                                       ones are rejected with ImagePoolBusy
+                                       (default 4 x workers)
+- MEDIA_IMAGE_PROCESS_TIMEOUT_SECONDS  max wait for one job (default 30)
+
+Workers are started with "spawn" (forking a process that already runs
+threads can deadlock) and only import this module and Pillow.
+
+Images that already have the target size are detected from the header on the
+calling thread and never reach the pool. Large JPEGs are decoded at a reduced
+DCT scale (draft mode, never below the target size) and the result is
+pre-shrunk with reduce() so the final LANCZOS pass covers at most
+MEDIA_IMAGE_REDUCING_GAP x the target (default 2; 0 disables both). PNG output
+uses zlib level MEDIA_IMAGE_PNG_COMPRESS_LEVEL (default 1): the bytes are
+uploaded once, so encode time matters more than a few percent of size.
+"""
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from env_config import env_int
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    Image = None
+    PIL_AVAILABLE = False
+
+
+class ImagePoolBusy(RuntimeError):
+    """Too many images are already waiting for a worker."""
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    format: str  # Pillow format name of `data` (PNG, JPEG, ...)
+    width: int
+    height: int
+    original_width: int
+    original_height: int
+    resized: bool
+    queue_ms: float = 0.0  # submit -> a worker picked it up
+    process_ms: float = 0.0  # time spent in the worker
+
+
+def _reducing_gap() -> Optional[float]:
+    gap = env_int("MEDIA_IMAGE_REDUCING_GAP", 2)
+    return float(gap) if gap > 0 else None
+
+
+def _png_compress_level() -> int:
+    return min(9, max(0, env_int("MEDIA_IMAGE_PNG_COMPRESS_LEVEL", 1)))
+
+
+def probe(data: bytes) -> Tuple[str, int, int]:
+    """(Pillow format, width, height) read from the image header; the pixels are not decoded."""
+    with Image.open(io.BytesIO(data)) as img:
+        return img.format or "", img.width, img.height
+
+
+def fit_exact(data: bytes, width: int, height: int, submitted_at: Optional[float] = None) -> PreparedImage:
+    """
+    Resize an encoded image to exactly width x height (LANCZOS, re-encoded as PNG).
+    Images that already have that size are returned untouched without a full decode.
+    Runs inside a pool worker.
+    """
+    started = time.time()
+    with Image.open(io.BytesIO(data)) as img:
+        fmt = img.format or "PNG"
+        original_width, original_height = img.size
+        if (original_width, original_height) == (width, height):
+            result = PreparedImage(data, fmt, width, height, original_width, original_height, resized=False)
+        else:
+            gap = _reducing_gap()
+            if gap and fmt == "JPEG":
+                # Let libjpeg decode at 1/2, 1/4 or 1/8 scale while staying >= the target size
+                img.draft(None, (width, height))
+            # reducing_gap: reduce() by an integer factor first, LANCZOS only over the last <= gap x step
+            resized = img.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=gap)
+            output = io.BytesIO()
+            resized.save(output, format="PNG", compress_level=_png_compress_level())
+            result = PreparedImage(output.getvalue(), "PNG", width, height, original_width, original_height, resized=True)
+    result.queue_ms = max(0.0, (started - submitted_at) * 1000) if submitted_at else 0.0
+    result.process_ms = (time.time() - started) * 1000
+    return result
+
+
+class ImagePreprocessPool:
+    def __init__(self):
+        self.workers = max(1, env_int("MEDIA_IMAGE_PROCESS_WORKERS", min(4, os.cpu_count() or 1)))
+        self.max_pending = max(1, env_int("MEDIA_IMAGE_PROCESS_MAX_PENDING", 4 * self.workers))
+        self.timeout_seconds = max(1, env_int("MEDIA_IMAGE_PROCESS_TIMEOUT_SECONDS", 30))
+
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._stats = {
+            "submitted": 0,
+            "passthrough": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "in_flight": 0,
+            "queue_ms_total": 0.0,
+            "queue_ms_max": 0.0,
+            "process_ms_total": 0.0,
+            "process_ms_max": 0.0,
+        }
+
+    def start(self) -> ProcessPoolExecutor:
+        """Create the worker processes (idempotent; also done lazily on first use)."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def fit_exact(self, data: bytes, width: int, height: int) -> PreparedImage:
+        """
+        Run fit_exact() in a worker and wait for it. Images that already have the
+        target size (checked from the header) are returned right away.
+        Raises ImagePoolBusy when max_pending jobs are already queued or running.
+        """
+        try:
+            fmt, original_width, original_height = probe(data)
+        except Exception:
+            fmt, original_width, original_height = "", None, None  # let the worker report the error
+        if (original_width, original_height) == (width, height):
+            with self._lock:
+                self._stats["passthrough"] += 1
+            return PreparedImage(data, fmt or "PNG", width, height, width, height, resized=False)
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise ImagePoolBusy(f"Image processing queue is full ({self.max_pending} pending)")
+        with self._lock:
+            self._stats["submitted"] += 1
+            self._stats["in_flight"] += 1
+        try:
+            future = self.start().submit(fit_exact, data, width, height, time.time())
+        except Exception:
+            self._job_done(None)
+            raise
+        # The slot is held until the worker is done with the job, not until we stop waiting:
+        # a job that timed out keeps its worker busy and still counts against max_pending
+        future.add_done_callback(self._job_done)
+        try:
+            result = future.result(timeout=self.timeout_seconds)
+        except Exception as e:
+            future.cancel()
+            with self._lock:
+                self._stats["failed"] += 1
+            if isinstance(e, BrokenProcessPool):
+                # A worker died (e.g. OOM on a huge image); start fresh processes next time
+                self.shutdown()
+            raise
+        with self._lock:
+            s = self._stats
+            s["completed"] += 1
+            s["queue_ms_total"] += result.queue_ms
+            s["queue_ms_max"] = max(s["queue_ms_max"], result.queue_ms)
+            s["process_ms_total"] += result.process_ms
+            s["process_ms_max"] = max(s["process_ms_max"], result.process_ms)
+        return result
+
+    def _job_done(self, future) -> None:
+        with self._lock:
+            self._stats["in_flight"] -= 1
+        self._slots.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+        done = s["completed"] or 1
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "started": self._executor is not None,
+            "submitted": s["submitted"],
+            "passthrough": s["passthrough"],
+            "completed": s["completed"],
+            "failed": s["failed"],
+            "rejected": s["rejected"],
+            "in_flight": s["in_flight"],
+            "queue_ms_avg": round(s["queue_ms_total"] / done, 2),
+            "queue_ms_max": round(s["queue_ms_max"], 2),
+            "process_ms_avg": round(s["process_ms_total"] / done, 2),
+            "process_ms_max": round(s["process_ms_max"], 2),
+        }
+
+
+image_pool = ImagePreprocessPool()
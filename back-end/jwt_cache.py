@@ -0,0 +1,76 @@
+"""
+Cache of verified JWT claims.
+
+Polling clients send the same access token hundreds of times, and each
+jwt.decode() base64-decodes, parses JSON and checks the HMAC again. Claims
+that verified once are kept under sha256(token) until the token's own exp,
+so a repeat only costs a digest and a dict lookup.
+
+- AUTH_TOKEN_CACHE_SIZE   max cached tokens, least recently used are dropped
+                          first (default 10000)
+
+Tokens without an exp claim are never cached.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from env_config import env_int
+
+
+def _digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+class TokenClaimsCache:
+    def __init__(self):
+        self.max_entries = max(0, env_int("AUTH_TOKEN_CACHE_SIZE", 10000))
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """Claims of a token verified earlier and not expired yet, otherwise None."""
+        key = _digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]  # expired: let jwt.decode report it
+            self.misses += 1
+        return None
+
+    def put(self, token: str, claims: Dict[str, Any]) -> None:
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)) or not self.max_entries:
+            return
+        key = _digest(token)
+        with self._lock:
+            self._entries[key] = (float(exp), claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+token_claims_cache = TokenClaimsCache()
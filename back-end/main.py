@@ -1,38 +1,29 @@
 import os
 import base64
-import io
-import tempfile
 import secrets
 import hashlib
+import hmac
+import threading
+import time
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any, List
 from uuid import uuid4
 
-try:
-    from PIL import Image
-    PIL_AVAILABLE = True
-    print("[Sora2] PIL/Pillow is available. Image resizing enabled.")
-except ImportError:
-    PIL_AVAILABLE = False
-    print("[Sora2] WARNING: PIL/Pillow not available. Image resizing will be skipped.")
-    print("[Sora2] Please install Pillow: pip install Pillow>=10.0.0")
-
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Query, Header
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Query, Header, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi.responses import RedirectResponse, StreamingResponse, Response
 from pydantic import BaseModel, EmailStr
 from sqlalchemy import Column, Integer, String, DateTime, Text, func
 from sqlalchemy.orm import Session
 from passlib.context import CryptContext
-import bcrypt
 from jose import JWTError, jwt
 import requests
 from urllib.parse import urlencode
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from email.utils import format_datetime, parsedate_to_datetime
 
 try:
     from dotenv import load_dotenv
@@ -48,11 +39,40 @@ if load_dotenv:
 # Database configuration
 # ==============================
 # Import database configuration first
-from database import get_db, engine, Base, init_db
+from database import get_db, engine, Base, init_db, SessionLocal
+from env_config import env_int
 
 # Import all models - this registers them with Base.metadata
 # IMPORTANT: Models must be imported before init_db() is called
-from models import User, UserCoinBalance, CoinTopUpTx, StoredVideo
+from models import User, UserCoinBalance, CoinTopUpTx, StoredVideo, StoredImage, MediaBlob
+import media_blobs
+from media_storage import storage_for_location, disk_free_bytes
+from media_cache import media_cache
+from media_cleanup import cleanup_service
+from media_reconcile import reconciler
+import mp4_faststart
+import media_fetch
+import media_images
+from image_preprocess import image_pool, ImagePoolBusy, PIL_AVAILABLE
+from image_cache import prepared_image_cache, content_source, url_source
+from image_fetch import image_fetcher
+import image_assets
+from image_assets import ResolvedImage
+import request_body
+from request_body import BodyLimitMiddleware, SpooledImage
+from password_hashing import password_hasher, PasswordHasherBusy
+from user_cache import user_cache
+from jwt_cache import token_claims_cache
+import email_outbox
+from email_outbox import email_dispatcher
+from rate_limit import rate_limiter, RateLimited
+
+# Images are decoded and resized in image_preprocess's worker pool, not here
+if PIL_AVAILABLE:
+    print("[Sora2] PIL/Pillow is available. Image resizing enabled.")
+else:
+    print("[Sora2] WARNING: PIL/Pillow not available. Image resizing will be skipped.")
+    print("[Sora2] Please install Pillow: pip install Pillow>=10.0.0")
 
 # Verify models are registered
 print(f"[MAIN] Models imported. Base.metadata.tables: {list(Base.metadata.tables.keys())}")
@@ -73,7 +93,8 @@ except Exception as e:
 # Security configuration
 # ==============================
 
-# Using pure bcrypt with SHA-256 pre-hashing for maximum reliability
+# Using pure bcrypt with SHA-256 pre-hashing for maximum reliability,
+# on a dedicated bounded executor with a calibrated cost (password_hashing.py)
 
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "CHANGE_ME_TO_A_RANDOM_SECRET")
 ALGORITHM = "HS256"
@@ -82,30 +103,47 @@ RESET_TOKEN_EXPIRE_MINUTES = 60  # 1 hour
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 
+def _password_hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many sign-in attempts right now, please retry in a few seconds",
+        headers={"Retry-After": "2"},
+    )
+
+
+def _enforce_rate_limit(request: Request, scope: str, account: Optional[str] = None) -> None:
+    """429 when the client IP or the account is over its limit for scope (rate_limit.py)."""
+    try:
+        rate_limiter.check(scope, request, account)
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Too many attempts, please retry in {e.retry_after} seconds",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
 def hash_password(password: str) -> str:
     """
     Hash password dengan pure bcrypt untuk maximum reliability.
     SHA-256 dulu, lalu bcrypt - menghindari 72-byte limit sepenuhnya.
+    Raises 429 when the hashing queue is full.
     """
-    # Always hash with SHA-256 first (produces 64 chars, safe for bcrypt)
-    sha256_hash = hashlib.sha256(password.encode('utf-8')).hexdigest()
-
-    # Use pure bcrypt for maximum reliability
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(sha256_hash.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
+    try:
+        return password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise _password_hashing_busy()
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     Verify password dengan pure bcrypt.
+    Raises 429 when the hashing queue is full.
     """
     try:
-        # Hash plain password with SHA-256 first, then verify with bcrypt
-        sha256_hash = hashlib.sha256(plain_password.encode('utf-8')).hexdigest()
-        return bcrypt.checkpw(sha256_hash.encode('utf-8'), hashed_password.encode('utf-8'))
-    except Exception:
-        return False
+        return password_hasher.verify(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise _password_hashing_busy()
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -128,175 +166,23 @@ def generate_reset_code() -> str:
     return ''.join([str(random.randint(0, 9)) for _ in range(6)])
 
 
-def send_reset_code_email(to_email: str, reset_code: str):
+def queue_reset_code_email(db: Session, to_email: str, reset_code: str):
     """
-    Send reset code via email.
-    Supports multiple email services for development and production.
+    Add the reset code email to the outbox; it's sent by the email dispatcher
+    (email_outbox.py) once the caller commits.
     """
-    import smtplib
-    from email.mime.text import MIMEText
-    from email.mime.multipart import MIMEMultipart
-
-    # Try different email configurations
-    email_configs = []
-
-    # 1. Check for Mailtrap API
-    mailtrap_api_token = os.getenv("MAILTRAP_API_TOKEN")
-    if mailtrap_api_token:
-        email_configs.append({
-            'type': 'mailtrap',
-            'api_token': mailtrap_api_token,
-            'from_email': os.getenv("FROM_EMAIL", "noreply@primestudio.ai")
-        })
-
-    # 2. Check for SendGrid API
-    sendgrid_key = os.getenv("SENDGRID_API_KEY")
-    if sendgrid_key:
-        email_configs.append({
-            'type': 'sendgrid',
-            'api_key': sendgrid_key,
-            'from_email': os.getenv("FROM_EMAIL", "noreply@primestudio.ai")
-        })
-
-    # 3. Check for SMTP configuration (works with Mailtrap SMTP too)
-    smtp_server = os.getenv("SMTP_SERVER")
-    smtp_port = os.getenv("SMTP_PORT", "587")
-    smtp_username = os.getenv("SMTP_USERNAME")
-    smtp_password = os.getenv("SMTP_PASSWORD")
-
-    if smtp_server and smtp_username and smtp_password:
-        email_configs.append({
-            'type': 'smtp',
-            'server': smtp_server,
-            'port': int(smtp_port),
-            'username': smtp_username,
-            'password': smtp_password,
-            'from_email': os.getenv("FROM_EMAIL", smtp_username)
-        })
-
-    # 4. Fallback: Console logging for development
-    if not email_configs:
-        print(f"[EMAIL] No email configuration found. Reset code for {to_email}: {reset_code}")
-        print(f"[EMAIL] To enable email sending, configure one of:")
-        print(f"[EMAIL] 1. Mailtrap: Set MAILTRAP_API_TOKEN and FROM_EMAIL in .env")
-        print(f"[EMAIL] 2. SendGrid: Set SENDGRID_API_KEY and FROM_EMAIL in .env")
-        print(f"[EMAIL] 3. SMTP: Set SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD in .env")
-        return
-
-    # Try each email configuration
-    for config in email_configs:
-        try:
-            if config['type'] == 'mailtrap':
-                send_via_mailtrap(config, to_email, reset_code)
-                print(f"[EMAIL] Reset code sent via Mailtrap to {to_email}")
-                return
-
-            elif config['type'] == 'sendgrid':
-                send_via_sendgrid(config, to_email, reset_code)
-                print(f"[EMAIL] Reset code sent via SendGrid to {to_email}")
-                return
-
-            elif config['type'] == 'smtp':
-                send_via_smtp(config, to_email, reset_code)
-                print(f"[EMAIL] Reset code sent via SMTP to {to_email}")
-                return
-
-        except Exception as e:
-            print(f"[EMAIL] Failed to send via {config['type']}: {e}")
-            continue
-
-    # If all methods fail, fall back to console
-    print(f"[EMAIL] All email methods failed. Reset code for {to_email}: {reset_code}")
-
-
-def send_via_mailtrap(config: dict, to_email: str, reset_code: str):
-    """Send email via Mailtrap API"""
-    import requests
-
-    # Mailtrap API endpoint - sesuai dokumentasi
-    url = "https://sandbox.api.mailtrap.io/api/send"
-
-    headers = {
-        "Authorization": f"Bearer {config['api_token']}",
-        "Content-Type": "application/json"
-    }
-
-    data = {
-        "to": [{"email": to_email}],
-        "from": {"email": config['from_email'], "name": "PrimeStudio"},
-        "subject": "PrimeStudio Password Reset Code",
-        "text": f"""Hello,
-
-Your password reset code is: {reset_code}
-
-This code will expire in 15 minutes.
-
-If you didn't request this password reset, please ignore this email.
-
-Best regards,
-PrimeStudio Team
-""",
-        "category": "password-reset"
-    }
-
-    response = requests.post(url, headers=headers, json=data, timeout=30)
-    response.raise_for_status()
-
-
-def send_via_sendgrid(config: dict, to_email: str, reset_code: str):
-    """Send email via SendGrid API"""
-    import requests
-
-    url = "https://api.sendgrid.com/v3/mail/send"
-    headers = {
-        "Authorization": f"Bearer {config['api_key']}",
-        "Content-Type": "application/json"
-    }
-
-    data = {
-        "personalizations": [{
-            "to": [{"email": to_email}],
-            "subject": "PrimeStudio Password Reset Code"
-        }],
-        "from": {"email": config['from_email']},
-        "content": [{
-            "type": "text/plain",
-            "value": f"Your password reset code is: {reset_code}\n\nThis code will expire in 15 minutes."
-        }]
-    }
-
-    response = requests.post(url, headers=headers, json=data, timeout=30)
-    response.raise_for_status()
-
-
-def send_via_smtp(config: dict, to_email: str, reset_code: str):
-    """Send email via SMTP"""
-    msg = MIMEMultipart()
-    msg['From'] = config['from_email']
-    msg['To'] = to_email
-    msg['Subject'] = "PrimeStudio Password Reset Code"
-
-    body = f"""
-Hello,
+    body = f"""Hello,
 
 Your password reset code is: {reset_code}
 
-This code will expire in 15 minutes.
+This code will expire in {RESET_TOKEN_EXPIRE_MINUTES} minutes.
 
 If you didn't request this password reset, please ignore this email.
 
 Best regards,
 PrimeStudio Team
-    """
-
-    msg.attach(MIMEText(body, 'plain'))
-
-    server = smtplib.SMTP(config['server'], config['port'])
-    server.starttls()
-    server.login(config['username'], config['password'])
-    text = msg.as_string()
-    server.sendmail(config['from_email'], to_email, text)
-    server.quit()
+"""
+    email_outbox.enqueue(db, to_email, "PrimeStudio Password Reset Code", body, category="password-reset")
 
 
 def verify_reset_token(token: str) -> str:
@@ -725,6 +611,21 @@ class VideoJobOut(BaseModel):
     coins_balance: Optional[int] = None
 
 
+class StoredVideoOut(BaseModel):
+    provider_task_id: str
+    job_id: Optional[str] = None
+    file_size: Optional[int] = None
+    duration_seconds: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    bitrate: Optional[int] = None
+    created_at: Optional[datetime] = None
+    expires_at: datetime
+
+    class Config:
+        orm_mode = True
+
+
 # ==============================
 # Image generation schemas
 # ==============================
@@ -750,12 +651,36 @@ class ImageJobOut(BaseModel):
     status: str  # queued | processing | succeeded | failed
     provider: str
     image_url: Optional[str] = None
+    thumbnails: Optional[Dict[str, str]] = None  # width -> WebP thumbnail URL
     error: Optional[str] = None
     created_at: datetime
     coins_spent: Optional[int] = None
     coins_balance: Optional[int] = None
 
 
+class StoredImageOut(BaseModel):
+    provider: str
+    provider_task_id: str
+    job_id: Optional[str] = None
+    image_url: str
+    thumbnails: Dict[str, str] = {}
+    width: Optional[int] = None
+    height: Optional[int] = None
+    file_size: Optional[int] = None
+    created_at: Optional[datetime] = None
+    expires_at: datetime
+
+
+class ImageAssetOut(BaseModel):
+    asset_id: str
+    ref: str  # Pass this as image_urls[i] / image_url / image_url2
+    content_type: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    file_size: Optional[int] = None
+    expires_at: datetime
+
+
 # In-memory job store (OK for hackathon / single-instance dev)
 VIDEO_JOBS: Dict[str, Dict[str, Any]] = {}
 IMAGE_JOBS: Dict[str, Dict[str, Any]] = {}
@@ -766,48 +691,29 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
     Validate JWT access token and return the User record.
     Frontend should send: Authorization: Bearer <token>
     """
-    if not token:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No token provided")
-    
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        sub = payload.get("sub")
-        if not sub:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token: missing user ID")
-        user_id = int(sub)
-    except JWTError as e:
-        # More specific error messages for debugging
-        error_msg = str(e)
-        if "expired" in error_msg.lower():
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired. Please login again.")
-        elif "invalid" in error_msg.lower():
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token. Please login again.")
-        else:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Token validation failed: {error_msg}")
-    except ValueError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token: user ID format error")
-
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
+    return get_user_from_token(token, db)
 
 
 def get_user_from_token(token: str, db: Session) -> User:
     """
-    Helper function to validate token and return user.
-    Used for token validation from query parameters.
+    Validate a JWT access token and return its User (from the user cache when possible).
+    Shared by get_current_user and the endpoints that take the token as a query parameter.
     """
     if not token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No token provided")
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Same token verified before and not expired: skip decoding and the HMAC check
+        payload = token_claims_cache.get(token)
+        if payload is None:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            token_claims_cache.put(token, payload)
         sub = payload.get("sub")
         if not sub:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token: missing user ID")
         user_id = int(sub)
     except JWTError as e:
+        # More specific error messages for debugging
         error_msg = str(e)
         if "expired" in error_msg.lower():
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired. Please login again.")
@@ -818,7 +724,7 @@ def get_user_from_token(token: str, db: Session) -> User:
     except ValueError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token: user ID format error")
 
-    user = db.query(User).filter(User.id == user_id).first()
+    user = user_cache.get(db, user_id)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
     return user
@@ -1271,8 +1177,10 @@ def _sora2_create_task(
     headers["X-Client-Request-Id"] = request_id
     
     # Handle input_reference (image file) if image_urls provided
-    image_file = None
-    temp_file_path = None
+    # The processed image stays in memory and goes straight into the multipart body
+    image_bytes: Optional[bytes] = None
+    image_size = None  # (width, height) as reported by the image pool
+    suffix = '.png'
     
     if image_urls and len(image_urls) > 0:
         image_url = image_urls[0]  # Use first image
@@ -1280,9 +1188,23 @@ def _sora2_create_task(
         try:
             image_data = None
             original_format = 'PNG'
+            # Prepared (resized, ready to upload) images are cached by content and by URL
+            cache_variant = f"sora2:{target_width}x{target_height}"
+            cached = None
+            url_cache_key = None
+            content_cache_key = None
+            
+            # Uploaded asset (POST /assets/images) or inline image spooled by BodyLimitMiddleware:
+            # its sha256 is the content hash, so a prepared copy is found without reading the file
+            if isinstance(image_url, (ResolvedImage, SpooledImage)):
+                content_cache_key = prepared_image_cache.key(image_url.sha256, cache_variant)
+                cached = prepared_image_cache.get(content_cache_key) if PIL_AVAILABLE else None
+                if cached is None:
+                    image_data = image_url.read()
+                suffix = image_url.suffix
             
             # Check if it's a base64 data URL
-            if image_url.startswith('data:image/'):
+            elif image_url.startswith('data:image/'):
                 # Extract base64 data
                 # Format: data:image/png;base64,<base64_data>
                 header, encoded = image_url.split(',', 1)
@@ -1300,19 +1222,23 @@ def _sora2_create_task(
                 suffix, original_format = ext_map.get(mime_type.lower(), ('.png', 'PNG'))
                     
             elif image_url.startswith('http://') or image_url.startswith('https://'):
-                # Download image from URL
-                img_resp = requests.get(image_url, timeout=30)
-                img_resp.raise_for_status()
-                image_data = img_resp.content
-                # Try to detect format from Content-Type or file extension
-                content_type = img_resp.headers.get('Content-Type', '')
-                if 'jpeg' in content_type or 'jpg' in content_type:
-                    original_format = 'JPEG'
-                elif 'png' in content_type:
-                    original_format = 'PNG'
-                elif 'webp' in content_type:
-                    original_format = 'WEBP'
-                suffix = '.png'
+                # Same URL prepared recently: skip both the download and the resize
+                url_cache_key = prepared_image_cache.key(url_source(image_url), cache_variant)
+                cached = prepared_image_cache.get(url_cache_key) if PIL_AVAILABLE else None
+                if cached is None:
+                    # Download image from URL
+                    img_resp = requests.get(image_url, timeout=30)
+                    img_resp.raise_for_status()
+                    image_data = img_resp.content
+                    # Try to detect format from Content-Type or file extension
+                    content_type = img_resp.headers.get('Content-Type', '')
+                    if 'jpeg' in content_type or 'jpg' in content_type:
+                        original_format = 'JPEG'
+                    elif 'png' in content_type:
+                        original_format = 'PNG'
+                    elif 'webp' in content_type:
+                        original_format = 'WEBP'
+                    suffix = '.png'
             else:
                 # Assume it's a file path (for local development)
                 if os.path.exists(image_url):
@@ -1328,32 +1254,44 @@ def _sora2_create_task(
                         original_format = 'WEBP'
                     suffix = ext or '.png'
             
+            if image_data and cached is None and PIL_AVAILABLE and content_cache_key is None:
+                content_cache_key = prepared_image_cache.key(content_source(image_data), cache_variant)
+                cached = prepared_image_cache.get(content_cache_key)
+                if cached is not None and url_cache_key:
+                    prepared_image_cache.put(url_cache_key, cached.data, cached.meta, ttl_seconds=prepared_image_cache.url_ttl_seconds)
+            
+            if cached is not None:
+                image_data = cached.data
+                suffix = cached.meta.get("suffix") or '.png'
+                image_size = (cached.meta.get("width"), cached.meta.get("height"))
+                print(f"[Sora2] Using cached prepared image ({len(image_data)} bytes, {image_size[0]}x{image_size[1]})")
             # Resize image to match target size if PIL is available
-            if image_data:
+            elif image_data:
                 if PIL_AVAILABLE:
                     try:
-                        # Open image from bytes
-                        img = Image.open(io.BytesIO(image_data))
-                        
                         # Resize image to match target dimensions exactly
                         # OpenAI requires exact dimensions matching the video size
-                        original_size = img.size
-                        print(f"[Sora2] Original image size: {original_size[0]}x{original_size[1]}, target: {target_width}x{target_height}")
-                        
-                        # Only resize if dimensions don't match
-                        if original_size != (target_width, target_height):
-                            img_resized = img.resize((target_width, target_height), Image.Resampling.LANCZOS)
-                            
-                            # Save resized image to bytes
-                            output = io.BytesIO()
-                            # Use PNG format for better compatibility
-                            img_resized.save(output, format='PNG')
-                            image_data = output.getvalue()
+                        # Decode / resize / PNG encode run in the image process pool, off the request thread
+                        prepared = image_pool.fit_exact(image_data, target_width, target_height)
+                        print(
+                            f"[Sora2] Original image size: {prepared.original_width}x{prepared.original_height}, "
+                            f"target: {target_width}x{target_height} "
+                            f"(queued {prepared.queue_ms:.0f} ms, processed {prepared.process_ms:.0f} ms)"
+                        )
+                        image_size = (prepared.width, prepared.height)
+                        if prepared.resized:
+                            image_data = prepared.data
                             original_format = 'PNG'
                             suffix = '.png'
                             print(f"[Sora2] Image successfully resized to {target_width}x{target_height}")
                         else:
                             print(f"[Sora2] Image already matches target size {target_width}x{target_height}, no resize needed")
+                        meta = {"suffix": suffix, "width": prepared.width, "height": prepared.height}
+                        prepared_image_cache.put(content_cache_key, image_data, meta)
+                        if url_cache_key:
+                            prepared_image_cache.put(url_cache_key, image_data, meta, ttl_seconds=prepared_image_cache.url_ttl_seconds)
+                    except ImagePoolBusy:
+                        raise
                     except Exception as resize_error:
                         print(f"[Sora2] Error: Failed to resize image: {resize_error}")
                         raise HTTPException(
@@ -1365,65 +1303,44 @@ def _sora2_create_task(
                     print(f"[Sora2] Warning: PIL not available. Image must be exactly {target_width}x{target_height} pixels.")
                     # We'll still try to upload, but OpenAI will reject if size doesn't match
             
-            # Create temporary file with processed image
-            if image_data:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-                    tmp_file.write(image_data)
-                    temp_file_path = tmp_file.name
-                    image_file = open(temp_file_path, 'rb')
+            image_bytes = image_data or None
                     
+        except ImagePoolBusy as e:
+            print(f"[Sora2] {e}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Image processing is busy, please retry in a few seconds",
+                headers={"Retry-After": "5"},
+            )
         except Exception as e:
             print(f"[Sora2] Error processing image: {e}")
             # Continue without image if processing fails
-            if image_file:
-                image_file.close()
-            if temp_file_path and os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-            image_file = None
+            image_bytes = None
     
-    # If we have an image file, use multipart/form-data
-    if image_file:
+    # If we have an image, use multipart/form-data
+    if image_bytes:
         try:
-            # Verify image dimensions before upload (if PIL available)
-            if PIL_AVAILABLE and temp_file_path:
-                try:
-                    # Re-open and verify dimensions
-                    verify_img = Image.open(temp_file_path)
-                    actual_size = verify_img.size
-                    verify_img.close()
-                    print(f"[Sora2] Verifying image before upload: {actual_size[0]}x{actual_size[1]}, expected: {target_width}x{target_height}")
-                    if actual_size != (target_width, target_height):
-                        raise HTTPException(
-                            status_code=status.HTTP_400_BAD_REQUEST,
-                            detail=f"Image dimensions mismatch. Image is {actual_size[0]}x{actual_size[1]} but must be {target_width}x{target_height} pixels. Please ensure PIL/Pillow is installed and image resizing is working."
-                        )
-                except HTTPException:
-                    raise
-                except Exception as verify_error:
-                    print(f"[Sora2] Warning: Error verifying image dimensions: {verify_error}")
-                    # Continue anyway, let OpenAI reject if wrong
+            # Dimensions are already known from processing, no need to decode the image again
+            if image_size is not None:
+                print(f"[Sora2] Image ready for upload: {image_size[0]}x{image_size[1]}, expected: {target_width}x{target_height}")
             
             # Determine MIME type from file extension
-            if temp_file_path:
-                ext = os.path.splitext(temp_file_path)[1].lower()
-                mime_map = {
-                    '.png': 'image/png',
-                    '.jpg': 'image/jpeg',
-                    '.jpeg': 'image/jpeg',
-                    '.gif': 'image/gif',
-                    '.webp': 'image/webp'
-                }
-                mime_type = mime_map.get(ext, 'image/png')
-                filename = f'image{ext}'
-            else:
-                mime_type = 'image/png'
-                filename = 'image.png'
+            ext = suffix.lower() if suffix else '.png'
+            mime_map = {
+                '.png': 'image/png',
+                '.jpg': 'image/jpeg',
+                '.jpeg': 'image/jpeg',
+                '.gif': 'image/gif',
+                '.webp': 'image/webp'
+            }
+            mime_type = mime_map.get(ext, 'image/png')
+            filename = f'image{ext}'
             
-            print(f"[Sora2] Uploading image file: {filename}, MIME: {mime_type}, target size: {target_width}x{target_height}")
+            print(f"[Sora2] Uploading image file: {filename}, MIME: {mime_type}, {len(image_bytes)} bytes, target size: {target_width}x{target_height}")
             
-            # Prepare multipart form data
+            # Prepare multipart form data (the body is built from the bytes in memory)
             files = {
-                'input_reference': (filename, image_file, mime_type)
+                'input_reference': (filename, image_bytes, mime_type)
             }
             
             data = {
@@ -1445,17 +1362,6 @@ def _sora2_create_task(
                 status_code=status.HTTP_502_BAD_GATEWAY,
                 detail=f"Failed to upload image to OpenAI Sora 2: {str(e)}"
             )
-        finally:
-            # Clean up
-            try:
-                image_file.close()
-            except:
-                pass
-            if temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.unlink(temp_file_path)
-                except:
-                    pass
     else:
         # No image, use JSON payload
         headers["Content-Type"] = "application/json"
@@ -1601,17 +1507,27 @@ def _kling_base_url() -> str:
     return base
 
 
-def _kling_api_key() -> str:
+# Minted Kling JWTs live 30 minutes; cached headers are rebuilt 5 minutes before that
+KLING_JWT_TTL_SECONDS = 1800
+KLING_JWT_REFRESH_MARGIN_SECONDS = 300
+
+_KLING_AUTH_LOCK = threading.Lock()
+_KLING_AUTH: Dict[str, Any] = {"headers": None, "refresh_at": 0.0}
+
+
+def _kling_auth_token():
     """
     Get Kling AI API key or generate JWT token from Access Key and Secret Key.
     Kling AI uses JWT authentication with Access Key (AK) and Secret Key (SK).
+    Returns (token, expires_at); expires_at is None for pre-generated tokens
+    (KLING_JWT_TOKEN / KLING_API_KEY), which are used as they are.
     """
     # Try to get pre-generated JWT token first
     jwt_token = os.getenv("KLING_JWT_TOKEN")
     if jwt_token:
         jwt_token = jwt_token.strip().strip('"').strip("'")
         if jwt_token:
-            return jwt_token
+            return jwt_token, None
     
     # If JWT token not provided, try to generate from Access Key and Secret Key
     access_key = os.getenv("KLING_ACCESS_KEY")
@@ -1624,16 +1540,15 @@ def _kling_api_key() -> str:
         if access_key and secret_key:
             # Generate JWT token using jose library (already imported)
             try:
-                import time
-                
+                now = int(time.time())
                 payload = {
                     "iss": access_key,  # Access Key as issuer
-                    "exp": int(time.time()) + 1800,  # Expires in 30 minutes
-                    "nbf": int(time.time()) - 5  # Not before (5 seconds ago)
+                    "exp": now + KLING_JWT_TTL_SECONDS,  # Expires in 30 minutes
+                    "nbf": now - 5  # Not before (5 seconds ago)
                 }
                 # Use jose.jwt which is already imported
                 token = jwt.encode(payload, secret_key, algorithm="HS256")
-                return token
+                return token, payload["exp"]
             except Exception as e:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1645,7 +1560,7 @@ def _kling_api_key() -> str:
     if api_key:
         api_key = api_key.strip().strip('"').strip("'")
         if api_key:
-            return api_key
+            return api_key, None
     
     # No valid key found
     raise HTTPException(
@@ -1654,13 +1569,33 @@ def _kling_api_key() -> str:
     )
 
 
-def _kling_headers() -> Dict[str, str]:
+def _kling_headers(force_refresh: bool = False) -> Dict[str, str]:
     """
     Kling AI API headers.
     Uses Authorization: Bearer <jwt_token> format.
     JWT token is generated from Access Key and Secret Key, or provided directly.
+    The headers are built once and reused until shortly before the minted token expires
+    (or until force_refresh, e.g. after a 401).
     """
-    token = _kling_api_key()
+    if not force_refresh:
+        headers = _KLING_AUTH["headers"]
+        if headers is not None and time.time() < _KLING_AUTH["refresh_at"]:
+            return dict(headers)
+    with _KLING_AUTH_LOCK:
+        # Another thread may have refreshed while we waited
+        headers = _KLING_AUTH["headers"]
+        if not force_refresh and headers is not None and time.time() < _KLING_AUTH["refresh_at"]:
+            return dict(headers)
+        headers, expires_at = _kling_build_headers()
+        _KLING_AUTH["headers"] = headers
+        _KLING_AUTH["refresh_at"] = (
+            expires_at - KLING_JWT_REFRESH_MARGIN_SECONDS if expires_at is not None else float("inf")
+        )
+        return dict(headers)
+
+
+def _kling_build_headers():
+    token, expires_at = _kling_auth_token()
     
     # Ensure token is not empty
     if not token or not token.strip():
@@ -1691,7 +1626,20 @@ def _kling_headers() -> Dict[str, str]:
         "Content-Type": "application/json",
     }
     
-    return headers
+    return headers, expires_at
+
+
+def _kling_request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    requests.get / requests.post with the cached Kling auth headers.
+    A 401 forces fresh headers and the request is retried once.
+    """
+    send = requests.post if method.upper() == "POST" else requests.get
+    resp = send(url, headers=_kling_headers(), **kwargs)
+    if resp.status_code == 401:
+        print(f"[Kling] 401 from {url}, refreshing the auth token and retrying once")
+        resp = send(url, headers=_kling_headers(force_refresh=True), **kwargs)
+    return resp
 
 
 def _kling_model_version() -> str:
@@ -1804,7 +1752,9 @@ def _kling_create_task(
         payload["cfg_scale"] = float(cfg_scale)
     
     # Image URL for image-to-video (if provided)
-    if image_url:
+    if isinstance(image_url, (ResolvedImage, SpooledImage)):
+        payload["image_url"] = _process_image_url_for_kling(image_url)  # Uploaded or spooled image, sent as base64
+    elif image_url:
         payload["image_url"] = image_url.strip()
     
     # Optional callback URL
@@ -1822,7 +1772,7 @@ def _kling_create_task(
         create_path = "/v1/videos/text2video"
     try:
         url = f"{_kling_base_url()}{create_path}"
-        resp = requests.post(url, headers=_kling_headers(), json=payload, timeout=90)
+        resp = _kling_request("POST", url, json=payload, timeout=90)
     except requests.exceptions.ConnectionError as e:
         base_url = _kling_base_url()
         raise HTTPException(
@@ -1917,11 +1867,7 @@ def _kling_get_status(task_id: str) -> Dict[str, Any]:
         status_path = f"/v1/videos/text2video/{task_id}"
     url = f"{_kling_base_url()}{status_path}"
     
-    resp = requests.get(
-        url,
-        headers=_kling_headers(),
-        timeout=60,
-    )
+    resp = _kling_request("GET", url, timeout=60)
     
     if resp.status_code in (401, 403):
         raise HTTPException(
@@ -2057,7 +2003,7 @@ def _kling_create_image_task(
     for path_to_try in possible_paths:
         try:
             url = f"{_kling_base_url()}{path_to_try}"
-            resp = requests.post(url, headers=_kling_headers(), json=payload, timeout=90)
+            resp = _kling_request("POST", url, json=payload, timeout=90)
             
             # If successful (2xx), use this response
             if resp.status_code < 400:
@@ -2129,7 +2075,7 @@ def _kling_create_image_task(
                 payload_retry["model"] = payload_retry.pop("model_name")
             
             try:
-                resp_retry = requests.post(url, headers=_kling_headers(), json=payload_retry, timeout=90)
+                resp_retry = _kling_request("POST", url, json=payload_retry, timeout=90)
                 if resp_retry.status_code < 400:
                     return resp_retry.json() if resp_retry.content else {}
                 # If still error, continue with original error
@@ -2170,14 +2116,24 @@ def _kling_create_image_task(
     return resp.json() if resp.content else {}
 
 
-def _process_image_url_for_kling(image_url: str) -> str:
+def _process_image_url_for_kling(image_url) -> str:
     """
     Process image URL to extract base64 data for Kling AI.
     Kling AI expects pure base64 string (without data:image/...;base64, prefix).
+    Also accepts an uploaded asset (ResolvedImage) or a spooled inline image (SpooledImage).
     
     Returns:
         Pure base64 string if input is data URL, or original URL if HTTP/HTTPS
     """
+    if isinstance(image_url, (ResolvedImage, SpooledImage)):
+        cache_key = prepared_image_cache.key(image_url.sha256, "kling:base64")
+        cached = prepared_image_cache.get(cache_key)
+        if cached is not None:
+            return cached.data.decode('ascii')
+        image_base64 = base64.b64encode(image_url.read()).decode('ascii')
+        prepared_image_cache.put(cache_key, image_base64.encode('ascii'))
+        return image_base64
+    
     if not image_url or not image_url.strip():
         raise ValueError("Image URL cannot be empty")
     
@@ -2196,14 +2152,8 @@ def _process_image_url_for_kling(image_url: str) -> str:
     
     # If it's HTTP/HTTPS URL, download and convert to base64
     elif image_url.startswith('http://') or image_url.startswith('https://'):
-        try:
-            img_resp = requests.get(image_url, timeout=30)
-            img_resp.raise_for_status()
-            # Convert to base64
-            image_base64 = base64.b64encode(img_resp.content).decode('utf-8')
-            return image_base64
-        except requests.exceptions.RequestException as e:
-            raise ValueError(f"Failed to download image from URL: {str(e)}")
+        # Pooled, size-capped fetch; reused from the cache while fresh or revalidated (ETag / Last-Modified)
+        return image_fetcher.fetch_base64(image_url)
     
     # If it's already pure base64 (no prefix), return as is
     else:
@@ -2295,7 +2245,7 @@ def _kling_create_image_to_image_task(
     create_path = os.getenv("KLING_IMAGE_TO_IMAGE_CREATE_PATH", "/v1/images/generations").strip()
     try:
         url = f"{_kling_base_url()}{create_path}"
-        resp = requests.post(url, headers=_kling_headers(), json=payload, timeout=90)
+        resp = _kling_request("POST", url, json=payload, timeout=90)
     except requests.exceptions.ConnectionError as e:
         base_url = _kling_base_url()
         raise HTTPException(
@@ -2349,11 +2299,7 @@ def _kling_get_image_status(task_id: str) -> Dict[str, Any]:
         status_path = status_path.replace("{task_id}", task_id).replace("{id}", task_id)
     url = f"{_kling_base_url()}{status_path}"
     
-    resp = requests.get(
-        url,
-        headers=_kling_headers(),
-        timeout=60,
-    )
+    resp = _kling_request("GET", url, timeout=60)
     
     if resp.status_code in (401, 403):
         raise HTTPException(
@@ -2432,107 +2378,637 @@ def _kling_parse_video_url(data: Any) -> Optional[str]:
 
 
 # ==============================
-# FastAPI app & middleware
+# Media storage & background prefetch
 # ==============================
 
-app = FastAPI(title="Web3 Auth API")
+def _backend_url() -> str:
+    # Use BACKEND_URL from environment (Railway production)
+    # Fallback to localhost only for development
+    backend_url = os.getenv("BACKEND_URL")
+    if not backend_url:
+        backend_url = "http://localhost:8001"
+    return backend_url.strip().strip('"').strip("'").rstrip("/")
 
 
-# Startup event - initialize database tables
-@app.on_event("startup")
-async def startup_event():
+def _media_url_secret() -> bytes:
+    secret = os.getenv("MEDIA_URL_SECRET")
+    if secret:
+        return secret.strip().strip('"').strip("'").encode()
+    # Derived from the JWT secret so a media signature can never double as a JWT signature
+    return hmac.new(SECRET_KEY.encode(), b"media-url-signing", hashlib.sha256).digest()
+
+
+def _media_url_signature(user_id: int, media_id: str, exp: int) -> str:
+    mac = hmac.new(_media_url_secret(), f"{user_id}:{media_id}:{exp}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(mac[:24]).decode().rstrip("=")
+
+
+def _sign_media_url(url: str, user_id: int, media_id: str, ttl_seconds: Optional[int] = None) -> str:
     """
-    Initialize database tables on application startup.
-    This ensures all models are imported and registered before creating tables.
-    
-    # Models imported at line 52 before this startup event
+    Short-lived URL for <video> and <img> tags, scoped to (user_id, media_id, expiry), so the
+    long-lived JWT never goes in a query string. Expiry is rounded up to a multiple of the
+    TTL: every poll within one TTL window returns the same URL (the browser's cache key),
+    and each URL stays valid for between one and two TTLs.
     """
-    import os
-    from sqlalchemy import inspect
-    
-    print("=" * 60)
-    print("[STARTUP] Starting database initialization...")
-    print("=" * 60)
-    
-    # Debug: Verify DATABASE_URL
-    db_url = os.getenv("DATABASE_URL")
-    db_url_exists = bool(db_url)
-    print(f"[STARTUP] DATABASE_URL exists: {db_url_exists}")
-    
-    if db_url:
-        # Mask sensitive parts for logging
-        if "@" in db_url:
-            masked_url = db_url.split("@")[-1]
-        else:
-            masked_url = db_url[:50] + "..." if len(db_url) > 50 else db_url
-        print(f"[STARTUP] DATABASE_URL: {masked_url}")
-        
-        # Check if PostgreSQL
-        if db_url.startswith("postgresql://") or db_url.startswith("postgres://"):
-            print("[STARTUP] Using PostgreSQL (Railway production)")
-        else:
-            print("[STARTUP] Using SQLite (development mode)")
-    else:
-        print("[STARTUP] WARNING: DATABASE_URL not found in environment!")
-        print("[STARTUP] WARNING: Make sure you set DATABASE_URL in Railway Variables")
-        print("[STARTUP] WARNING: Format: ${{ Postgres.DATABASE_URL }}")
-    
-    # Debug: Verify models are imported
-    print(f"[STARTUP] Models imported: User={User is not None}, UserCoinBalance={UserCoinBalance is not None}")
-    print(f"[STARTUP] Found {len(Base.metadata.tables)} table(s) to create: {list(Base.metadata.tables.keys())}")
-    
-    if len(Base.metadata.tables) == 0:
-        print("[STARTUP] ERROR: No tables found in Base.metadata!")
-        print("[STARTUP] ERROR: This means models were not imported correctly")
-        print("[STARTUP] ERROR: Check if models.py is imported correctly")
-        return
-    
-    # Try to connect and verify database
+    ttl = max(60, ttl_seconds or env_int("MEDIA_URL_TTL_SECONDS", 6 * 3600))
+    exp = (int(time.time()) + 2 * ttl - 1) // ttl * ttl
+    sig = _media_url_signature(user_id, media_id, exp)
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}{urlencode({'uid': user_id, 'exp': exp, 'sig': sig})}"
+
+
+def _verify_media_signature(media_id: str, uid: Optional[str], exp: Optional[str], sig: str) -> int:
+    """Check a signed media URL (CPU only, no DB). Returns the user id."""
     try:
-        print("[STARTUP] Testing database connection...")
-        with engine.connect() as conn:
-            print("[STARTUP] Database connection successful")
-    except Exception as e:
-        print(f"[STARTUP] Database connection failed: {e}")
-        import traceback
-        traceback.print_exc()
-        print("[STARTUP] WARNING: App will continue, but database operations may fail")
-        return
-    
-    # Create tables
+        user_id = int(uid or "")
+        exp_ts = int(exp or "")
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid media link")
+    if not hmac.compare_digest(sig, _media_url_signature(user_id, media_id, exp_ts)):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid media link")
+    if exp_ts < time.time():
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Media link expired")
+    return user_id
+
+
+def _find_stored_video(db: Session, user_id: int, provider_task_id: str) -> Optional[StoredVideo]:
+    """
+    Return the user's non-expired stored copy of a provider video, if the file still exists in storage.
+    """
+    stored_video = db.query(StoredVideo).filter(
+        StoredVideo.provider_task_id == provider_task_id,
+        StoredVideo.user_id == user_id,
+        StoredVideo.expires_at > datetime.utcnow()
+    ).order_by(StoredVideo.id.desc()).first()
+    if stored_video and storage_for_location(stored_video.file_path).exists(stored_video.file_path):
+        return stored_video
+    return None
+
+
+def _create_stored_video(
+    db: Session,
+    user_id: int,
+    provider_task_id: str,
+    job_id: Optional[str],
+    blob: MediaBlob,
+    video_info: Optional[Dict[str, Any]] = None,
+) -> StoredVideo:
+    expires_at = media_cache.expires_at()
+    stored_video = StoredVideo(
+        user_id=user_id,
+        provider_task_id=provider_task_id,
+        job_id=job_id,
+        file_path=blob.file_path,
+        file_size=blob.file_size,
+        blob_sha256=blob.sha256,
+        expires_at=expires_at,
+        **(video_info or {})
+    )
+    db.add(stored_video)
+    db.commit()
+    db.refresh(stored_video)
+    return stored_video
+
+
+def _ingest_mp4(tmp_path: Path, sha256: str, file_size: int):
+    """
+    Ingest stage for downloaded MP4s: read duration / resolution / bitrate and move
+    the moov box to the front (faststart) so playback can begin before the whole file arrives.
+    Returns (tmp_path, sha256, file_size, video_info) describing the file to store.
+    Files we can't parse are stored unchanged.
+    """
+    started = time.monotonic()
+    out_path = tmp_path.with_suffix(".faststart")
     try:
-        print("[STARTUP] Creating tables if they don't exist...")
-        init_db()
-        print("[STARTUP] Database initialization complete")
-        
-        # Verify tables were created
-        print("[STARTUP] Verifying tables were created...")
-        inspector = inspect(engine)
-        existing_tables = inspector.get_table_names()
-        print(f"[STARTUP] Found {len(existing_tables)} table(s) in database: {existing_tables}")
-        
-        expected_tables = list(Base.metadata.tables.keys())
-        missing_tables = [t for t in expected_tables if t not in existing_tables]
-        
-        if missing_tables:
-            print(f"[STARTUP] WARNING: Some tables are missing: {missing_tables}")
-        else:
-            print("[STARTUP] All expected tables exist in database")
-            
+        info = mp4_faststart.process_file(tmp_path, out_path)
     except Exception as e:
-        print(f"[STARTUP] Database initialization failed: {e}")
-        import traceback
-        traceback.print_exc()
-        print("[STARTUP] WARNING: You can manually initialize using: POST /admin/db/init")
-        # Don't raise - let app start even if DB init fails (for debugging)
-        # In production, you might want to raise here
-    
-    print("=" * 60)
-    print("[STARTUP] Startup complete")
-    print("=" * 60)
+        media_blobs.discard_temp(out_path)
+        print(f"[Ingest] MP4 parse failed, storing as-is: {e}")
+        return tmp_path, sha256, file_size, None
+
+    if info.rewritten:
+        os.replace(out_path, tmp_path)
+        sha256, file_size = info.sha256, info.size
+    print(
+        f"[Ingest] {file_size} bytes, {info.duration_seconds}s {info.width}x{info.height}, "
+        f"faststart={'moved' if info.rewritten else info.faststart} in {int((time.monotonic() - started) * 1000)} ms"
+    )
+    video_info = {
+        "duration_seconds": info.duration_seconds,
+        "width": info.width,
+        "height": info.height,
+        "bitrate": info.bitrate,
+    }
+    return tmp_path, sha256, file_size, video_info
 
 
-# CORS configuration - MUST be added before routes
+def _store_video_stream(
+    db: Session,
+    user_id: int,
+    provider_task_id: str,
+    job_id: Optional[str],
+    resp: requests.Response,
+) -> StoredVideo:
+    """
+    Save a streaming provider response into the content-addressed blob store and record it in StoredVideo.
+    Large range-capable responses are fetched over several connections (media_fetch.py).
+    Identical content already in the store is not written twice.
+    """
+    tmp_path, sha256, file_size = media_fetch.download_to_temp(resp)
+    try:
+        tmp_path, sha256, file_size, video_info = _ingest_mp4(tmp_path, sha256, file_size)
+        blob = media_blobs.commit_blob(db, tmp_path, sha256, file_size, ext=".mp4", content_type="video/mp4")
+    except Exception:
+        media_blobs.discard_temp(tmp_path)
+        raise
+    stored_video = _create_stored_video(db, user_id, provider_task_id, job_id, blob, video_info)
+    print(f"[Storage] Video saved: {blob.file_path}, size: {file_size} bytes, expires: {stored_video.expires_at}")
+    try:
+        media_cache.enforce_budget(db)
+    except Exception as e:
+        db.rollback()
+        print(f"[MediaCache] Eviction failed: {e}")
+    return stored_video
+
+
+def _link_shared_video(db: Session, user_id: int, provider_task_id: str, job_id: Optional[str]) -> Optional[StoredVideo]:
+    """
+    If another user already stored this provider video, reference the same blob instead of downloading it again.
+    """
+    other = db.query(StoredVideo).filter(
+        StoredVideo.provider_task_id == provider_task_id,
+        StoredVideo.blob_sha256.isnot(None),
+        StoredVideo.expires_at > datetime.utcnow()
+    ).first()
+    # add_ref() fails for a blob whose last reference is gone, so this can't revive one being deleted
+    if not other or not media_blobs.add_ref(db, other.blob_sha256):
+        return None
+    blob = db.get(MediaBlob, other.blob_sha256)
+    if not blob or not storage_for_location(blob.file_path).exists(blob.file_path):
+        media_blobs.release_ref(db, other.blob_sha256)
+        return None
+    video_info = {
+        "duration_seconds": other.duration_seconds,
+        "width": other.width,
+        "height": other.height,
+        "bitrate": other.bitrate,
+    }
+    stored_video = _create_stored_video(db, user_id, provider_task_id, job_id, blob, video_info)
+    print(f"[Storage] Linked {provider_task_id} for user {user_id} to existing blob {blob.sha256[:12]}")
+    return stored_video
+
+
+def _stored_media_cache_headers(stored_video, local_path: Optional[Path]) -> Dict[str, str]:
+    """
+    Validators and caching policy for a stored video or image row.
+    - ETag: the blob's sha256 (content-addressed), or size + mtime for legacy files
+    - Last-Modified: file mtime, or when the row was created
+    - Cache-Control: private (URLs carry the user's token), immutable until expires_at
+    """
+    st = None
+    if local_path is not None:
+        try:
+            st = local_path.stat()
+        except OSError:
+            pass
+
+    if stored_video.blob_sha256:
+        etag = f'"{stored_video.blob_sha256}"'
+    elif st is not None:
+        etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+    else:
+        etag = f'"{stored_video.file_size or 0:x}-{stored_video.id:x}"'
+
+    if st is not None:
+        mtime = datetime.fromtimestamp(int(st.st_mtime), tz=timezone.utc)
+    else:
+        mtime = (stored_video.created_at or datetime.utcnow()).replace(microsecond=0, tzinfo=timezone.utc)
+
+    expires_at = stored_video.expires_at or media_cache.expires_at()
+    max_age = max(0, int((expires_at - datetime.utcnow()).total_seconds()))
+    cache_control = f"private, max-age={max_age}, immutable" if max_age else "private, no-cache"
+
+    return {
+        "ETag": etag,
+        "Last-Modified": format_datetime(mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        # Authorization may come from the header instead of ?token=
+        "Vary": "Authorization",
+    }
+
+
+def _not_modified(request: Optional[Request], headers: Dict[str, str]) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since against our validators (RFC 9110 13.2.2)."""
+    if request is None:
+        return False
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison: W/"x" matches "x"
+        etag = headers["ETag"]
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            if candidate.startswith("W/"):
+                candidate = candidate[2:]
+            if candidate == etag:
+                return True
+        return False
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return parsedate_to_datetime(headers["Last-Modified"]) <= since
+    return False
+
+
+def _stored_media_response(
+    stored_video,
+    filename: str,
+    request: Optional[Request] = None,
+    media_type: str = "video/mp4",
+):
+    """
+    Serve a stored video (or image). Backends that can presign (S3) answer with a short-lived
+    redirect so the bytes never pass through the API workers.
+    Conditional requests (If-None-Match / If-Modified-Since) get a 304.
+    """
+    storage = storage_for_location(stored_video.file_path)
+    file_path = storage.local_path(stored_video.file_path)
+    cache_headers = _stored_media_cache_headers(stored_video, file_path)
+    if _not_modified(request, cache_headers):
+        return Response(status_code=304, headers=cache_headers)
+
+    presigned = storage.presigned_url(stored_video.file_path, filename=filename, content_type=media_type)
+    if presigned:
+        # The presigned URL itself expires, so the redirect must not outlive it
+        return RedirectResponse(
+            url=presigned,
+            status_code=302,
+            headers={"Cache-Control": "private, no-cache", "Vary": "Authorization"},
+        )
+
+    def iterfile():
+        with open(file_path, "rb") as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                yield chunk
+
+    return StreamingResponse(
+        iterfile(),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'inline; filename="{filename}"',
+            "Content-Length": str(stored_video.file_size or file_path.stat().st_size),
+            **cache_headers,
+        }
+    )
+
+
+def _prefetch_concurrency() -> int:
+    return max(1, env_int("MEDIA_PREFETCH_CONCURRENCY", 2))
+
+
+def _prefetch_min_free_bytes() -> int:
+    # Keep at least this much disk free after a prefetch (default 1 GB)
+    return max(0, env_int("MEDIA_PREFETCH_MIN_FREE_MB", 1024)) * 1024 * 1024
+
+
+# Bounded queue of videos waiting to be copied into local storage
+PREFETCH_QUEUE: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max(1, env_int("MEDIA_PREFETCH_QUEUE_SIZE", 100)))
+PREFETCH_PENDING: set = set()  # (user_id, provider_task_id) queued or in flight
+PREFETCH_LOCK = threading.Lock()
+PREFETCH_WORKERS: List[threading.Thread] = []
+PREFETCH_STOP = threading.Event()
+
+
+def _has_disk_room(expected_bytes: Optional[int]) -> bool:
+    """
+    Disk-aware admission: only accept a prefetch if the volume keeps
+    MEDIA_PREFETCH_MIN_FREE_MB free after writing the file.
+    (Downloads are staged on local disk even when the backend is S3.)
+    """
+    try:
+        free = disk_free_bytes()
+    except Exception as e:
+        print(f"[Prefetch] Could not read disk usage: {e}")
+        return False
+    return free - int(expected_bytes or 0) >= _prefetch_min_free_bytes()
+
+
+def _enqueue_video_prefetch(job: Dict[str, Any]) -> bool:
+    """
+    Queue a completed video job for background download into local storage.
+    Sora2 videos are pulled from the OpenAI content endpoint, Veo3/Kling from job["source_url"].
+    Returns False when the job is already queued, the queue is full or the disk is short on space.
+    """
+    provider = job.get("provider")
+    provider_task_id = job.get("provider_task_id")
+    user_id = job.get("user_id")
+    if provider not in ("sora2", "veo3", "kling") or not provider_task_id or user_id is None:
+        return False
+    if provider != "sora2" and not job.get("source_url"):
+        return False
+
+    key = (user_id, str(provider_task_id))
+    with PREFETCH_LOCK:
+        if key in PREFETCH_PENDING:
+            return False
+        if not _has_disk_room(None):
+            print(f"[Prefetch] Skipping {provider_task_id}: low disk space")
+            return False
+        item = {
+            "user_id": user_id,
+            "provider": provider,
+            "provider_task_id": str(provider_task_id),
+            "job_id": job.get("job_id"),
+            "source_url": job.get("source_url"),
+        }
+        try:
+            PREFETCH_QUEUE.put_nowait(item)
+        except queue.Full:
+            print(f"[Prefetch] Queue full, skipping {provider_task_id}")
+            return False
+        PREFETCH_PENDING.add(key)
+
+    _start_prefetch_workers()
+    return True
+
+
+def _prefetch_video(item: Dict[str, Any]) -> None:
+    provider = item["provider"]
+    provider_task_id = item["provider_task_id"]
+    db = SessionLocal()
+    try:
+        if _find_stored_video(db, item["user_id"], provider_task_id):
+            return
+        if _link_shared_video(db, item["user_id"], provider_task_id, item.get("job_id")):
+            return
+
+        if provider == "sora2":
+            url = f"{_sora2_base_url()}/v1/videos/{provider_task_id}/content"
+            headers = _sora2_headers()
+            headers["X-Client-Request-Id"] = str(uuid4())
+        else:
+            url = item["source_url"]
+            headers = {}
+
+        resp = requests.get(url, headers=headers, timeout=120, stream=True)
+        try:
+            if resp.status_code >= 400:
+                print(f"[Prefetch] {provider} {provider_task_id}: upstream returned {resp.status_code}")
+                return
+            content_length = resp.headers.get("Content-Length")
+            expected = int(content_length) if content_length and content_length.isdigit() else None
+            if not _has_disk_room(expected):
+                print(f"[Prefetch] {provider} {provider_task_id}: not enough disk space for {expected or 'unknown'} bytes")
+                return
+            _store_video_stream(db, item["user_id"], provider_task_id, item.get("job_id"), resp)
+            print(f"[Prefetch] {provider} {provider_task_id} is now stored locally")
+        finally:
+            resp.close()
+    finally:
+        db.close()
+
+
+def _prefetch_worker() -> None:
+    while not PREFETCH_STOP.is_set():
+        try:
+            item = PREFETCH_QUEUE.get(timeout=1)
+        except queue.Empty:
+            continue
+        try:
+            _prefetch_video(item)
+        except Exception as e:
+            print(f"[Prefetch] Error prefetching {item.get('provider_task_id')}: {e}")
+        finally:
+            with PREFETCH_LOCK:
+                PREFETCH_PENDING.discard((item["user_id"], item["provider_task_id"]))
+            PREFETCH_QUEUE.task_done()
+
+
+def _start_prefetch_workers() -> None:
+    """Start the prefetch worker threads (idempotent)."""
+    with PREFETCH_LOCK:
+        PREFETCH_WORKERS[:] = [t for t in PREFETCH_WORKERS if t.is_alive()]
+        PREFETCH_STOP.clear()
+        for i in range(len(PREFETCH_WORKERS), _prefetch_concurrency()):
+            t = threading.Thread(target=_prefetch_worker, name=f"video-prefetch-{i}", daemon=True)
+            t.start()
+            PREFETCH_WORKERS.append(t)
+
+
+# Kling image results are mirrored into local storage (original + WebP thumbnails)
+IMAGE_MIRROR_POOL = ThreadPoolExecutor(
+    max_workers=max(1, env_int("MEDIA_IMAGE_WORKERS", 2)),
+    thread_name_prefix="image-mirror",
+)
+IMAGE_MIRROR_PENDING: Dict[Any, Future] = {}  # (user_id, provider_task_id) -> in-flight mirror
+IMAGE_MIRROR_LOCK = threading.Lock()
+IMAGE_MIRROR_STATS = {"mirrored": 0, "failed": 0, "bytes": 0}
+
+
+def _find_stored_images(db: Session, user_id: int, provider_task_id: str) -> List[StoredImage]:
+    """The user's non-expired mirrored copies (original and variants) of a provider image."""
+    return db.query(StoredImage).filter(
+        StoredImage.provider_task_id == provider_task_id,
+        StoredImage.user_id == user_id,
+        StoredImage.expires_at > datetime.utcnow()
+    ).all()
+
+
+def _mirror_image(item: Dict[str, Any]) -> None:
+    db = SessionLocal()
+    try:
+        if _find_stored_images(db, item["user_id"], item["provider_task_id"]):
+            return
+        if not _has_disk_room(None):
+            print(f"[Images] Skipping {item['provider_task_id']}: low disk space")
+            return
+        rows = media_images.mirror_image(
+            db,
+            item["user_id"],
+            item["provider"],
+            item["provider_task_id"],
+            item.get("job_id"),
+            item["source_url"],
+        )
+        with IMAGE_MIRROR_LOCK:
+            IMAGE_MIRROR_STATS["mirrored"] += 1
+            IMAGE_MIRROR_STATS["bytes"] += sum(int(r.file_size or 0) for r in rows)
+    except Exception as e:
+        with IMAGE_MIRROR_LOCK:
+            IMAGE_MIRROR_STATS["failed"] += 1
+        print(f"[Images] Error mirroring {item.get('provider_task_id')}: {e}")
+    finally:
+        db.close()
+        with IMAGE_MIRROR_LOCK:
+            IMAGE_MIRROR_PENDING.pop((item["user_id"], item["provider_task_id"]), None)
+
+
+def _enqueue_image_mirror(job: Dict[str, Any]) -> Optional[Future]:
+    """
+    Mirror a succeeded image job in the background (no-op if already in flight).
+    Until it's done the download endpoint redirects to the provider URL.
+    """
+    provider_task_id = job.get("provider_task_id")
+    user_id = job.get("user_id")
+    if not provider_task_id or user_id is None or not job.get("source_url"):
+        return None
+    key = (user_id, str(provider_task_id))
+    with IMAGE_MIRROR_LOCK:
+        future = IMAGE_MIRROR_PENDING.get(key)
+        if future is None:
+            item = {
+                "user_id": user_id,
+                "provider": job.get("provider", "kling"),
+                "provider_task_id": str(provider_task_id),
+                "job_id": job.get("job_id"),
+                "source_url": job["source_url"],
+            }
+            future = IMAGE_MIRROR_POOL.submit(_mirror_image, item)
+            IMAGE_MIRROR_PENDING[key] = future
+    return future
+
+
+# ==============================
+# FastAPI app & middleware
+# ==============================
+
+app = FastAPI(title="Web3 Auth API")
+
+# Body size caps + streaming of inline images (request_body.py).
+# Added before CORS so that its 413 responses still carry CORS headers.
+app.add_middleware(BodyLimitMiddleware)
+
+
+# Startup event - initialize database tables
+@app.on_event("startup")
+async def startup_event():
+    """
+    Initialize database tables on application startup.
+    This ensures all models are imported and registered before creating tables.
+    
+    # Models imported at line 52 before this startup event
+    """
+    import os
+    from sqlalchemy import inspect
+    
+    print("=" * 60)
+    print("[STARTUP] Starting database initialization...")
+    print("=" * 60)
+    
+    # Debug: Verify DATABASE_URL
+    db_url = os.getenv("DATABASE_URL")
+    db_url_exists = bool(db_url)
+    print(f"[STARTUP] DATABASE_URL exists: {db_url_exists}")
+    
+    if db_url:
+        # Mask sensitive parts for logging
+        if "@" in db_url:
+            masked_url = db_url.split("@")[-1]
+        else:
+            masked_url = db_url[:50] + "..." if len(db_url) > 50 else db_url
+        print(f"[STARTUP] DATABASE_URL: {masked_url}")
+        
+        # Check if PostgreSQL
+        if db_url.startswith("postgresql://") or db_url.startswith("postgres://"):
+            print("[STARTUP] Using PostgreSQL (Railway production)")
+        else:
+            print("[STARTUP] Using SQLite (development mode)")
+    else:
+        print("[STARTUP] WARNING: DATABASE_URL not found in environment!")
+        print("[STARTUP] WARNING: Make sure you set DATABASE_URL in Railway Variables")
+        print("[STARTUP] WARNING: Format: ${{ Postgres.DATABASE_URL }}")
+    
+    # Debug: Verify models are imported
+    print(f"[STARTUP] Models imported: User={User is not None}, UserCoinBalance={UserCoinBalance is not None}")
+    print(f"[STARTUP] Found {len(Base.metadata.tables)} table(s) to create: {list(Base.metadata.tables.keys())}")
+    
+    if len(Base.metadata.tables) == 0:
+        print("[STARTUP] ERROR: No tables found in Base.metadata!")
+        print("[STARTUP] ERROR: This means models were not imported correctly")
+        print("[STARTUP] ERROR: Check if models.py is imported correctly")
+        return
+    
+    # Try to connect and verify database
+    try:
+        print("[STARTUP] Testing database connection...")
+        with engine.connect() as conn:
+            print("[STARTUP] Database connection successful")
+    except Exception as e:
+        print(f"[STARTUP] Database connection failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print("[STARTUP] WARNING: App will continue, but database operations may fail")
+        return
+    
+    # Create tables
+    try:
+        print("[STARTUP] Creating tables if they don't exist...")
+        init_db()
+        print("[STARTUP] Database initialization complete")
+        
+        # Verify tables were created
+        print("[STARTUP] Verifying tables were created...")
+        inspector = inspect(engine)
+        existing_tables = inspector.get_table_names()
+        print(f"[STARTUP] Found {len(existing_tables)} table(s) in database: {existing_tables}")
+        
+        expected_tables = list(Base.metadata.tables.keys())
+        missing_tables = [t for t in expected_tables if t not in existing_tables]
+        
+        if missing_tables:
+            print(f"[STARTUP] WARNING: Some tables are missing: {missing_tables}")
+        else:
+            print("[STARTUP] All expected tables exist in database")
+            
+    except Exception as e:
+        print(f"[STARTUP] Database initialization failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print("[STARTUP] WARNING: You can manually initialize using: POST /admin/db/init")
+        # Don't raise - let app start even if DB init fails (for debugging)
+        # In production, you might want to raise here
+    
+    # Background workers that copy finished videos into local storage
+    _start_prefetch_workers()
+    print(f"[STARTUP] Video prefetch workers started ({_prefetch_concurrency()})")
+
+    # bcrypt cost for this machine (BCRYPT_TARGET_MS per hash)
+    password_hasher.calibrate()
+
+    # Scheduled cleanup of expired videos
+    cleanup_service.start()
+    print(f"[STARTUP] Video cleanup scheduled every {cleanup_service.interval_seconds}s")
+
+    # Background delivery of queued emails (password reset codes)
+    email_dispatcher.start()
+    print("[STARTUP] Email dispatcher started")
+
+    print("=" * 60)
+    print("[STARTUP] Startup complete")
+    print("=" * 60)
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    PREFETCH_STOP.set()
+    IMAGE_MIRROR_POOL.shutdown(wait=False, cancel_futures=True)
+    image_pool.shutdown()
+    password_hasher.shutdown()
+    cleanup_service.stop()
+    email_dispatcher.stop()
+
+
+# CORS configuration - MUST be added before routes
 # Get allowed origins from environment or use defaults
 cors_origins = os.getenv("CORS_ORIGINS", "").split(",") if os.getenv("CORS_ORIGINS") else []
 # Default origins for local development
@@ -2611,6 +3087,54 @@ def debug_env():
     }
 
 
+def _require_metrics_token(x_metrics_token: Optional[str] = Header(default=None)) -> None:
+    """
+    /debug/metrics shows cache, storage and queue internals, so it's only served
+    when DEBUG_METRICS_TOKEN is set, to requests sending it as X-Metrics-Token.
+    """
+    expected = (os.getenv("DEBUG_METRICS_TOKEN") or "").strip().strip('"').strip("'")
+    if not expected:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not x_metrics_token or not hmac.compare_digest(x_metrics_token.encode("utf-8"), expected.encode("utf-8")):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+
+
+@app.get("/debug/metrics", dependencies=[Depends(_require_metrics_token)])
+def debug_metrics():
+    """
+    Runtime counters for the media pipeline (cache hit rate, bytes in use, prefetch queue, cleanup).
+    In-memory counters only: bytes in use is the value measured by the last
+    scheduled cleanup, not a query per request.
+    """
+    return {
+        "media_cache": media_cache.metrics(),
+        "prefetch": {
+            "queue_depth": PREFETCH_QUEUE.qsize(),
+            "pending": len(PREFETCH_PENDING),
+            "workers": sum(1 for t in PREFETCH_WORKERS if t.is_alive()),
+        },
+        "image_mirror": {
+            **IMAGE_MIRROR_STATS,
+            "pending": len(IMAGE_MIRROR_PENDING),
+        },
+        "fetch": media_fetch.metrics(),
+        "cleanup": {
+            "interval_seconds": cleanup_service.interval_seconds,
+            "last_run": cleanup_service.last_run,
+        },
+        "reconcile": reconciler.metrics(),
+        "image_pool": image_pool.metrics(),
+        "image_cache": prepared_image_cache.metrics(),
+        "request_body": request_body.metrics(),
+        "image_fetch": image_fetcher.metrics(),
+        "password_hashing": password_hasher.metrics(),
+        "user_cache": user_cache.metrics(),
+        "token_cache": token_claims_cache.metrics(),
+        "email": email_dispatcher.metrics(),
+        "rate_limit": rate_limiter.metrics(),
+    }
+
+
 @app.post("/admin/db/init")
 def admin_init_db():
     """
@@ -2688,6 +3212,8 @@ def register(user_in: UserCreate, db: Session = Depends(get_db)):
         # Hash password with error handling
         try:
             hashed_pw = hash_password(user_in.password)
+        except HTTPException:
+            raise
         except Exception as hash_error:
             error_msg = str(hash_error)
             print(f"[AUTH] ❌ Password hashing failed: {hash_error}")
@@ -2733,9 +3259,10 @@ def register(user_in: UserCreate, db: Session = Depends(get_db)):
 
 
 @app.post("/auth/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     # Normalize email: trim whitespace and convert to lowercase for comparison
     email_input = form_data.username.strip().lower()
+    _enforce_rate_limit(request, "login", email_input)
     user = db.query(User).filter(func.lower(User.email) == email_input).first()
     
     if not user:
@@ -2746,6 +3273,16 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
         print(f"[AUTH] Login failed: Invalid password for email: {email_input}")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email or password")
 
+    # Stored with a lower bcrypt cost than the calibrated one: upgrade it now that we know the password
+    if password_hasher.needs_rehash(user.hashed_password):
+        try:
+            user.hashed_password = password_hasher.hash(form_data.password)
+            db.add(user)
+            db.commit()
+            password_hasher.count_rehash()
+        except PasswordHasherBusy:
+            pass  # Not worth failing the login; the next one will rehash
+
     print(f"[AUTH] Login successful for user: {email_input} (ID: {user.id})")
     access_token = create_access_token(data={"sub": str(user.id)})
     return {"access_token": access_token, "token_type": "bearer", "user": user}
@@ -2816,6 +3353,8 @@ def google_callback(code: Optional[str] = None, state: Optional[str] = None, err
         dummy_password = secrets.token_hex(8)  # 16 characters = 16 bytes, definitely safe for bcrypt
         try:
             hashed_pw = hash_password(dummy_password)
+        except HTTPException:
+            raise
         except Exception as hash_error:
             error_msg = str(hash_error)
             error_type = type(hash_error).__name__
@@ -2859,9 +3398,10 @@ def google_callback(code: Optional[str] = None, state: Optional[str] = None, err
 
 
 @app.post("/auth/forgot-password")
-def forgot_password(body: ForgotPasswordRequest, db: Session = Depends(get_db)):
+def forgot_password(body: ForgotPasswordRequest, request: Request, db: Session = Depends(get_db)):
     # Normalize email for case-insensitive lookup
     email_input = body.email.strip().lower()
+    _enforce_rate_limit(request, "forgot", email_input)
     user = db.query(User).filter(func.lower(User.email) == email_input).first()
     if not user:
         # Untuk keamanan, jangan bocorkan bahwa email tidak terdaftar
@@ -2877,24 +3417,21 @@ def forgot_password(body: ForgotPasswordRequest, db: Session = Depends(get_db)):
     user.reset_token_expires_at = None
 
     db.add(user)
+    # Queued in the same transaction as the code (use email from database for consistency)
+    queue_reset_code_email(db, user.email, reset_code)
     db.commit()
-
-    # Send reset code via email (use email from database for consistency)
-    try:
-        send_reset_code_email(user.email, reset_code)
-        print(f"[FORGOT PASSWORD] Reset code sent to {user.email}: {reset_code}")
-    except Exception as email_error:
-        print(f"[FORGOT PASSWORD] Failed to send email to {user.email}: {email_error}")
-        # For development, still show code in console if email fails
-        print(f"[FORGOT PASSWORD] Reset code for {user.email}: {reset_code}")
+    email_dispatcher.wake()
+    print(f"[FORGOT PASSWORD] Reset code queued for {user.email}: {reset_code}")
 
     return {"message": "If that email exists, a reset code has been sent."}
 
 
 @app.post("/auth/verify-reset-code")
-def verify_reset_code(body: VerifyResetCodeRequest, db: Session = Depends(get_db)):
+def verify_reset_code(body: VerifyResetCodeRequest, request: Request, db: Session = Depends(get_db)):
     # Normalize email for case-insensitive lookup
     email_input = body.email.strip().lower()
+    # Shares the "reset" budget with reset-password-with-code: both accept a code guess
+    _enforce_rate_limit(request, "reset", email_input)
     user = db.query(User).filter(func.lower(User.email) == email_input).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid email or code")
@@ -2913,8 +3450,9 @@ def verify_reset_code(body: VerifyResetCodeRequest, db: Session = Depends(get_db
 
 
 @app.post("/auth/reset-password")
-def reset_password(body: ResetPasswordRequest, db: Session = Depends(get_db)):
+def reset_password(body: ResetPasswordRequest, request: Request, db: Session = Depends(get_db)):
     """Legacy endpoint using JWT token (for backward compatibility)"""
+    _enforce_rate_limit(request, "reset")
     email = verify_reset_token(body.token)
     # Normalize email for case-insensitive lookup
     email_input = email.strip().lower() if email else None
@@ -2938,10 +3476,11 @@ def reset_password(body: ResetPasswordRequest, db: Session = Depends(get_db)):
 
 
 @app.post("/auth/reset-password-with-code")
-def reset_password_with_code(body: ResetPasswordWithCodeRequest, db: Session = Depends(get_db)):
+def reset_password_with_code(body: ResetPasswordWithCodeRequest, request: Request, db: Session = Depends(get_db)):
     """New endpoint using numeric code"""
     # Normalize email for case-insensitive lookup
     email_input = body.email.strip().lower()
+    _enforce_rate_limit(request, "reset", email_input)
     user = db.query(User).filter(func.lower(User.email) == email_input).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid email")
@@ -3089,6 +3628,13 @@ def create_text_to_video_job(
     if not body.prompt or not body.prompt.strip():
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Prompt is required")
 
+    # "asset:<id>" references are resolved (and checked) before any coins are spent
+    image_refs = (
+        [_resolve_image_ref(db, current_user.id, u) for u in body.image_urls]
+        if isinstance(body.image_urls, list) and body.image_urls
+        else None
+    )
+
     # Spend coins for generation
     # For sora2: use duration-based pricing (4s=50, 8s=90, 12s=110 coins)
     # For kling: use model-based pricing
@@ -3192,7 +3738,7 @@ def create_text_to_video_job(
             quality = (body.quality or "standard").strip().lower()
             if quality not in ("standard", "hd"):
                 quality = "standard"
-            image_urls = body.image_urls if isinstance(body.image_urls, list) and body.image_urls else None
+            image_urls = image_refs
             callback_url = (body.callback_url or "").strip() or None
             task = _sora2_create_task(
                 body.prompt.strip(),
@@ -3215,8 +3761,8 @@ def create_text_to_video_job(
         elif provider == "kling":
             # Kling AI supports text-to-video and image-to-video
             image_url = None
-            if body.image_urls and isinstance(body.image_urls, list) and len(body.image_urls) > 0:
-                image_url = body.image_urls[0]  # Use first image for image-to-video
+            if image_refs:
+                image_url = image_refs[0]  # Use first image for image-to-video
             
             duration = int(body.duration_seconds or 5)
             # Validate duration (must be 5 or 10)
@@ -3372,9 +3918,14 @@ def get_video_job(
                     dl_data = dl.get("data") if isinstance(dl, dict) else None
                     if isinstance(dl_data, dict) and isinstance(dl_data.get("result_url"), str):
                         video_url = dl_data.get("result_url")
-                job["video_url"] = video_url
                 job["status"] = "succeeded" if video_url else "failed"
-                if not video_url:
+                if video_url:
+                    # Serve through our download endpoint; it redirects to the provider until the prefetch lands
+                    job["source_url"] = video_url
+                    job["video_url"] = f"{_backend_url()}/video/veo3/{task_id}/download"
+                    _enqueue_video_prefetch(job)
+                else:
+                    job["video_url"] = None
                     job["error"] = "Veo3 completed but no video URL returned"
                     _maybe_refund(job.get("error"))
             else:
@@ -3404,22 +3955,11 @@ def get_video_job(
                 _maybe_refund(job.get("error"))
             elif status_norm in ("completed", "succeeded", "success", "done"):
                 # OpenAI doesn't return video URL in status, need to download from /content endpoint
-                # Use our proxy endpoint which will save video to our server
-                # Get backend base URL from env or use default
-                # Use BACKEND_URL from environment (Railway production)
-                # Fallback to localhost only for development
-                backend_url = os.getenv("BACKEND_URL")
-                if not backend_url:
-                    # Development fallback
-                    backend_url = "http://localhost:8001"
-                    print("[Sora2] ⚠️  BACKEND_URL not set, using localhost (development mode)")
-                else:
-                    print(f"[Sora2] Using BACKEND_URL: {backend_url.split('@')[-1] if '@' in backend_url else backend_url[:50]}...")
-                backend_url = backend_url.strip().rstrip("/")
-                # Use our stored video endpoint if available, otherwise use download endpoint
-                # The download endpoint will save the video on first access
-                job["video_url"] = f"{backend_url}/video/sora2/{task_id}/download"
+                # Use our proxy endpoint, which serves the locally stored copy.
+                # The copy is prefetched in the background so it is usually ready before first play.
+                job["video_url"] = f"{_backend_url()}/video/sora2/{task_id}/download"
                 job["status"] = "succeeded"
+                _enqueue_video_prefetch(job)
             else:
                 job["status"] = "processing"
 
@@ -3441,7 +3981,7 @@ def get_video_job(
                     job_id=job_id,
                     status=job["status"],
                     provider=job["provider"],
-                    video_url=job.get("video_url"),
+                    video_url=_client_video_url(job),
                     error=job.get("error"),
                     created_at=job["created_at"],
                 )
@@ -3464,9 +4004,13 @@ def get_video_job(
                 _maybe_refund(job.get("error"))
             elif status_norm in ("completed", "succeeded", "success", "done", "succeed"):
                 video_url = _kling_parse_video_url(st)
-                job["video_url"] = video_url
                 job["status"] = "succeeded" if video_url else "failed"
-                if not video_url:
+                if video_url:
+                    job["source_url"] = video_url
+                    job["video_url"] = f"{_backend_url()}/video/kling/{task_id}/download"
+                    _enqueue_video_prefetch(job)
+                else:
+                    job["video_url"] = None
                     job["error"] = "Kling AI completed but no video URL returned"
                     _maybe_refund(job.get("error"))
             else:
@@ -3478,25 +4022,26 @@ def get_video_job(
         job_id=job_id,
         status=job["status"],
         provider=job["provider"],
-        video_url=job.get("video_url"),
+        video_url=_client_video_url(job),
         error=job.get("error"),
         created_at=job["created_at"],
     )
 
 
-@app.get("/video/sora2/{video_id}/download")
-def download_sora2_video(
-    video_id: str,
-    token: Optional[str] = Query(None, description="JWT token for authentication (alternative to Authorization header)"),
-    authorization: Optional[str] = Header(None, alias="Authorization"),
-    db: Session = Depends(get_db),
-):
+def _media_request_user_id(
+    media_id: str,
+    token: Optional[str],
+    authorization: Optional[str],
+    uid: Optional[str],
+    exp: Optional[str],
+    sig: Optional[str],
+    db: Session,
+) -> int:
     """
-    Proxy endpoint to download OpenAI Sora 2 video content.
-    This endpoint downloads the video from OpenAI and streams it to the client.
-    Accepts token either from query parameter (for video tag) or Authorization header.
+    Resolve the user for media endpoints.
+    Signed URLs (uid/exp/sig, see _sign_media_url) are checked without touching the DB.
+    Otherwise accepts a JWT from the query parameter (for video tag) or Authorization header.
     """
-    # Get token from query parameter or Authorization header
     auth_token = token
     if not auth_token and authorization:
         # Extract token from "Bearer <token>" format
@@ -3504,18 +4049,53 @@ def download_sora2_video(
             auth_token = authorization[7:]
         else:
             auth_token = authorization
-    
+
+    if sig:
+        try:
+            return _verify_media_signature(media_id, uid, exp, sig)
+        except HTTPException:
+            if not auth_token:
+                raise
+            # Stale link but the client also sent credentials: fall through to them
+
     if not auth_token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No token provided")
-    
+
     # Validate token and get user
-    try:
-        current_user = get_user_from_token(auth_token, db)
-    except HTTPException:
-        raise
+    return get_user_from_token(auth_token, db).id
+
+
+def _client_video_url(job: Dict[str, Any]) -> Optional[str]:
+    """video_url for API responses: our own download URLs are returned signed."""
+    video_url = job.get("video_url")
+    provider_task_id = job.get("provider_task_id")
+    if not video_url or not provider_task_id or job.get("user_id") is None:
+        return video_url
+    if not video_url.startswith(f"{_backend_url()}/video/{job.get('provider')}/"):
+        return video_url
+    return _sign_media_url(video_url, job["user_id"], str(provider_task_id))
+
+
+@app.get("/video/sora2/{video_id}/download")
+def download_sora2_video(
+    video_id: str,
+    request: Request,
+    token: Optional[str] = Query(None, description="JWT token for authentication (alternative to Authorization header)"),
+    authorization: Optional[str] = Header(None, alias="Authorization"),
+    uid: Optional[str] = Query(None, description="Signed media URL: user id"),
+    exp: Optional[str] = Query(None, description="Signed media URL: expiry (unix time)"),
+    sig: Optional[str] = Query(None, description="Signed media URL: signature"),
+    db: Session = Depends(get_db),
+):
+    """
+    Proxy endpoint to download OpenAI Sora 2 video content.
+    This endpoint downloads the video from OpenAI and streams it to the client.
+    Accepts a signed media URL (uid/exp/sig), or a token from query parameter (for video tag) or Authorization header.
+    """
+    user_id = _media_request_user_id(video_id.strip(), token, authorization, uid, exp, sig, db)
     
     # Log for debugging
-    print(f"[Download] Request for video_id: {video_id}, user_id: {current_user.id}, VIDEO_JOBS count: {len(VIDEO_JOBS)}")
+    print(f"[Download] Request for video_id: {video_id}, user_id: {user_id}, VIDEO_JOBS count: {len(VIDEO_JOBS)}")
     
     # Verify the video belongs to the user
     # video_id could be either:
@@ -3526,7 +4106,7 @@ def download_sora2_video(
     # First, try to find by job_id (if video_id is a job_id)
     if video_id in VIDEO_JOBS:
         candidate = VIDEO_JOBS[video_id]
-        if candidate.get("user_id") == current_user.id:
+        if candidate.get("user_id") == user_id:
             job = candidate
             print(f"[Download] Found video in VIDEO_JOBS by job_id: {video_id}")
     
@@ -3545,7 +4125,7 @@ def download_sora2_video(
                 if normalized_task_id.startswith("video_"):
                     normalized_task_id = normalized_task_id[6:]
                 
-                if normalized_task_id == normalized_video_id and j.get("user_id") == current_user.id:
+                if normalized_task_id == normalized_video_id and j.get("user_id") == user_id:
                     job = j
                     print(f"[Download] Found video in VIDEO_JOBS by provider_task_id: {provider_task_id}")
                     break
@@ -3566,7 +4146,18 @@ def download_sora2_video(
         # Use the video_id directly - it should be the provider_task_id from the URL
         # The video_id from URL is already in the correct format (e.g., "video_xxx")
         provider_task_id = video_id.strip()
-        
+
+    # Serve from our storage before touching OpenAI (usually filled by the background prefetch)
+    stored_video = _find_stored_video(db, user_id, provider_task_id) or _link_shared_video(
+        db, user_id, provider_task_id, job.get("job_id") if job else None
+    )
+    if stored_video:
+        print(f"[Download] Serving video from storage: {stored_video.file_path}")
+        media_cache.record_hit(db, stored_video)
+        return _stored_media_response(stored_video, f"sora2-video-{video_id}.mp4", request)
+    media_cache.record_miss()
+
+    if not job:
         print(f"[Download] Video not in VIDEO_JOBS. Using video_id directly as provider_task_id: {provider_task_id}")
         
         # Try to verify the video exists in OpenAI (optional check)
@@ -3653,107 +4244,41 @@ def download_sora2_video(
                 detail=f"OpenAI Sora 2 error ({resp.status_code}): {error_msg} (Request ID: {request_id})"
             )
         
-        # Check if video is already stored in our server
-        stored_video = db.query(StoredVideo).filter(
-            StoredVideo.provider_task_id == provider_task_id,
-            StoredVideo.user_id == current_user.id,
-            StoredVideo.expires_at > datetime.utcnow()
-        ).first()
-        
-        if stored_video and os.path.exists(stored_video.file_path):
-            # Serve from our storage
-            print(f"[Download] Serving video from storage: {stored_video.file_path}")
-            file_path = Path(stored_video.file_path)
-            if file_path.exists():
-                def iterfile():
-                    with open(file_path, "rb") as f:
-                        while True:
-                            chunk = f.read(8192)
-                            if not chunk:
-                                break
-                            yield chunk
-                
-                return StreamingResponse(
-                    iterfile(),
-                    media_type="video/mp4",
-                    headers={
-                        "Content-Disposition": f'inline; filename="sora2-video-{video_id}.mp4"',
-                        "Content-Length": str(stored_video.file_size or file_path.stat().st_size),
-                    }
-                )
-        
         # Video not stored yet, download from OpenAI and save it
         print(f"[Download] Downloading and saving video: {provider_task_id}")
-        
-        # Create storage directory
-        storage_dir = Path(base_dir) / "storage" / "videos"
-        storage_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Generate unique filename
-        file_name = f"{current_user.id}_{provider_task_id}_{uuid4().hex[:8]}.mp4"
-        file_path = storage_dir / file_name
-        
-        # Download and save video
-        file_size = 0
         try:
-            with open(file_path, "wb") as f:
-                for chunk in resp.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        file_size += len(chunk)
-            
-            # Save to database with 2 days expiry
-            expires_at = datetime.utcnow() + timedelta(days=2)
-            stored_video = StoredVideo(
-                user_id=current_user.id,
-                provider_task_id=provider_task_id,
-                job_id=job.get("job_id") if job else None,
-                file_path=str(file_path),
-                file_size=file_size,
-                expires_at=expires_at
+            stored_video = _store_video_stream(
+                db,
+                user_id,
+                provider_task_id,
+                job.get("job_id") if job else None,
+                resp,
             )
-            db.add(stored_video)
-            db.commit()
-            db.refresh(stored_video)
-            
-            print(f"[Download] Video saved: {file_path}, size: {file_size} bytes, expires: {expires_at}")
-            
-            # Now serve the saved file
-            def iterfile():
-                with open(file_path, "rb") as f:
-                    while True:
-                        chunk = f.read(8192)
-                        if not chunk:
-                            break
-                        yield chunk
-            
-            return StreamingResponse(
-                iterfile(),
-                media_type="video/mp4",
-                headers={
-                    "Content-Disposition": f'inline; filename="sora2-video-{video_id}.mp4"',
-                    "Content-Length": str(file_size),
-                }
-            )
-        except Exception as save_error:
-            # If save fails, try to clean up and stream directly
+        except Exception:
+            # The first response is partly consumed by now. Partial bytes stay checkpointed
+            # (media_fetch.py) for the next attempt; serve this request from a fresh upstream stream.
             import traceback
             print(f"[Download] Error saving video: {traceback.format_exc()}")
-            if file_path.exists():
+            resp.close()
+            fresh = requests.get(url, headers=headers, timeout=120, stream=True)
+            if fresh.status_code >= 400:
+                fresh.close()
+                raise HTTPException(
+                    status_code=status.HTTP_502_BAD_GATEWAY,
+                    detail=f"OpenAI Sora 2 error ({fresh.status_code}) while downloading video {provider_task_id}"
+                )
+
+            def stream_upstream():
                 try:
-                    file_path.unlink()
-                except:
-                    pass
-            
-            # Fallback: stream directly from OpenAI response
-            return StreamingResponse(
-                resp.iter_content(chunk_size=8192),
-                media_type="video/mp4",
-                headers={
-                    "Content-Disposition": f'inline; filename="sora2-video-{video_id}.mp4"',
-                    "Content-Length": resp.headers.get("Content-Length", ""),
-                }
-            )
+                    yield from fresh.iter_content(chunk_size=64 * 1024)
+                finally:
+                    fresh.close()
+
+            fallback_headers = {"Content-Disposition": f'inline; filename="sora2-video-{video_id}.mp4"'}
+            if fresh.headers.get("Content-Length"):
+                fallback_headers["Content-Length"] = fresh.headers["Content-Length"]
+            return StreamingResponse(stream_upstream(), media_type="video/mp4", headers=fallback_headers)
+        return _stored_media_response(stored_video, f"sora2-video-{video_id}.mp4", request)
     except HTTPException:
         raise
     except requests.exceptions.Timeout:
@@ -3776,6 +4301,128 @@ def download_sora2_video(
         )
 
 
+@app.get("/video/{provider}/{video_id}/download")
+def download_provider_video(
+    provider: str,
+    video_id: str,
+    request: Request,
+    token: Optional[str] = Query(None, description="JWT token for authentication (alternative to Authorization header)"),
+    authorization: Optional[str] = Header(None, alias="Authorization"),
+    uid: Optional[str] = Query(None, description="Signed media URL: user id"),
+    exp: Optional[str] = Query(None, description="Signed media URL: expiry (unix time)"),
+    sig: Optional[str] = Query(None, description="Signed media URL: signature"),
+    db: Session = Depends(get_db),
+):
+    """
+    Serve a Veo3 / Kling video from our storage.
+    If the background prefetch hasn't finished yet, redirect to the provider's result URL.
+    """
+    provider = provider.strip().lower()
+    if provider not in ("veo3", "kling"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unsupported provider: {provider}")
+
+    provider_task_id = video_id.strip()
+    user_id = _media_request_user_id(provider_task_id, token, authorization, uid, exp, sig, db)
+
+    stored_video = _find_stored_video(db, user_id, provider_task_id)
+    if stored_video:
+        media_cache.record_hit(db, stored_video)
+        return _stored_media_response(stored_video, f"{provider}-video-{provider_task_id}.mp4", request)
+    media_cache.record_miss()
+
+    job = None
+    for j in VIDEO_JOBS.values():
+        if (
+            j.get("provider") == provider
+            and str(j.get("provider_task_id") or "") == provider_task_id
+            and j.get("user_id") == user_id
+        ):
+            job = j
+            break
+
+    if not job or not job.get("source_url"):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Video not found: {provider_task_id}. It may have expired."
+        )
+
+    # Not local yet: make sure it's queued, and let the browser fetch from the provider meanwhile
+    _enqueue_video_prefetch(job)
+    return RedirectResponse(url=job["source_url"], status_code=302)
+
+
+@app.get("/video/stored", response_model=List[StoredVideoOut])
+def list_stored_videos(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    The current user's stored (not yet expired) videos with duration / resolution metadata.
+    """
+    return db.query(StoredVideo).filter(
+        StoredVideo.user_id == current_user.id,
+        StoredVideo.expires_at > datetime.utcnow()
+    ).order_by(StoredVideo.id.desc()).all()
+
+
+# ==============================
+# Reference image assets
+# ==============================
+
+
+def _resolve_image_ref(db: Session, user_id: int, value):
+    """
+    Replace an "asset:<id>" reference with the user's uploaded image (ResolvedImage)
+    and a "spool:<token>" reference with the inline image spooled from this request (SpooledImage).
+    Other values (data URLs, http URLs) are returned unchanged.
+    """
+    if request_body.is_spool_ref(value):
+        spooled = request_body.spooled_image(value)
+        if spooled is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown image reference")
+        return spooled
+    if not image_assets.is_asset_ref(value):
+        return value
+    resolved = image_assets.resolve(db, user_id, value)
+    if resolved is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Image asset not found: {value.strip()}. It may have expired, please upload the image again."
+        )
+    return resolved
+
+
+@app.post("/assets/images", response_model=ImageAssetOut)
+def upload_image_asset(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Upload a reference image once (multipart/form-data, field "file").
+    Returns an asset ID; send "asset:<asset_id>" to the generation endpoints instead of a base64 data URL.
+    The upload is streamed to disk in chunks, never held in memory as a whole.
+    """
+    try:
+        asset = image_assets.store_upload(db, current_user.id, file.file)
+    except image_assets.AssetTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=str(e))
+    except image_assets.AssetError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    finally:
+        file.file.close()
+
+    return ImageAssetOut(
+        asset_id=asset.asset_id,
+        ref=f"{image_assets.ASSET_REF_PREFIX}{asset.asset_id}",
+        content_type=asset.content_type,
+        width=asset.width,
+        height=asset.height,
+        file_size=asset.file_size,
+        expires_at=asset.expires_at,
+    )
+
+
 # ==============================
 # Image generation endpoints
 # ==============================
@@ -3851,7 +4498,8 @@ def create_text_to_image_job(
         job_id=job_id,
         status=job["status"],
         provider=job["provider"],
-        image_url=job.get("image_url"),
+        image_url=_client_image_url(job),
+        thumbnails=_client_image_thumbnails(job),
         error=job.get("error"),
         created_at=job["created_at"],
         coins_spent=job.get("coins_spent"),
@@ -3866,47 +4514,14 @@ def create_text_to_image_job(
 @app.post("/admin/videos/cleanup")
 def cleanup_expired_videos(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
 ):
     """
-    Cleanup expired videos (older than 2 days).
-    This endpoint can be called manually or by a cron job.
+    Run the expired-video cleanup now.
+    The same cleanup also runs on a schedule in the background (see media_cleanup.py).
     """
     try:
-        now = datetime.utcnow()
-        expired_videos = db.query(StoredVideo).filter(
-            StoredVideo.expires_at < now
-        ).all()
-        
-        deleted_count = 0
-        deleted_size = 0
-        
-        for video in expired_videos:
-            # Delete file from disk
-            file_path = Path(video.file_path)
-            if file_path.exists():
-                try:
-                    file_size = file_path.stat().st_size
-                    file_path.unlink()
-                    deleted_size += file_size
-                    print(f"[Cleanup] Deleted expired video: {video.file_path} ({file_size} bytes)")
-                except Exception as e:
-                    print(f"[Cleanup] Error deleting file {video.file_path}: {e}")
-            
-            # Delete from database
-            db.delete(video)
-            deleted_count += 1
-        
-        db.commit()
-        
-        return {
-            "deleted_count": deleted_count,
-            "deleted_size_bytes": deleted_size,
-            "deleted_size_mb": round(deleted_size / (1024 * 1024), 2),
-            "message": f"Cleaned up {deleted_count} expired videos"
-        }
+        result = cleanup_service.run_once()
     except Exception as e:
-        db.rollback()
         import traceback
         error_trace = traceback.format_exc()
         print(f"[Cleanup] Error: {error_trace}")
@@ -3914,6 +4529,36 @@ def cleanup_expired_videos(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to cleanup videos: {str(e)}"
         )
+    return {
+        "deleted_count": result["deleted_count"],
+        "deleted_size_bytes": result["deleted_size_bytes"],
+        "deleted_size_mb": result["deleted_size_mb"],
+        "message": f"Cleaned up {result['deleted_count']} expired videos"
+    }
+
+
+@app.post("/admin/media/reconcile")
+def reconcile_media_storage(
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Finish a storage reconciliation pass now: delete orphan files, mark rows whose file is missing as expired.
+    Passes also advance in the background with the scheduled cleanup (see media_reconcile.py).
+    """
+    try:
+        result = reconciler.run_pass()
+    except Exception as e:
+        import traceback
+        print(f"[Reconcile] Error: {traceback.format_exc()}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to reconcile media storage: {str(e)}"
+        )
+    return {
+        **result,
+        "bytes_reclaimed_mb": round(result["bytes_reclaimed"] / (1024 * 1024), 2),
+        "message": f"Deleted {result['orphans_deleted']} orphan files, marked {result['dead_rows_marked']} rows with missing files",
+    }
 
 
 @app.post("/image/image-to-image", response_model=ImageJobOut)
@@ -3926,6 +4571,8 @@ def create_image_to_image_job(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Prompt is required")
     if not body.image_url or not body.image_url.strip():
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Image URL is required")
+    image_ref = _resolve_image_ref(db, current_user.id, body.image_url.strip())
+    image_ref2 = _resolve_image_ref(db, current_user.id, body.image_url2.strip()) if body.image_url2 else None
 
     # Spend coins for generation (5 coins as per user requirement)
     cost_coins = 5
@@ -3950,7 +4597,8 @@ def create_image_to_image_job(
         "coins_spent": cost_coins,
         "coins_balance": int(bal.coins or 0),
         "prompt": body.prompt.strip(),
-        "image_url": body.image_url.strip(),
+        # Only echo plain URLs back: uploaded / inline images would be a reference or megabytes of base64
+        "image_url": image_ref if isinstance(image_ref, str) else None,
         "model": body.model or "kling-v1",
         "mode": body.mode or "entire-image",
         "aspect_ratio": body.aspect_ratio,
@@ -3960,11 +4608,11 @@ def create_image_to_image_job(
     try:
         task_data = _kling_create_image_to_image_task(
             prompt=body.prompt.strip(),
-            image_url=body.image_url.strip(),
+            image_url=image_ref,
             model=body.model or "kling-v1",
             mode=body.mode or "entire-image",
             aspect_ratio=body.aspect_ratio,
-            image_url2=body.image_url2.strip() if body.image_url2 else None,
+            image_url2=image_ref2,
         )
         provider_task_id = _kling_parse_task_id(task_data)
         if provider_task_id:
@@ -3993,7 +4641,8 @@ def create_image_to_image_job(
         job_id=job_id,
         status=job["status"],
         provider=job["provider"],
-        image_url=job.get("image_url"),
+        image_url=_client_image_url(job),
+        thumbnails=_client_image_thumbnails(job),
         error=job.get("error"),
         created_at=job["created_at"],
         coins_spent=job.get("coins_spent"),
@@ -4001,63 +4650,6 @@ def create_image_to_image_job(
     )
 
 
-# ==============================
-# Video cleanup endpoint (remove expired videos)
-# ==============================
-
-@app.post("/admin/videos/cleanup")
-def cleanup_expired_videos(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
-):
-    """
-    Cleanup expired videos (older than 2 days).
-    This endpoint can be called manually or by a cron job.
-    """
-    try:
-        now = datetime.utcnow()
-        expired_videos = db.query(StoredVideo).filter(
-            StoredVideo.expires_at < now
-        ).all()
-        
-        deleted_count = 0
-        deleted_size = 0
-        
-        for video in expired_videos:
-            # Delete file from disk
-            file_path = Path(video.file_path)
-            if file_path.exists():
-                try:
-                    file_size = file_path.stat().st_size
-                    file_path.unlink()
-                    deleted_size += file_size
-                    print(f"[Cleanup] Deleted expired video: {video.file_path} ({file_size} bytes)")
-                except Exception as e:
-                    print(f"[Cleanup] Error deleting file {video.file_path}: {e}")
-            
-            # Delete from database
-            db.delete(video)
-            deleted_count += 1
-        
-        db.commit()
-        
-        return {
-            "deleted_count": deleted_count,
-            "deleted_size_bytes": deleted_size,
-            "deleted_size_mb": round(deleted_size / (1024 * 1024), 2),
-            "message": f"Cleaned up {deleted_count} expired videos"
-        }
-    except Exception as e:
-        db.rollback()
-        import traceback
-        error_trace = traceback.format_exc()
-        print(f"[Cleanup] Error: {error_trace}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to cleanup videos: {str(e)}"
-        )
-
-
 @app.get("/image/job/{job_id}", response_model=ImageJobOut)
 def get_image_job(
     job_id: str,
@@ -4095,7 +4687,8 @@ def get_image_job(
                         job_id=job_id,
                         status=job["status"],
                         provider=job["provider"],
-                        image_url=job.get("image_url"),
+                        image_url=_client_image_url(job),
+                        thumbnails=_client_image_thumbnails(job),
                         error=job.get("error"),
                         created_at=job["created_at"],
                         coins_spent=job.get("coins_spent"),
@@ -4152,8 +4745,11 @@ def get_image_job(
                     # Status is "succeed" per documentation, or image URL found
                     image_url = image_url_from_response or _kling_parse_image_url(st)
                     if image_url:
-                        job["image_url"] = image_url
+                        # Clients get our own URL; the provider's is only used until the mirror lands
+                        job["source_url"] = image_url
+                        job["image_url"] = f"{_backend_url()}/image/{provider}/{task_id}/download"
                         job["status"] = "succeeded"
+                        _enqueue_image_mirror(job)
                     else:
                         # Try to get more info for debugging
                         debug_info = ""
@@ -4185,7 +4781,8 @@ def get_image_job(
         job_id=job_id,
         status=job["status"],
         provider=job["provider"],
-        image_url=job.get("image_url"),
+        image_url=_client_image_url(job),
+        thumbnails=_client_image_thumbnails(job),
         error=job.get("error"),
         created_at=job["created_at"],
         coins_spent=job.get("coins_spent"),
@@ -4193,58 +4790,134 @@ def get_image_job(
     )
 
 
-# ==============================
-# Video cleanup endpoint (remove expired videos)
-# ==============================
+def _client_image_url(job: Dict[str, Any], width: Optional[int] = None) -> Optional[str]:
+    """image_url for API responses: our own download URLs are returned signed."""
+    image_url = job.get("image_url")
+    provider_task_id = job.get("provider_task_id")
+    if job.get("status") != "succeeded" or not image_url or not provider_task_id or job.get("user_id") is None:
+        return image_url
+    if not image_url.startswith(f"{_backend_url()}/image/{job.get('provider')}/"):
+        return image_url
+    if width:
+        image_url = f"{image_url}?{urlencode({'w': width})}"
+    return _sign_media_url(image_url, job["user_id"], f"image/{provider_task_id}")
+
+
+def _client_image_thumbnails(job: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """Signed WebP thumbnail URLs by width, for succeeded jobs served from our storage."""
+    if job.get("status") != "succeeded" or not job.get("source_url"):
+        return None
+    return {str(w): _client_image_url(job, w) for w in media_images.thumb_widths()}
+
+
+def _pick_image_variant(rows: List[StoredImage], width: Optional[int]) -> Optional[StoredImage]:
+    """Smallest WebP variant at least `width` wide, otherwise the original."""
+    original = next((r for r in rows if r.variant == media_images.ORIGINAL), None)
+    if width:
+        variants = [
+            r for r in rows
+            if (media_images.variant_width(r.variant) or 0) >= width
+        ]
+        if variants:
+            return min(variants, key=lambda r: media_images.variant_width(r.variant))
+    return original
 
-@app.post("/admin/videos/cleanup")
-def cleanup_expired_videos(
+
+@app.get("/image/{provider}/{image_id}/download")
+def download_provider_image(
+    provider: str,
+    image_id: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, description="Serve the smallest WebP thumbnail at least this wide"),
+    token: Optional[str] = Query(None, description="JWT token for authentication (alternative to Authorization header)"),
+    authorization: Optional[str] = Header(None, alias="Authorization"),
+    uid: Optional[str] = Query(None, description="Signed media URL: user id"),
+    exp: Optional[str] = Query(None, description="Signed media URL: expiry (unix time)"),
+    sig: Optional[str] = Query(None, description="Signed media URL: signature"),
+    db: Session = Depends(get_db),
+):
+    """
+    Serve a generated image (or a resized WebP thumbnail with ?w=) from local storage.
+    While the mirror is still in flight this redirects to the provider's URL.
+    """
+    provider_task_id = image_id.strip()
+    user_id = _media_request_user_id(f"image/{provider_task_id}", token, authorization, uid, exp, sig, db)
+
+    rows = [r for r in _find_stored_images(db, user_id, provider_task_id) if r.provider == provider]
+    stored_image = _pick_image_variant(rows, w)
+    if stored_image:
+        ext = ".webp" if stored_image.variant != media_images.ORIGINAL else Path(stored_image.file_path).suffix
+        return _stored_media_response(
+            stored_image,
+            f"{provider}-image-{provider_task_id}{ext}",
+            request,
+            media_type=stored_image.content_type or "application/octet-stream",
+        )
+
+    job = None
+    for j in IMAGE_JOBS.values():
+        if (
+            j.get("provider") == provider
+            and str(j.get("provider_task_id")) == provider_task_id
+            and j.get("user_id") == user_id
+        ):
+            job = j
+            break
+
+    if not job or not job.get("source_url"):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Image not found: {provider_task_id}. It may have expired."
+        )
+
+    # Not local yet: make sure it's being mirrored, and let the browser fetch from the provider meanwhile
+    _enqueue_image_mirror(job)
+    return RedirectResponse(url=job["source_url"], status_code=302)
+
+
+@app.get("/image/stored", response_model=List[StoredImageOut])
+def list_stored_images(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """
-    Cleanup expired videos (older than 2 days).
-    This endpoint can be called manually or by a cron job.
+    The current user's mirrored (not yet expired) images, with signed URLs for the original and thumbnails.
     """
-    try:
-        now = datetime.utcnow()
-        expired_videos = db.query(StoredVideo).filter(
-            StoredVideo.expires_at < now
-        ).all()
-        
-        deleted_count = 0
-        deleted_size = 0
-        
-        for video in expired_videos:
-            # Delete file from disk
-            file_path = Path(video.file_path)
-            if file_path.exists():
-                try:
-                    file_size = file_path.stat().st_size
-                    file_path.unlink()
-                    deleted_size += file_size
-                    print(f"[Cleanup] Deleted expired video: {video.file_path} ({file_size} bytes)")
-                except Exception as e:
-                    print(f"[Cleanup] Error deleting file {video.file_path}: {e}")
-            
-            # Delete from database
-            db.delete(video)
-            deleted_count += 1
-        
-        db.commit()
-        
-        return {
-            "deleted_count": deleted_count,
-            "deleted_size_bytes": deleted_size,
-            "deleted_size_mb": round(deleted_size / (1024 * 1024), 2),
-            "message": f"Cleaned up {deleted_count} expired videos"
+    rows = db.query(StoredImage).filter(
+        StoredImage.user_id == current_user.id,
+        StoredImage.expires_at > datetime.utcnow()
+    ).order_by(StoredImage.id.desc()).all()
+
+    results: List[StoredImageOut] = []
+    by_task: Dict[Any, List[StoredImage]] = {}
+    for row in rows:
+        by_task.setdefault((row.provider, row.provider_task_id), []).append(row)
+    for (provider, provider_task_id), group in by_task.items():
+        original = next((r for r in group if r.variant == media_images.ORIGINAL), None)
+        if original is None:
+            continue
+        job = {
+            "status": "succeeded",
+            "user_id": current_user.id,
+            "provider": provider,
+            "provider_task_id": provider_task_id,
+            "image_url": f"{_backend_url()}/image/{provider}/{provider_task_id}/download",
         }
-    except Exception as e:
-        db.rollback()
-        import traceback
-        error_trace = traceback.format_exc()
-        print(f"[Cleanup] Error: {error_trace}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to cleanup videos: {str(e)}"
-        )
\ No newline at end of file
+        thumbnails = {
+            str(media_images.variant_width(r.variant)): _client_image_url(job, media_images.variant_width(r.variant))
+            for r in group
+            if media_images.variant_width(r.variant)
+        }
+        results.append(StoredImageOut(
+            provider=provider,
+            provider_task_id=provider_task_id,
+            job_id=original.job_id,
+            image_url=_client_image_url(job),
+            thumbnails=thumbnails,
+            width=original.width,
+            height=original.height,
+            file_size=original.file_size,
+            created_at=original.created_at,
+            expires_at=original.expires_at,
+        ))
+    return results
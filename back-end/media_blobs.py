@@ -0,0 +1,205 @@
+"""
+Content-addressed media store.
+
+Files are named by the sha256 of their content and shared by every row
+(StoredVideo, images, ...) that points at them. MediaBlob.ref_count tracks
+how many rows reference a blob; the file is deleted when the last one goes.
+
+Key layout: blobs/<first 2 hex chars>/<sha256><ext>, stored through the
+configured media_storage backend (local disk or S3).
+
+Reference counts are only changed by single conditional statements, so they
+hold across workers and instances: a reference is only added to a row that
+still has one (ref_count > 0), and the row is deleted with
+"ref_count <= 0" in the WHERE clause. Whoever's DELETE removed the row
+deletes the file; nobody else does.
+"""
+import hashlib
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import MediaBlob
+from media_storage import get_media_storage, storage_for_location, temp_dir
+
+# Serializes "last reference gone -> delete file" against "same hash stored again"
+_BLOB_LOCK = threading.Lock()
+
+COMMIT_ATTEMPTS = 5
+
+
+def blob_key(sha256: str, ext: str = "") -> str:
+    return f"blobs/{sha256[:2]}/{sha256}{ext}"
+
+
+def write_temp_blob(chunks: Iterable[bytes]) -> Tuple[Path, str, int]:
+    """
+    Stream chunks into a local temporary file, hashing as we go.
+    Returns (temp_path, sha256_hex, size). The caller passes the result to commit_blob().
+    """
+    tmp_path = temp_dir() / f"{uuid4().hex}.part"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                if chunk:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+    except Exception:
+        discard_temp(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+def discard_temp(tmp_path: Path) -> None:
+    try:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    except Exception:
+        pass
+
+
+def add_ref(db: Session, sha256: str) -> bool:
+    """
+    Add a reference to an existing, live blob. Returns False if the blob doesn't exist
+    or its last reference is already gone (it is being deleted and can't be revived).
+    """
+    result = db.execute(
+        update(MediaBlob)
+        .where(MediaBlob.sha256 == sha256, MediaBlob.ref_count > 0)
+        .values(ref_count=MediaBlob.ref_count + 1)
+    )
+    db.commit()
+    return result.rowcount > 0
+
+
+def commit_blob(
+    db: Session,
+    tmp_path: Path,
+    sha256: str,
+    size: int,
+    ext: str = "",
+    content_type: Optional[str] = None,
+) -> MediaBlob:
+    """
+    Move a temp file into the storage backend under its hash and take one reference on it.
+    If the same content is already stored, the temp file is dropped and the
+    existing blob gains a reference instead.
+    """
+    with _BLOB_LOCK:
+        location = None
+        for _ in range(COMMIT_ATTEMPTS):
+            if add_ref(db, sha256):
+                discard_temp(tmp_path)
+                print(f"[Blobs] Reused existing blob {sha256[:12]} ({size} bytes)")
+                return db.get(MediaBlob, sha256)
+
+            if location is None:
+                location = get_media_storage().put_file(tmp_path, blob_key(sha256, ext), content_type)
+            db.add(MediaBlob(
+                sha256=sha256,
+                file_path=location,
+                file_size=size,
+                content_type=content_type,
+                ref_count=1,
+            ))
+            try:
+                db.commit()
+                return db.get(MediaBlob, sha256)
+            except IntegrityError:
+                # Row inserted by another process in the meantime (live: take a ref next
+                # time round), or a dead one another process is about to delete
+                db.rollback()
+                time.sleep(0.05)
+        raise RuntimeError(f"Could not store blob {sha256[:12]}: its row kept changing under us")
+
+
+def release_ref(db: Session, sha256: str) -> int:
+    """
+    Drop one reference. When the last reference goes, the blob row and file are deleted.
+    Returns the number of bytes freed on disk (0 if the blob is still referenced).
+    """
+    with _BLOB_LOCK:
+        db.execute(
+            update(MediaBlob)
+            .where(MediaBlob.sha256 == sha256)
+            .values(ref_count=MediaBlob.ref_count - 1)
+        )
+        location = db.execute(select(MediaBlob.file_path).where(MediaBlob.sha256 == sha256)).scalar()
+        # Only the one DELETE that removes the row owns the file: add_ref() can't revive a
+        # row at zero, so no reference can be taken between the decrement and here
+        result = db.execute(delete(MediaBlob).where(MediaBlob.sha256 == sha256, MediaBlob.ref_count <= 0))
+        db.commit()
+        if result.rowcount != 1:
+            return 0
+        try:
+            freed = storage_for_location(location).delete(location)
+            print(f"[Blobs] Deleted unreferenced blob {sha256[:12]} ({freed} bytes)")
+            return freed
+        except Exception as e:
+            print(f"[Blobs] Error deleting blob {location}: {e}")
+            return 0
+
+
+def release_refs(db: Session, counts: Dict[str, int], delete_files: Callable[[List[str]], int]) -> int:
+    """
+    Batch version of release_ref(): drop counts[sha256] references per blob with one
+    UPDATE each, bulk-delete the blobs that reached zero and hand their locations to
+    delete_files() (e.g. a thread pool). Returns bytes freed.
+    """
+    if not counts:
+        return 0
+    with _BLOB_LOCK:
+        for sha256, n in counts.items():
+            db.execute(
+                update(MediaBlob)
+                .where(MediaBlob.sha256 == sha256)
+                .values(ref_count=MediaBlob.ref_count - n)
+            )
+        dead = db.query(MediaBlob.sha256, MediaBlob.file_path).filter(
+            MediaBlob.sha256.in_(list(counts.keys())),
+            MediaBlob.ref_count <= 0,
+        ).all()
+        # As in release_ref(), a file is deleted only by whoever deleted its row
+        locations = [
+            row.file_path for row in dead
+            if db.execute(
+                delete(MediaBlob).where(MediaBlob.sha256 == row.sha256, MediaBlob.ref_count <= 0)
+            ).rowcount == 1
+        ]
+        db.commit()
+        # Files are deleted while still holding the lock so the same content can't be re-stored mid-delete
+        return delete_files(locations) if locations else 0
+
+
+def delete_orphan_file(db: Session, sha256: str, location: str) -> int:
+    """
+    Delete a blob file that no MediaBlob row points at (e.g. left behind by a crash
+    between put_file() and the row insert). Re-checked under the blob lock so a
+    concurrent commit_blob() of the same content keeps its file. Returns bytes freed.
+    """
+    with _BLOB_LOCK:
+        # A row left at zero references (crash between release_ref()'s two statements)
+        # is removed the same way release_ref() does it; a live row keeps its file
+        result = db.execute(delete(MediaBlob).where(
+            MediaBlob.sha256 == sha256,
+            MediaBlob.file_path == location,
+            MediaBlob.ref_count <= 0,
+        ))
+        db.commit()
+        if result.rowcount != 1:
+            live = db.execute(select(MediaBlob.sha256).where(
+                MediaBlob.sha256 == sha256,
+                MediaBlob.file_path == location,
+            )).first()
+            if live is not None:
+                return 0
+        return storage_for_location(location).delete(location)
@@ -0,0 +1,168 @@
+"""
+Size-bounded LRU cache policy for stored media.
+
+Stored videos are kept while they fit in a byte budget:
+- MEDIA_CACHE_MAX_BYTES          total budget (default 5 GB)
+- MEDIA_CACHE_HIGH_WATERMARK     start evicting above this fraction of the budget (default 0.90)
+- MEDIA_CACHE_LOW_WATERMARK      evict least-recently-used videos until below this fraction (default 0.75)
+- MEDIA_CACHE_MAX_AGE_HOURS      hard max age regardless of use, for privacy (default 48 = 2 days)
+
+Only video bytes count against the budget (blobs referenced by a StoredVideo,
+plus legacy per-user video files), since videos are all eviction can remove.
+Image variants and uploaded assets are bounded by their max age only.
+
+Hit/miss counters and bytes in use are exposed through /debug/metrics.
+"""
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import media_blobs
+from env_config import env_float
+from models import MediaBlob, StoredVideo
+
+# Don't rewrite last_accessed_at on every range request
+ACCESS_TOUCH_INTERVAL = timedelta(seconds=60)
+
+
+def release_video_storage(db: Session, video: StoredVideo) -> int:
+    """
+    Release the storage behind a StoredVideo row (the row itself is deleted by the caller).
+    Blob-backed files are only removed when their last reference goes.
+    Returns bytes freed.
+    """
+    if video.blob_sha256:
+        return media_blobs.release_ref(db, video.blob_sha256)
+
+    # Legacy per-user file
+    file_path = Path(video.file_path)
+    if not file_path.exists():
+        return 0
+    try:
+        file_size = file_path.stat().st_size
+        file_path.unlink()
+        print(f"[Cleanup] Deleted expired video: {video.file_path} ({file_size} bytes)")
+        return file_size
+    except Exception as e:
+        print(f"[Cleanup] Error deleting file {video.file_path}: {e}")
+        return 0
+
+
+class MediaCacheManager:
+    def __init__(self):
+        self.max_bytes = int(env_float("MEDIA_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+        self.high_watermark = env_float("MEDIA_CACHE_HIGH_WATERMARK", 0.90)
+        self.low_watermark = min(self.high_watermark, env_float("MEDIA_CACHE_LOW_WATERMARK", 0.75))
+        self.max_age = timedelta(hours=env_float("MEDIA_CACHE_MAX_AGE_HOURS", 48))
+
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.last_bytes_in_use: Optional[int] = None
+        self.last_measured_at: Optional[datetime] = None  # when last_bytes_in_use was read from the DB
+
+    def expires_at(self, now: Optional[datetime] = None) -> datetime:
+        """Hard expiry for a newly stored video."""
+        return (now or datetime.utcnow()) + self.max_age
+
+    def record_hit(self, db: Session, video: StoredVideo) -> None:
+        with self._lock:
+            self.hits += 1
+        now = datetime.utcnow()
+        if video.last_accessed_at is None or now - video.last_accessed_at >= ACCESS_TOUCH_INTERVAL:
+            try:
+                video.last_accessed_at = now
+                db.add(video)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f"[MediaCache] Could not update last access for video {video.id}: {e}")
+
+    def record_miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def bytes_in_use(self, db: Session) -> int:
+        """Bytes held by stored videos (a blob shared by several videos counts once)."""
+        video_blobs = select(StoredVideo.blob_sha256).where(StoredVideo.blob_sha256.isnot(None))
+        blob_bytes = db.query(func.coalesce(func.sum(MediaBlob.file_size), 0)).filter(
+            MediaBlob.sha256.in_(video_blobs)
+        ).scalar() or 0
+        legacy_bytes = db.query(func.coalesce(func.sum(StoredVideo.file_size), 0)).filter(
+            StoredVideo.blob_sha256.is_(None)
+        ).scalar() or 0
+        used = int(blob_bytes) + int(legacy_bytes)
+        self.last_bytes_in_use = used
+        self.last_measured_at = datetime.utcnow()
+        return used
+
+    def enforce_budget(self, db: Session, batch_size: int = 100) -> int:
+        """
+        If bytes in use exceed the high watermark, evict least-recently-used videos
+        until usage drops below the low watermark. Returns bytes freed.
+        """
+        if not self._evict_lock.acquire(blocking=False):
+            return 0  # another thread is already evicting
+        try:
+            used = self.bytes_in_use(db)
+            if used <= self.max_bytes * self.high_watermark:
+                return 0
+
+            target = self.max_bytes * self.low_watermark
+            print(f"[MediaCache] {used} bytes in use > high watermark, evicting down to {int(target)}")
+            freed_total = 0
+            last_used = func.coalesce(StoredVideo.last_accessed_at, StoredVideo.created_at)
+            while used > target:
+                victims = db.query(StoredVideo).order_by(last_used.asc(), StoredVideo.id.asc()).limit(batch_size).all()
+                if not victims:
+                    break  # nothing left to evict
+                before = used
+                for video in victims:
+                    freed = release_video_storage(db, video)
+                    db.delete(video)
+                    db.commit()
+                    freed_total += freed
+                    used -= freed
+                    with self._lock:
+                        self.evictions += 1
+                        self.evicted_bytes += freed
+                    if used <= target:
+                        break
+                # Re-measure: files already missing on disk free nothing but still leave the budget
+                used = self.bytes_in_use(db)
+                if used >= before:
+                    print(f"[MediaCache] Evicting videos no longer lowers usage ({used} bytes), stopping")
+                    break
+            print(f"[MediaCache] Evicted {freed_total} bytes")
+            return freed_total
+        finally:
+            self._evict_lock.release()
+
+    def metrics(self, db: Optional[Session] = None) -> Dict[str, Any]:
+        used = self.bytes_in_use(db) if db is not None else self.last_bytes_in_use
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "bytes_in_use": used,
+                "bytes_in_use_measured_at": self.last_measured_at.isoformat() if self.last_measured_at else None,
+                "max_bytes": self.max_bytes,
+                "usage_ratio": round(used / self.max_bytes, 4) if used is not None and self.max_bytes else None,
+                "high_watermark": self.high_watermark,
+                "low_watermark": self.low_watermark,
+                "max_age_hours": self.max_age.total_seconds() / 3600,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+            }
+
+
+media_cache = MediaCacheManager()
@@ -0,0 +1,178 @@
+"""
+Scheduled cleanup of expired stored videos, mirrored images and uploaded image assets.
+
+Runs in-process on a background thread every MEDIA_CLEANUP_INTERVAL_SECONDS
+(default 600). Expired StoredVideo, StoredImage and ImageAsset rows are selected in
+keyset-paginated batches (MEDIA_CLEANUP_BATCH_SIZE, default 500), each batch
+is deleted with a single statement and its files are unlinked on a small pool
+(MEDIA_CLEANUP_WORKERS, default 4), so a large backlog never holds one big
+transaction or a request thread. Abandoned partial downloads in storage/tmp
+older than MEDIA_PARTIAL_MAX_AGE_HOURS (default 24) are removed as well, and
+each run advances the storage reconciler (media_reconcile.py) a few steps.
+"""
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete
+
+import media_blobs
+from database import SessionLocal
+from env_config import env_int
+from media_cache import media_cache
+from media_reconcile import reconciler
+from media_storage import storage_for_location, temp_dir
+from models import ImageAsset, StoredImage, StoredVideo
+
+
+def _delete_location(location: str) -> int:
+    try:
+        return storage_for_location(location).delete(location)
+    except Exception as e:
+        print(f"[Cleanup] Error deleting {location}: {e}")
+        return 0
+
+
+class CleanupService:
+    def __init__(self):
+        self.interval_seconds = max(10, env_int("MEDIA_CLEANUP_INTERVAL_SECONDS", 600))
+        self.batch_size = max(1, env_int("MEDIA_CLEANUP_BATCH_SIZE", 500))
+        self.workers = max(1, env_int("MEDIA_CLEANUP_WORKERS", 4))
+        # Resumable download leftovers (.part + checkpoint) untouched this long are dropped
+        self.partial_max_age_seconds = max(1, env_int("MEDIA_PARTIAL_MAX_AGE_HOURS", 24)) * 3600
+
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def _delete_files(self, locations: List[str]) -> int:
+        if not locations:
+            return 0
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="media-cleanup")
+        return sum(self._pool.map(_delete_location, locations))
+
+    def _delete_expired(self, db, model, now: datetime):
+        """Delete expired rows of one media table in keyset batches. Returns (count, bytes freed)."""
+        deleted_count = 0
+        deleted_size = 0
+        last_id = 0
+        while not self._stop.is_set():
+            rows = (
+                db.query(model.id, model.file_path, model.blob_sha256)
+                .filter(model.expires_at < now, model.id > last_id)
+                .order_by(model.id.asc())
+                .limit(self.batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            db.execute(delete(model).where(model.id.in_([row.id for row in rows])))
+            blob_refs = Counter(row.blob_sha256 for row in rows if row.blob_sha256)
+            if blob_refs:
+                # Commits the row deletes together with the ref count updates
+                deleted_size += media_blobs.release_refs(db, dict(blob_refs), self._delete_files)
+            else:
+                db.commit()
+
+            # Legacy per-user files (pre blob store) are owned by a single row
+            deleted_size += self._delete_files([row.file_path for row in rows if not row.blob_sha256])
+            deleted_count += len(rows)
+        return deleted_count, deleted_size
+
+    def run_once(self) -> Dict[str, Any]:
+        """
+        Delete all videos, images and image assets expired as of now, batch by batch.
+        Only one run happens at a time; a concurrent call waits for the running one.
+        """
+        with self._run_lock:
+            started = time.monotonic()
+            now = datetime.utcnow()
+            deleted_count = 0
+            deleted_size = 0
+            db = SessionLocal()
+            try:
+                for model in (StoredVideo, StoredImage, ImageAsset):
+                    count, size = self._delete_expired(db, model, now)
+                    deleted_count += count
+                    deleted_size += size
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+            result = {
+                "deleted_count": deleted_count,
+                "deleted_size_bytes": deleted_size,
+                "deleted_size_mb": round(deleted_size / (1024 * 1024), 2),
+                "duration_ms": int((time.monotonic() - started) * 1000),
+                "finished_at": datetime.utcnow().isoformat(),
+            }
+            self.last_run = result
+            if deleted_count:
+                print(f"[Cleanup] Deleted {deleted_count} expired media rows ({deleted_size} bytes) in {result['duration_ms']} ms")
+            return result
+
+    def remove_stale_partials(self) -> int:
+        """Delete temp download files nobody has written to for partial_max_age_seconds. Returns bytes freed."""
+        cutoff = time.time() - self.partial_max_age_seconds
+        freed = 0
+        for entry in os.scandir(temp_dir()):
+            try:
+                st = entry.stat()
+                if entry.is_file() and st.st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    freed += st.st_size
+            except OSError:
+                continue
+        if freed:
+            print(f"[Cleanup] Removed stale partial downloads ({freed} bytes)")
+        return freed
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[Cleanup] Scheduled cleanup failed: {e}")
+            try:
+                self.remove_stale_partials()
+            except Exception as e:
+                print(f"[Cleanup] Partial download cleanup failed: {e}")
+            db = SessionLocal()
+            try:
+                media_cache.enforce_budget(db)
+            except Exception as e:
+                print(f"[Cleanup] Cache budget enforcement failed: {e}")
+            finally:
+                db.close()
+            try:
+                reconciler.run_steps()
+            except Exception as e:
+                print(f"[Cleanup] Storage reconciliation failed: {e}")
+            self._stop.wait(self.interval_seconds)
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="media-cleanup", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+
+cleanup_service = CleanupService()
@@ -0,0 +1,434 @@
+"""
+Resumable, parallel downloads of upstream media (Sora2 / Veo3 / Kling results).
+
+- Parallel: when the upstream response advertises `Accept-Ranges: bytes` and a
+  Content-Length of at least MEDIA_FETCH_MIN_PARALLEL_MB (default 16), the file is
+  preallocated and split into up to MEDIA_FETCH_CONNECTIONS (default 4) byte
+  ranges fetched concurrently and written in place with os.pwrite. The response
+  that is already open serves the first range, so no extra probe request is made.
+  Anything else is streamed over the single connection.
+- Resumable: bytes go into storage/tmp/<url hash>.part. A sidecar
+  <url hash>.part.json records, per range, how many bytes are on disk (fsynced
+  before they are recorded). A dropped connection is retried up to
+  MEDIA_FETCH_RETRIES times (default 5) with exponential backoff, asking only for
+  the missing bytes (`Range: bytes=N-`, `If-Range` with the ETag/Last-Modified).
+  If every retry fails the .part file is kept, so the next download of the same
+  URL resumes from the checkpoint. The final size is validated against the
+  upstream Content-Length.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+from uuid import uuid4
+
+import requests
+
+import media_blobs
+from env_config import env_float, env_int
+from media_storage import temp_dir
+
+CHUNK_SIZE = 256 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+CHECKPOINT_EVERY_BYTES = 8 * 1024 * 1024
+MAX_BACKOFF_SECONDS = 10.0
+
+# Request headers that must not be replayed on the ranged requests
+_HOP_HEADERS = {"range", "if-range", "content-length", "cookie", "host"}
+
+# Upstream statuses worth retrying; any other 4xx is final
+_RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class RangeFetchError(Exception):
+    """A ranged request didn't return the bytes we asked for."""
+
+
+class _RangesNotHonored(Exception):
+    """Upstream answered a ranged request with the full body."""
+
+
+def _connections() -> int:
+    return max(1, env_int("MEDIA_FETCH_CONNECTIONS", 4))
+
+
+def _min_parallel_bytes() -> int:
+    return max(1, env_int("MEDIA_FETCH_MIN_PARALLEL_MB", 16)) * 1024 * 1024
+
+
+def _retries() -> int:
+    return max(0, env_int("MEDIA_FETCH_RETRIES", 5))
+
+
+def _backoff_base() -> float:
+    return max(0.0, env_float("MEDIA_FETCH_BACKOFF_SECONDS", 0.5))
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    "parallel_downloads": 0,
+    "single_stream_downloads": 0,
+    "parallel_fallbacks": 0,
+    "retries": 0,
+    "resumed_downloads": 0,
+    "resumed_bytes": 0,  # bytes already on disk when a range was resumed (not fetched again)
+    "bytes_downloaded": 0,
+    "last_download": None,
+}
+
+
+def _count(name: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += n
+
+
+def _record(parallel: bool, size: int, seconds: float, connections: int) -> None:
+    with _stats_lock:
+        _stats["parallel_downloads" if parallel else "single_stream_downloads"] += 1
+        _stats["bytes_downloaded"] += size
+        _stats["last_download"] = {
+            "mode": "parallel" if parallel else "single",
+            "connections": connections,
+            "bytes": size,
+            "seconds": round(seconds, 3),
+            "mb_per_second": round(size / seconds / (1024 * 1024), 2) if seconds > 0 else None,
+        }
+
+
+def metrics() -> Dict[str, Any]:
+    with _stats_lock:
+        return {
+            **_stats,
+            "connections": _connections(),
+            "min_parallel_bytes": _min_parallel_bytes(),
+            "max_retries": _retries(),
+        }
+
+
+# One download per URL at a time owns its .part file. Only URLs being downloaded
+# are kept: provider URLs are signed and unique, so a per-URL lock table would grow forever.
+_active_urls: Set[str] = set()
+_active_urls_guard = threading.Lock()
+
+
+def _claim_url(key: str) -> bool:
+    with _active_urls_guard:
+        if key in _active_urls:
+            return False
+        _active_urls.add(key)
+        return True
+
+
+def _release_url(key: str) -> None:
+    with _active_urls_guard:
+        _active_urls.discard(key)
+
+
+def _original_request(resp: requests.Response) -> requests.PreparedRequest:
+    # Replay the first hop so redirects (e.g. to a CDN) are followed the same way,
+    # and credentials are dropped on cross-host redirects as requests does
+    return resp.history[0].request if resp.history else resp.request
+
+
+def _pwrite(fd: int, data: bytes, offset: int) -> None:
+    if hasattr(os, "pwrite"):
+        os.pwrite(fd, data, offset)
+    else:
+        # Only reached with a single range (no concurrent writers)
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _split(size: int, parts: int) -> List[List[Optional[int]]]:
+    """[start, end (inclusive), next byte to write] for each range covering size bytes."""
+    step = -(-size // parts)
+    return [[start, min(start + step, size) - 1, start] for start in range(0, size, step)]
+
+
+class _Download:
+    """State of one download: the .part file, its ranges and the sidecar checkpoint."""
+
+    def __init__(self, part_path: Path, url: str, headers: Dict[str, str], validator: Optional[str], size: Optional[int]):
+        self.part_path = part_path
+        self.sidecar_path = part_path.with_name(part_path.name + ".json")
+        self.url = url
+        self.headers = {k: v for k, v in headers.items() if k.lower() not in _HOP_HEADERS}
+        self.validator = validator
+        self.size = size
+        self.ranges: List[List[Optional[int]]] = [[0, None if size is None else size - 1, 0]]
+        self.fd: Optional[int] = None
+        self._lock = threading.Lock()
+        self._unsaved = 0
+
+    def load_checkpoint(self) -> int:
+        """Adopt ranges from a previous attempt at the same content. Returns bytes already on disk."""
+        if not self.validator or not self.part_path.exists():
+            return 0
+        try:
+            with open(self.sidecar_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if state.get("url") != self.url or state.get("validator") != self.validator or state.get("size") != self.size:
+            return 0
+        ranges = state.get("ranges") or []
+        if not ranges or any(len(r) != 3 for r in ranges):
+            return 0
+        self.ranges = ranges
+        return self.bytes_done()
+
+    def bytes_done(self) -> int:
+        return sum(r[2] - r[0] for r in self.ranges)
+
+    def open(self, preallocate: bool) -> None:
+        self.fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        if preallocate and self.size:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(self.fd, 0, self.size)
+            else:
+                os.ftruncate(self.fd, self.size)
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def write(self, index: int, data: bytes) -> bool:
+        """Write the next bytes of a range. Returns True once the range is complete."""
+        start, end, pos = self.ranges[index]
+        if end is not None:
+            data = data[:end + 1 - pos]
+        _pwrite(self.fd, data, pos)
+        with self._lock:
+            self.ranges[index][2] = pos + len(data)
+            self._unsaved += len(data)
+            if self._unsaved >= CHECKPOINT_EVERY_BYTES:
+                self._save_locked()
+        return end is not None and pos + len(data) > end
+
+    def restart(self, validator: Optional[str], size: Optional[int]) -> None:
+        """Content changed (or ranges unsupported): start over as one range."""
+        with self._lock:
+            self.validator = validator
+            self.size = size
+            self.ranges = [[0, None if size is None else size - 1, 0]]
+            os.ftruncate(self.fd, 0)
+            self._save_locked()
+
+    def checkpoint(self) -> None:
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self) -> None:
+        if not self.validator:
+            return  # without a validator we can't tell later whether the bytes still match
+        os.fsync(self.fd)  # bytes must be on disk before the sidecar claims them
+        tmp = self.sidecar_path.with_name(self.sidecar_path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"url": self.url, "validator": self.validator, "size": self.size, "ranges": self.ranges}, f)
+        os.replace(tmp, self.sidecar_path)
+        self._unsaved = 0
+
+    def discard(self) -> None:
+        self.close()
+        media_blobs.discard_temp(self.part_path)
+        media_blobs.discard_temp(self.sidecar_path)
+
+
+def _validator(resp: requests.Response) -> Optional[str]:
+    etag = resp.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return resp.headers.get("Last-Modified")
+
+
+def _content_size(resp: requests.Response) -> Optional[int]:
+    """Size of the full resource, if the response tells us."""
+    if resp.status_code == 206:
+        total = resp.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    if resp.headers.get("Content-Encoding", "identity").lower() != "identity":
+        return None  # Content-Length is the compressed size
+    length = resp.headers.get("Content-Length", "")
+    return int(length) if length.isdigit() else None
+
+
+def _range_request(dl: _Download, index: int) -> requests.Response:
+    start, end, pos = dl.ranges[index]
+    headers = dict(dl.headers)
+    headers["Range"] = f"bytes={pos}-{'' if end is None else end}"
+    headers["Accept-Encoding"] = "identity"
+    if dl.validator:
+        headers["If-Range"] = dl.validator
+    resp = requests.get(dl.url, headers=headers, timeout=120, stream=True)
+    if resp.status_code == 206:
+        content_range = resp.headers.get("Content-Range", "")
+        if not content_range.startswith(f"bytes {pos}-"):
+            resp.close()
+            raise RangeFetchError(f"Asked for bytes {pos}-, got Content-Range {content_range or '(none)'}")
+        return resp
+    if resp.status_code == 200:
+        if len(dl.ranges) == 1:
+            return resp  # caller starts over from byte 0
+        resp.close()
+        raise _RangesNotHonored()
+    try:
+        resp.raise_for_status()
+    finally:
+        resp.close()
+    raise RangeFetchError(f"Unexpected status {resp.status_code}")
+
+
+def _fetch_range(dl: _Download, index: int, resp: Optional[requests.Response] = None) -> None:
+    """Fill one range, resuming from the last written byte after transient failures."""
+    attempt = 0
+    while True:
+        start, end, pos = dl.ranges[index]
+        if end is not None and pos > end:
+            if resp is not None:
+                resp.close()
+            return
+        try:
+            if resp is None:
+                resp = _range_request(dl, index)
+                if resp.status_code == 200:
+                    # Ranges unsupported, or If-Range says the content changed: start over
+                    if pos > 0:
+                        dl.restart(_validator(resp), _content_size(resp))
+                elif pos > start:
+                    _count("resumed_bytes", pos - start)
+                if dl.size is None and resp.status_code == 206:
+                    dl.size = _content_size(resp)
+
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk and dl.write(index, chunk):
+                    return
+            if dl.ranges[index][1] is None:
+                # Open-ended stream finished cleanly: now we know the size
+                dl.ranges[index][1] = dl.ranges[index][2] - 1
+                return
+            raise RangeFetchError(
+                f"Connection closed at byte {dl.ranges[index][2]}, expected up to {dl.ranges[index][1]}"
+            )
+        except _RangesNotHonored:
+            raise
+        except (requests.RequestException, RangeFetchError) as e:
+            status_code = getattr(getattr(e, "response", None), "status_code", None)
+            if status_code is not None and status_code not in _RETRY_STATUSES:
+                raise
+            attempt += 1
+            if attempt > _retries():
+                raise
+            delay = min(MAX_BACKOFF_SECONDS, _backoff_base() * (2 ** (attempt - 1)))
+            print(f"[Fetch] Range {index} interrupted at byte {dl.ranges[index][2]} ({e}); retry {attempt} in {delay:.1f}s")
+            _count("retries")
+            dl.checkpoint()
+            time.sleep(delay)
+        finally:
+            if resp is not None:
+                resp.close()
+                resp = None
+
+
+def _run(dl: _Download, resp: Optional[requests.Response]) -> None:
+    """Fetch every unfinished range; the open response (starting at byte 0) serves range 0."""
+    first = resp if dl.ranges[0][2] == 0 else None
+    if first is None and resp is not None:
+        resp.close()
+    pending = [i for i, r in enumerate(dl.ranges) if r[1] is None or r[2] <= r[1]]
+    if first is not None and 0 not in pending:
+        first.close()
+    if len(pending) == 1:
+        _fetch_range(dl, pending[0], first if pending[0] == 0 else None)
+        return
+    with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix="media-fetch") as pool:
+        futures = [pool.submit(_fetch_range, dl, i, first if i == 0 else None) for i in pending]
+        for future in futures:
+            future.result()
+
+
+def download_to_temp(resp: requests.Response) -> Tuple[Path, str, int]:
+    """
+    Download an upstream response (status already checked by the caller) into a temp file.
+    Returns (temp_path, sha256_hex, size), like media_blobs.write_temp_blob().
+    Raises after MEDIA_FETCH_RETRIES failed attempts; the partial file is kept for the next try.
+    """
+    started = time.monotonic()
+    request = _original_request(resp)
+    key = hashlib.sha256(request.url.encode()).hexdigest()[:32]
+    owns_part = _claim_url(key)
+    if owns_part:
+        part_path = temp_dir() / f"{key}.part"
+    else:
+        # Same URL already downloading in another thread: don't share its .part file
+        part_path = temp_dir() / f"{uuid4().hex}.part"
+
+    try:
+        size = _content_size(resp)
+        dl = _Download(part_path, request.url, dict(request.headers), _validator(resp), size)
+        resumed = dl.load_checkpoint()
+        if resumed:
+            print(f"[Fetch] Resuming {part_path.name} from checkpoint ({resumed} bytes on disk)")
+            _count("resumed_downloads")
+        else:
+            media_blobs.discard_temp(part_path)
+            connections = min(_connections(), -(-size // CHUNK_SIZE)) if size else 1
+            if (
+                size
+                and size >= _min_parallel_bytes()
+                and connections > 1
+                and resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+                and hasattr(os, "pwrite")
+            ):
+                dl.ranges = _split(size, connections)
+
+        dl.open(preallocate=not resumed)
+        try:
+            try:
+                _run(dl, resp)
+            except _RangesNotHonored:
+                print("[Fetch] Upstream ignored byte ranges, downloading as a single stream")
+                _count("parallel_fallbacks")
+                fresh = requests.get(dl.url, headers=dl.headers, timeout=120, stream=True)
+                fresh.raise_for_status()
+                dl.restart(_validator(fresh), _content_size(fresh))
+                _run(dl, fresh)
+
+            total = dl.size if dl.size is not None else dl.ranges[-1][1] + 1
+            if any(r[1] is None or r[2] <= r[1] for r in dl.ranges) or dl.bytes_done() != total:
+                raise RangeFetchError(f"Incomplete download: {dl.bytes_done()} of {total} bytes")
+            os.ftruncate(dl.fd, total)
+        except Exception:
+            if dl.validator:
+                dl.checkpoint()  # keep the .part file for the next attempt
+                dl.close()
+            else:
+                dl.discard()
+            raise
+        dl.close()
+
+        # Hand the finished file over under a unique name so the .part slot is free again
+        tmp_path = temp_dir() / f"{uuid4().hex}.download"
+        os.replace(part_path, tmp_path)
+        media_blobs.discard_temp(dl.sidecar_path)
+    finally:
+        if owns_part:
+            _release_url(key)
+
+    _record(len(dl.ranges) > 1, total, time.monotonic() - started, len(dl.ranges))
+    return tmp_path, _hash_file(tmp_path), total
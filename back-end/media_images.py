@@ -0,0 +1,152 @@
+"""
+Mirroring of provider image results (Kling) into our media store.
+
+The original is fetched once into the content-addressed blob store and
+resized WebP variants are generated with Pillow:
+- MEDIA_IMAGE_THUMB_WIDTHS     comma-separated widths (default "320,640,1280");
+                               widths >= the original's are skipped
+- MEDIA_IMAGE_WEBP_QUALITY     WebP quality for the variants (default 80)
+
+Every file is a StoredImage row (variant "original" or "w<width>") holding a
+MediaBlob reference, expiring with the same max age as stored videos.
+"""
+import io
+import os
+from typing import List, Optional, Tuple
+
+import requests
+from sqlalchemy.orm import Session
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    Image = None
+    PIL_AVAILABLE = False
+
+import media_blobs
+import media_fetch
+from media_cache import media_cache
+from models import StoredImage
+
+ORIGINAL = "original"
+
+_FORMAT_EXT = {
+    "JPEG": (".jpg", "image/jpeg"),
+    "PNG": (".png", "image/png"),
+    "WEBP": (".webp", "image/webp"),
+    "GIF": (".gif", "image/gif"),
+}
+
+
+def thumb_widths() -> List[int]:
+    raw = (os.getenv("MEDIA_IMAGE_THUMB_WIDTHS") or "320,640,1280").strip().strip('"').strip("'")
+    widths = set()
+    for part in raw.split(","):
+        part = part.strip()
+        if part.isdigit() and int(part) > 0:
+            widths.add(int(part))
+    return sorted(widths)
+
+
+def _webp_quality() -> int:
+    try:
+        return min(100, max(1, int((os.getenv("MEDIA_IMAGE_WEBP_QUALITY") or "80").strip())))
+    except ValueError:
+        return 80
+
+
+def variant_width(variant: str) -> Optional[int]:
+    return int(variant[1:]) if variant.startswith("w") and variant[1:].isdigit() else None
+
+
+def render_variants(path) -> Tuple[str, int, int, List[Tuple[int, int, bytes]]]:
+    """
+    Decode an image file and encode the WebP variants.
+    Returns (PIL format, width, height, [(variant_width, variant_height, webp_bytes), ...]).
+    Variants are produced largest first, each resized from the previous one.
+    """
+    with Image.open(path) as img:
+        fmt = img.format or ""
+        width, height = img.size
+        img.load()
+        source = img if img.mode in ("RGB", "RGBA") else img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        variants = []
+        for w in sorted((w for w in thumb_widths() if w < width), reverse=True):
+            h = max(1, round(height * w / width))
+            source = source.resize((w, h), Image.Resampling.LANCZOS)
+            buf = io.BytesIO()
+            source.save(buf, format="WEBP", quality=_webp_quality(), method=4)
+            variants.append((w, h, buf.getvalue()))
+    return fmt, width, height, variants
+
+
+def _create_row(
+    db: Session,
+    user_id: int,
+    provider: str,
+    provider_task_id: str,
+    job_id: Optional[str],
+    variant: str,
+    blob,
+    width: Optional[int],
+    height: Optional[int],
+) -> StoredImage:
+    row = StoredImage(
+        user_id=user_id,
+        provider=provider,
+        provider_task_id=provider_task_id,
+        job_id=job_id,
+        variant=variant,
+        file_path=blob.file_path,
+        file_size=blob.file_size,
+        blob_sha256=blob.sha256,
+        content_type=blob.content_type,
+        width=width,
+        height=height,
+        expires_at=media_cache.expires_at(),
+    )
+    db.add(row)
+    db.commit()
+    db.refresh(row)
+    return row
+
+
+def mirror_image(
+    db: Session,
+    user_id: int,
+    provider: str,
+    provider_task_id: str,
+    job_id: Optional[str],
+    url: str,
+) -> List[StoredImage]:
+    """
+    Fetch a provider image into the blob store and add its WebP variants.
+    Returns the StoredImage rows (original first).
+    """
+    resp = requests.get(url, timeout=60, stream=True)
+    if resp.status_code >= 400:
+        resp.close()
+        raise RuntimeError(f"Image download failed with status {resp.status_code}")
+    tmp_path, sha256, size = media_fetch.download_to_temp(resp)
+
+    try:
+        fmt, width, height, variants = render_variants(tmp_path) if PIL_AVAILABLE else ("", None, None, [])
+    except Exception as e:
+        print(f"[Images] Could not decode {provider_task_id}, storing original only: {e}")
+        fmt, width, height, variants = "", None, None, []
+
+    ext, content_type = _FORMAT_EXT.get(fmt, ("", resp.headers.get("Content-Type") or "application/octet-stream"))
+    blob = media_blobs.commit_blob(db, tmp_path, sha256, size, ext=ext, content_type=content_type)
+    rows = [_create_row(db, user_id, provider, provider_task_id, job_id, ORIGINAL, blob, width, height)]
+
+    for w, h, data in variants:
+        v_tmp, v_sha, v_size = media_blobs.write_temp_blob([data])
+        v_blob = media_blobs.commit_blob(db, v_tmp, v_sha, v_size, ext=".webp", content_type="image/webp")
+        rows.append(_create_row(db, user_id, provider, provider_task_id, job_id, f"w{w}", v_blob, w, h))
+
+    print(
+        f"[Images] Mirrored {provider} {provider_task_id}: {size} bytes original, "
+        f"variants {[(r.variant, r.file_size) for r in rows[1:]]}"
+    )
+    return rows
@@ -0,0 +1,279 @@
+"""
+Reconciliation of local media files against the database.
+
+Crashes between writing a file and committing its row leave orphan files,
+and files removed behind our back leave dead rows. The reconciler finds both
+without ever holding a whole table or directory listing in memory:
+
+- blobs:  storage/blobs/<2 hex>/<sha256><ext> is walked one shard at a time.
+          The shard's os.scandir() entries are sorted by sha256 and merged
+          against MediaBlob rows read in keyset batches of the same shard
+          (sha256 is hex, so Python and SQL agree on the order).
+- videos: legacy per-user files in the flat storage/videos directory
+          (pre blob store) are streamed from os.scandir() in chunks and
+          looked up by path; legacy StoredVideo rows are then checked in
+          keyset batches by id.
+
+Orphan files older than MEDIA_RECONCILE_GRACE_MINUTES (default 60) are
+deleted. Rows whose file is missing are marked expired, so the cleanup
+service deletes them and releases their blob references.
+
+Work is split into steps (one shard or one batch of MEDIA_RECONCILE_BATCH_SIZE,
+default 1000) behind a cursor, so the cleanup loop can advance a pass a few
+steps per interval (MEDIA_RECONCILE_STEPS_PER_RUN, default 16).
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import update
+
+import media_blobs
+from database import SessionLocal
+from env_config import env_int
+from media_storage import STORAGE_ROOT, storage_for_location
+from models import ImageAsset, MediaBlob, StoredImage, StoredVideo
+
+SHARDS = [f"{i:02x}" for i in range(256)]
+
+
+def _new_pass() -> Dict[str, Any]:
+    return {
+        "started_at": datetime.utcnow().isoformat(),
+        "files_scanned": 0,
+        "rows_scanned": 0,
+        "orphans_deleted": 0,
+        "orphans_skipped_recent": 0,
+        "bytes_reclaimed": 0,
+        "dead_blobs": 0,
+        "dead_rows_marked": 0,
+    }
+
+
+class StorageReconciler:
+    def __init__(self, root=STORAGE_ROOT):
+        self.blobs_dir = os.path.join(str(root), "blobs")
+        self.videos_dir = os.path.join(str(root), "videos")
+        self.batch_size = max(1, env_int("MEDIA_RECONCILE_BATCH_SIZE", 1000))
+        self.steps_per_run = max(1, env_int("MEDIA_RECONCILE_STEPS_PER_RUN", 16))
+        self.grace_seconds = max(0, env_int("MEDIA_RECONCILE_GRACE_MINUTES", 60)) * 60
+
+        self._lock = threading.Lock()
+        # Cursor: the phase we're in and where to resume inside it
+        self._phase = "blobs"
+        self._shard = 0
+        self._video_files: Optional[Iterator[os.DirEntry]] = None
+        self._last_row_id = 0
+        self._pass: Dict[str, Any] = _new_pass()
+        self.last_pass: Optional[Dict[str, Any]] = None
+
+    # ---- orphan / dead handling ----
+
+    def _is_recent(self, st: os.stat_result) -> bool:
+        return st.st_mtime > time.time() - self.grace_seconds
+
+    def _remove_orphan(self, db, path: str, st: os.stat_result, sha256: Optional[str] = None) -> None:
+        if self._is_recent(st):
+            self._pass["orphans_skipped_recent"] += 1
+            return
+        try:
+            if sha256:
+                freed = media_blobs.delete_orphan_file(db, sha256, path)
+            else:
+                freed = storage_for_location(path).delete(path)
+        except Exception as e:
+            print(f"[Reconcile] Error deleting orphan {path}: {e}")
+            return
+        if freed:
+            self._pass["orphans_deleted"] += 1
+            self._pass["bytes_reclaimed"] += freed
+            print(f"[Reconcile] Deleted orphan file {path} ({freed} bytes)")
+
+    def _mark_expired(self, db, model, *criteria) -> int:
+        now = datetime.utcnow()
+        result = db.execute(
+            update(model)
+            .where(model.expires_at > now, *criteria)
+            .values(expires_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount or 0
+
+    # ---- phases ----
+
+    def _reconcile_shard(self, db, shard: str) -> None:
+        """Sorted merge of one blob shard directory against its MediaBlob rows."""
+        files = []
+        shard_dir = os.path.join(self.blobs_dir, shard)
+        if os.path.isdir(shard_dir):
+            with os.scandir(shard_dir) as it:
+                for entry in it:
+                    if entry.is_file(follow_symlinks=False) and not entry.name.endswith(".part"):
+                        files.append((entry.name[:64], entry.path, entry.stat(follow_symlinks=False)))
+        files.sort()
+        self._pass["files_scanned"] += len(files)
+
+        dead: List[str] = []
+        i = 0
+        last_sha = shard
+        while True:
+            rows = (
+                db.query(MediaBlob.sha256, MediaBlob.file_path)
+                .filter(MediaBlob.sha256 > last_sha, MediaBlob.sha256 < shard + "g")
+                .order_by(MediaBlob.sha256.asc())
+                .limit(self.batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            last_sha = rows[-1].sha256
+            self._pass["rows_scanned"] += len(rows)
+
+            for row in rows:
+                while i < len(files) and files[i][0] < row.sha256:
+                    self._remove_orphan(db, files[i][1], files[i][2], files[i][0])
+                    i += 1
+                found = False
+                while i < len(files) and files[i][0] == row.sha256:
+                    if files[i][1] == row.file_path:
+                        found = True
+                    else:
+                        # Same content under another extension: the row points elsewhere
+                        self._remove_orphan(db, files[i][1], files[i][2], files[i][0])
+                    i += 1
+                # Only local blobs can be judged from the directory listing
+                if not found and storage_for_location(row.file_path).local_path(row.file_path) is not None:
+                    if not os.path.exists(row.file_path):
+                        dead.append(row.sha256)
+
+        for sha256, path, st in files[i:]:
+            self._remove_orphan(db, path, st, sha256)
+
+        if dead:
+            self._pass["dead_blobs"] += len(dead)
+            marked = self._mark_expired(db, StoredVideo, StoredVideo.blob_sha256.in_(dead))
+            marked += self._mark_expired(db, StoredImage, StoredImage.blob_sha256.in_(dead))
+            marked += self._mark_expired(db, ImageAsset, ImageAsset.blob_sha256.in_(dead))
+            db.commit()
+            self._pass["dead_rows_marked"] += marked
+            print(f"[Reconcile] {len(dead)} blobs in shard {shard} are missing on disk; marked {marked} rows expired")
+
+    def _reconcile_video_files(self, db) -> bool:
+        """One chunk of the legacy video directory. Returns True when the directory is exhausted."""
+        if self._video_files is None:
+            if not os.path.isdir(self.videos_dir):
+                return True
+            self._video_files = os.scandir(self.videos_dir)
+
+        chunk = []
+        for entry in self._video_files:
+            if entry.is_file(follow_symlinks=False):
+                chunk.append((entry.path, entry.stat(follow_symlinks=False)))
+                if len(chunk) >= self.batch_size:
+                    break
+        self._pass["files_scanned"] += len(chunk)
+
+        if chunk:
+            paths = [path for path, _ in chunk]
+            known = {
+                row.file_path
+                for row in db.query(StoredVideo.file_path).filter(StoredVideo.file_path.in_(paths)).all()
+            }
+            for path, st in chunk:
+                if path not in known:
+                    self._remove_orphan(db, path, st)
+
+        if len(chunk) < self.batch_size:
+            self._video_files.close()
+            self._video_files = None
+            return True
+        return False
+
+    def _reconcile_video_rows(self, db) -> bool:
+        """One keyset batch of legacy StoredVideo rows. Returns True when all rows were checked."""
+        rows = (
+            db.query(StoredVideo.id, StoredVideo.file_path)
+            .filter(StoredVideo.blob_sha256.is_(None), StoredVideo.id > self._last_row_id)
+            .order_by(StoredVideo.id.asc())
+            .limit(self.batch_size)
+            .all()
+        )
+        if not rows:
+            return True
+        self._last_row_id = rows[-1].id
+        self._pass["rows_scanned"] += len(rows)
+
+        dead = [
+            row.id for row in rows
+            if storage_for_location(row.file_path).local_path(row.file_path) is not None
+            and not os.path.exists(row.file_path)
+        ]
+        if dead:
+            marked = self._mark_expired(db, StoredVideo, StoredVideo.id.in_(dead))
+            db.commit()
+            self._pass["dead_rows_marked"] += marked
+        return len(rows) < self.batch_size
+
+    # ---- driving ----
+
+    def step(self) -> bool:
+        """Advance the current pass by one unit of work. Returns True when a pass just finished."""
+        with self._lock:
+            db = SessionLocal()
+            try:
+                if self._phase == "blobs":
+                    self._reconcile_shard(db, SHARDS[self._shard])
+                    self._shard += 1
+                    if self._shard >= len(SHARDS):
+                        self._phase = "video_files"
+                elif self._phase == "video_files":
+                    if self._reconcile_video_files(db):
+                        self._phase = "video_rows"
+                elif self._reconcile_video_rows(db):
+                    return self._finish_pass()
+                return False
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+    def _finish_pass(self) -> bool:
+        result = dict(self._pass, finished_at=datetime.utcnow().isoformat())
+        self.last_pass = result
+        self._phase = "blobs"
+        self._shard = 0
+        self._last_row_id = 0
+        self._pass = _new_pass()
+        if result["orphans_deleted"] or result["dead_rows_marked"]:
+            print(
+                f"[Reconcile] Pass done: {result['orphans_deleted']} orphan files "
+                f"({result['bytes_reclaimed']} bytes) deleted, {result['dead_rows_marked']} dead rows marked"
+            )
+        return True
+
+    def run_steps(self, max_steps: Optional[int] = None) -> bool:
+        """Run up to max_steps (default steps_per_run) steps. Returns True if a pass finished."""
+        for _ in range(max_steps or self.steps_per_run):
+            if self.step():
+                return True
+        return False
+
+    def run_pass(self) -> Dict[str, Any]:
+        """Finish the current pass (or run a whole new one) and return its report."""
+        while not self.step():
+            pass
+        return self.last_pass
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "phase": self._phase,
+            "shard": self._shard,
+            "current_pass": dict(self._pass),
+            "last_pass": self.last_pass,
+        }
+
+
+reconciler = StorageReconciler()
@@ -0,0 +1,254 @@
+"""
+Storage backends for media files (videos, images).
+
+- local: files under back-end/storage (default)
+- s3:    any S3-compatible bucket (AWS S3, MinIO, R2, ...); downloads are
+         answered with short-lived presigned URLs so bytes bypass the API
+
+Configure with MEDIA_STORAGE_BACKEND=local|s3. S3 settings:
+S3_BUCKET, S3_ENDPOINT_URL (MinIO/R2), S3_REGION, S3_ACCESS_KEY_ID,
+S3_SECRET_ACCESS_KEY, S3_KEY_PREFIX, S3_PRESIGN_EXPIRE_SECONDS.
+
+Rows store a "location": an absolute path for local files, s3://bucket/key for S3.
+"""
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional
+
+from env_config import env_int, env_str
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+    BOTO3_AVAILABLE = True
+except ImportError:
+    boto3 = None
+    ClientError = Exception
+    BOTO3_AVAILABLE = False
+
+STORAGE_ROOT = Path(__file__).resolve().parent / "storage"
+
+
+class MediaStorage(ABC):
+    """Interface shared by all storage backends."""
+
+    name = "base"
+
+    @abstractmethod
+    def put_file(self, local_path: Path, key: str, content_type: Optional[str] = None) -> str:
+        """Move a finished local file into storage under `key`. Returns its location."""
+
+    @abstractmethod
+    def delete(self, location: str) -> int:
+        """Delete the object. Returns bytes freed (0 if it didn't exist)."""
+
+    @abstractmethod
+    def exists(self, location: str) -> bool:
+        pass
+
+    @abstractmethod
+    def size(self, location: str) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def open(self, location: str) -> BinaryIO:
+        pass
+
+    def local_path(self, location: str) -> Optional[Path]:
+        """Filesystem path when the object lives on local disk, else None."""
+        return None
+
+    def presigned_url(
+        self,
+        location: str,
+        expires_in: Optional[int] = None,
+        filename: Optional[str] = None,
+        content_type: Optional[str] = None,
+    ) -> Optional[str]:
+        """Short-lived direct download URL, or None if the backend can't presign."""
+        return None
+
+
+class LocalMediaStorage(MediaStorage):
+    name = "local"
+
+    def __init__(self, root: Path = STORAGE_ROOT):
+        self.root = Path(root)
+
+    def put_file(self, local_path: Path, key: str, content_type: Optional[str] = None) -> str:
+        dest = self.root / key
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(local_path, dest)
+        return str(dest)
+
+    def delete(self, location: str) -> int:
+        path = Path(location)
+        try:
+            freed = path.stat().st_size
+            path.unlink()
+            return freed
+        except FileNotFoundError:
+            return 0
+
+    def exists(self, location: str) -> bool:
+        return os.path.exists(location)
+
+    def size(self, location: str) -> Optional[int]:
+        try:
+            return os.path.getsize(location)
+        except OSError:
+            return None
+
+    def open(self, location: str) -> BinaryIO:
+        return open(location, "rb")
+
+    def local_path(self, location: str) -> Optional[Path]:
+        return Path(location)
+
+
+class S3MediaStorage(MediaStorage):
+    name = "s3"
+
+    def __init__(
+        self,
+        bucket: str,
+        client=None,
+        key_prefix: str = "",
+        presign_expire_seconds: int = 300,
+    ):
+        if client is None:
+            if not BOTO3_AVAILABLE:
+                raise RuntimeError("MEDIA_STORAGE_BACKEND=s3 requires boto3: pip install boto3")
+            client = boto3.client(
+                "s3",
+                endpoint_url=env_str("S3_ENDPOINT_URL"),
+                region_name=env_str("S3_REGION"),
+                aws_access_key_id=env_str("S3_ACCESS_KEY_ID"),
+                aws_secret_access_key=env_str("S3_SECRET_ACCESS_KEY"),
+            )
+        self.client = client
+        self.bucket = bucket
+        self.key_prefix = key_prefix.strip("/")
+        self.presign_expire_seconds = presign_expire_seconds
+
+    def _location(self, key: str) -> str:
+        full_key = f"{self.key_prefix}/{key}" if self.key_prefix else key
+        return f"s3://{self.bucket}/{full_key}"
+
+    @staticmethod
+    def _split(location: str):
+        bucket, _, key = location[len("s3://"):].partition("/")
+        return bucket, key
+
+    def put_file(self, local_path: Path, key: str, content_type: Optional[str] = None) -> str:
+        location = self._location(key)
+        bucket, full_key = self._split(location)
+        extra = {"ContentType": content_type} if content_type else None
+        self.client.upload_file(str(local_path), bucket, full_key, ExtraArgs=extra)
+        try:
+            os.unlink(local_path)
+        except OSError:
+            pass
+        return location
+
+    def delete(self, location: str) -> int:
+        freed = self.size(location) or 0
+        bucket, key = self._split(location)
+        self.client.delete_object(Bucket=bucket, Key=key)
+        return freed
+
+    def exists(self, location: str) -> bool:
+        return self.size(location) is not None
+
+    def size(self, location: str) -> Optional[int]:
+        bucket, key = self._split(location)
+        try:
+            head = self.client.head_object(Bucket=bucket, Key=key)
+        except ClientError:
+            return None
+        return int(head.get("ContentLength") or 0)
+
+    def open(self, location: str) -> BinaryIO:
+        bucket, key = self._split(location)
+        return self.client.get_object(Bucket=bucket, Key=key)["Body"]
+
+    def presigned_url(
+        self,
+        location: str,
+        expires_in: Optional[int] = None,
+        filename: Optional[str] = None,
+        content_type: Optional[str] = None,
+    ) -> Optional[str]:
+        bucket, key = self._split(location)
+        params = {"Bucket": bucket, "Key": key}
+        if filename:
+            params["ResponseContentDisposition"] = f'inline; filename="{filename}"'
+        if content_type:
+            params["ResponseContentType"] = content_type
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params=params,
+            ExpiresIn=int(expires_in or self.presign_expire_seconds),
+        )
+
+
+_storage: Optional[MediaStorage] = None
+_local_storage = LocalMediaStorage()
+_s3_by_bucket: Dict[str, S3MediaStorage] = {}  # buckets of older rows, one client each
+_storage_lock = threading.Lock()
+
+
+def get_media_storage() -> MediaStorage:
+    """Backend used for new media, configured by MEDIA_STORAGE_BACKEND."""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            backend = (env_str("MEDIA_STORAGE_BACKEND", "local") or "local").lower()
+            if backend == "s3":
+                bucket = env_str("S3_BUCKET")
+                if not bucket:
+                    raise RuntimeError("MEDIA_STORAGE_BACKEND=s3 but S3_BUCKET is not set")
+                _storage = S3MediaStorage(
+                    bucket,
+                    key_prefix=env_str("S3_KEY_PREFIX", "") or "",
+                    presign_expire_seconds=env_int("S3_PRESIGN_EXPIRE_SECONDS", 300),
+                )
+            else:
+                _storage = _local_storage
+            print(f"[Storage] Using {_storage.name} media storage backend")
+        return _storage
+
+
+def set_media_storage(storage: Optional[MediaStorage]) -> None:
+    """Override the configured backend (e.g. with a MinIO/moto-backed S3MediaStorage)."""
+    global _storage
+    with _storage_lock:
+        _storage = storage
+
+
+def storage_for_location(location: str) -> MediaStorage:
+    """Backend that holds an existing location (rows written before a backend switch stay readable)."""
+    if location.startswith("s3://"):
+        bucket = S3MediaStorage._split(location)[0]
+        storage = get_media_storage()
+        if isinstance(storage, S3MediaStorage) and storage.bucket == bucket:
+            return storage
+        with _storage_lock:
+            if bucket not in _s3_by_bucket:
+                _s3_by_bucket[bucket] = S3MediaStorage(bucket)
+            return _s3_by_bucket[bucket]
+    return _local_storage
+
+
+def temp_dir() -> Path:
+    """Local scratch space for downloads before they are committed to a backend."""
+    path = STORAGE_ROOT / "tmp"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def disk_free_bytes() -> int:
+    return shutil.disk_usage(temp_dir()).free
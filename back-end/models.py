@@ -2,7 +2,7 @@
 Database models using SQLAlchemy ORM.
 All models inherit from database.Base
 """
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, BigInteger, Float, String, DateTime, Text
 from datetime import datetime
 from database import Base
 
@@ -49,6 +49,101 @@ class StoredVideo(Base):
     job_id = Column(String, index=True, nullable=True)  # Our internal job ID
     file_path = Column(String, nullable=False)  # Path to stored video file
     file_size = Column(Integer, nullable=True)  # File size in bytes
-    expires_at = Column(DateTime, nullable=False, index=True)  # Auto-delete after 2 days
+    blob_sha256 = Column(String, index=True, nullable=True)  # MediaBlob holding the content (null for legacy files)
+    expires_at = Column(DateTime, nullable=False, index=True)  # Hard max age (MEDIA_CACHE_MAX_AGE_HOURS)
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    last_accessed_at = Column(DateTime, nullable=True, index=True)  # For LRU eviction under the cache byte budget
+    # Read from the MP4 moov box at ingest (mp4_faststart.py)
+    duration_seconds = Column(Float, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    bitrate = Column(Integer, nullable=True)  # bits per second
 
+
+class StoredImage(Base):
+    """
+    Mirrored provider image: the original or one resized WebP variant, backed by a MediaBlob.
+    """
+    __tablename__ = "stored_images"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, index=True, nullable=False)
+    provider = Column(String, nullable=False)  # e.g. kling
+    provider_task_id = Column(String, index=True, nullable=False)
+    job_id = Column(String, index=True, nullable=True)  # Our internal job ID
+    variant = Column(String, nullable=False)  # "original" or "w<width>" (WebP)
+    file_path = Column(String, nullable=False)  # Location of the blob file
+    file_size = Column(Integer, nullable=True)  # File size in bytes
+    blob_sha256 = Column(String, index=True, nullable=False)  # MediaBlob holding the content
+    content_type = Column(String, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)  # Same max age as stored videos
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class ImageAsset(Base):
+    """
+    Reference image uploaded once through POST /assets/images and reused by
+    generation requests as "asset:<asset_id>", backed by a MediaBlob.
+    """
+    __tablename__ = "image_assets"
+
+    id = Column(Integer, primary_key=True, index=True)
+    asset_id = Column(String, unique=True, index=True, nullable=False)  # Public ID returned to the client
+    user_id = Column(Integer, index=True, nullable=False)
+    file_path = Column(String, nullable=False)  # Location of the blob file
+    file_size = Column(Integer, nullable=True)  # File size in bytes
+    blob_sha256 = Column(String, index=True, nullable=False)  # MediaBlob holding the content
+    content_type = Column(String, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)  # Same max age as stored media
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class MediaBlob(Base):
+    """
+    Content-addressed media file (sha256-named) shared by every row that references it.
+    The file is deleted when ref_count drops to zero.
+    """
+    __tablename__ = "media_blobs"
+
+    sha256 = Column(String, primary_key=True)  # Hex digest of the file content
+    file_path = Column(String, nullable=False)  # Path to blob file
+    file_size = Column(BigInteger, nullable=False)  # File size in bytes
+    content_type = Column(String, nullable=True)  # e.g. video/mp4
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class EmailOutbox(Base):
+    """
+    Outgoing email, written in the transaction of the request that needs it and
+    sent by the background dispatcher (email_outbox.py).
+    """
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=True)  # Cleared once sent (may hold a reset code)
+    category = Column(String, nullable=True)  # e.g. password-reset
+    status = Column(String, nullable=False, default="pending", index=True)  # pending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, index=True)  # Due time, or end of a claim's lease
+    claim_token = Column(String, nullable=True, index=True)  # Set by the dispatcher round that claimed the row
+    transport = Column(String, nullable=True)  # mailtrap, sendgrid, smtp or console
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    sent_at = Column(DateTime, nullable=True)
+
+
+class RateLimitBucket(Base):
+    """
+    Shared state of one rate limit key for RATE_LIMIT_BACKEND=database (rate_limit.py).
+    """
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String, primary_key=True)  # sha256 of scope + IP / account
+    tat = Column(Float, nullable=False, index=True)  # Theoretical arrival time (epoch seconds); stale once in the past
@@ -0,0 +1,256 @@
+"""
+Pure-Python MP4 (ISO BMFF) box parser used when ingesting provider videos.
+
+- Reads duration, width, height and bitrate from the `moov` box (mvhd / tkhd)
+- "faststart": when `moov` sits after `mdat`, writes a copy with `moov` moved to
+  the front and every `stco`/`co64` chunk offset shifted to match, so browsers
+  can start playback before the whole file has downloaded (same result as
+  qt-faststart / ffmpeg -movflags +faststart)
+
+Box headers are parsed from a read-only memory map and only the `moov` box
+(usually a few hundred KB) is copied into memory; `mdat` is streamed through
+a single COPY_CHUNK_SIZE buffer.
+"""
+import hashlib
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Boxes we descend into to reach mvhd / tkhd / hdlr / stco / co64
+CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+UINT32_MAX = 0xFFFFFFFF
+
+
+class Mp4Error(ValueError):
+    """File is not an MP4 we can parse."""
+
+
+@dataclass
+class Box:
+    type: bytes
+    offset: int  # start of the box header
+    size: int  # header + payload
+    header_size: int
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+    @property
+    def payload_offset(self) -> int:
+        return self.offset + self.header_size
+
+
+@dataclass
+class Mp4Info:
+    duration_seconds: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    bitrate: Optional[int] = None  # bits per second over the whole file
+    faststart: bool = False  # moov precedes mdat (already, or after rewriting)
+    rewritten: bool = False  # a relocated copy was written
+    sha256: Optional[str] = None  # of the rewritten file
+    size: Optional[int] = None  # of the rewritten file
+
+
+def iter_boxes(buf, start: int, end: int) -> Iterator[Box]:
+    """Yield the boxes laid out back to back in buf[start:end]."""
+    pos = start
+    while pos < end:
+        if end - pos < 8:
+            raise Mp4Error(f"Truncated box header at offset {pos}")
+        size, box_type = struct.unpack_from(">I4s", buf, pos)
+        header_size = 8
+        if size == 1:
+            if end - pos < 16:
+                raise Mp4Error(f"Truncated box header at offset {pos}")
+            size = struct.unpack_from(">Q", buf, pos + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos  # last box, extends to the end of the file
+        if size < header_size or pos + size > end:
+            raise Mp4Error(f"Box {box_type!r} at offset {pos} has invalid size {size}")
+        yield Box(box_type, pos, size, header_size)
+        pos += size
+
+
+def _box_header(box_type: bytes, payload_size: int) -> bytes:
+    if payload_size + 8 <= UINT32_MAX:
+        return struct.pack(">I4s", payload_size + 8, box_type)
+    return struct.pack(">I4sQ", 1, box_type, payload_size + 16)
+
+
+def _chunk_offsets(moov: bytes, box: Box) -> tuple:
+    p = box.payload_offset
+    count = struct.unpack_from(">I", moov, p + 4)[0]
+    fmt = f">{count}{'I' if box.type == b'stco' else 'Q'}"
+    if p + 8 + struct.calcsize(fmt) > box.end:
+        raise Mp4Error(f"{box.type.decode()} entry count {count} exceeds box size")
+    return struct.unpack_from(fmt, moov, p + 8)
+
+
+def _walk(moov: bytes, parent: Box) -> Iterator[Box]:
+    """Depth-first walk of the container boxes we understand."""
+    for box in iter_boxes(moov, parent.payload_offset, parent.end):
+        yield box
+        if box.type in CONTAINER_BOXES:
+            yield from _walk(moov, box)
+
+
+def _moov_root(moov: bytes) -> Box:
+    header_size = 16 if struct.unpack_from(">I", moov, 0)[0] == 1 else 8
+    return Box(b"moov", 0, len(moov), header_size)
+
+
+def read_moov_info(moov: bytes) -> Mp4Info:
+    """Duration and video dimensions from a moov box held in memory."""
+    info = Mp4Info()
+    root = _moov_root(moov)
+    for box in iter_boxes(moov, root.payload_offset, root.end):
+        if box.type == b"mvhd":
+            p = box.payload_offset
+            if moov[p] == 1:
+                timescale, duration = struct.unpack_from(">IQ", moov, p + 20)
+            else:
+                timescale, duration = struct.unpack_from(">II", moov, p + 12)
+            if timescale and duration and duration not in (UINT32_MAX, 2 ** 64 - 1):
+                info.duration_seconds = round(duration / timescale, 3)
+        elif box.type == b"trak" and info.width is None:
+            handler = None
+            width = height = 0
+            for child in _walk(moov, box):
+                if child.type == b"tkhd":
+                    # width and height are the last 8 bytes, 16.16 fixed point
+                    w, h = struct.unpack_from(">II", moov, child.end - 8)
+                    width, height = w >> 16, h >> 16
+                elif child.type == b"hdlr":
+                    handler = bytes(moov[child.payload_offset + 8:child.payload_offset + 12])
+            if handler == b"vide" and width and height:
+                info.width, info.height = width, height
+    return info
+
+
+def _rebuild(moov: bytes, parent: Box, shift: Callable[[int], int], use_co64: bool) -> bytes:
+    """Re-serialize a container's payload with every chunk offset passed through shift()."""
+    parts: List[bytes] = []
+    for box in iter_boxes(moov, parent.payload_offset, parent.end):
+        if box.type in CONTAINER_BOXES:
+            payload = _rebuild(moov, box, shift, use_co64)
+            parts.append(_box_header(box.type, len(payload)))
+            parts.append(payload)
+        elif box.type in (b"stco", b"co64"):
+            offsets = [shift(o) for o in _chunk_offsets(moov, box)]
+            out_type = b"co64" if use_co64 or box.type == b"co64" else b"stco"
+            fmt = f">{len(offsets)}{'Q' if out_type == b'co64' else 'I'}"
+            version_flags = moov[box.payload_offset:box.payload_offset + 4]
+            payload = version_flags + struct.pack(">I", len(offsets)) + struct.pack(fmt, *offsets)
+            parts.append(_box_header(out_type, len(payload)))
+            parts.append(payload)
+        else:
+            parts.append(moov[box.offset:box.end])
+    return b"".join(parts)
+
+
+def relocate_moov(moov: bytes, moved_start: int, moved_end: int) -> bytes:
+    """
+    moov box for the faststart layout. File data in [moved_start, moved_end)
+    moves forward by the size of the new moov, everything else keeps its offset.
+    32-bit stco tables are upgraded to co64 only if a shifted offset no longer fits.
+    """
+    root = _moov_root(moov)
+    stco_entries = 0
+    max_stco_offset = 0
+    for box in _walk(moov, root):
+        if box.type == b"stco":
+            offsets = _chunk_offsets(moov, box)
+            stco_entries += len(offsets)
+            moved = [o for o in offsets if moved_start <= o < moved_end]
+            if moved:
+                max_stco_offset = max(max_stco_offset, max(moved))
+
+    # The new moov's size is known up front: same payload, plus 4 bytes per entry if upgraded
+    payload_size = len(moov) - root.header_size
+    use_co64 = max_stco_offset + len(_box_header(b"moov", payload_size)) + payload_size > UINT32_MAX
+    if use_co64:
+        payload_size += 4 * stco_entries
+    delta = len(_box_header(b"moov", payload_size)) + payload_size
+
+    def shift(offset: int) -> int:
+        return offset + delta if moved_start <= offset < moved_end else offset
+
+    payload = _rebuild(moov, root, shift, use_co64)
+    new_moov = _box_header(b"moov", len(payload)) + payload
+    if len(new_moov) != delta:
+        raise Mp4Error("moov size changed unexpectedly while relocating")
+    return new_moov
+
+
+def process_file(src_path: Path, dst_path: Path) -> Mp4Info:
+    """
+    Parse src_path and, if its moov comes after mdat, write a faststart copy to dst_path
+    (hashing it on the way, see Mp4Info.sha256 / size). Otherwise dst_path is not created.
+    Raises Mp4Error for files that aren't parseable MP4.
+    """
+    file_size = os.path.getsize(src_path)
+    if file_size < 8:
+        raise Mp4Error("File too small to be an MP4")
+
+    with open(src_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        top = list(iter_boxes(mm, 0, file_size))
+        moov_box = next((b for b in top if b.type == b"moov"), None)
+        mdat_box = next((b for b in top if b.type == b"mdat"), None)
+        if moov_box is None:
+            raise Mp4Error("No moov box")
+
+        moov = mm[moov_box.offset:moov_box.end]
+        info = read_moov_info(moov)
+        if info.duration_seconds:
+            info.bitrate = int(file_size * 8 / info.duration_seconds)
+
+        # Fragmented MP4 (moof) streams already; compressed moov (cmov) can't be rewritten here
+        fragmented = any(b.type == b"moof" for b in top)
+        compressed = any(b.type == b"cmov" for b in iter_boxes(moov, _moov_root(moov).payload_offset, len(moov)))
+        if mdat_box is None or moov_box.offset < mdat_box.offset or fragmented or compressed:
+            info.faststart = mdat_box is None or moov_box.offset < mdat_box.offset
+            return info
+
+        # Layout: [boxes before mdat] [moov] [mdat ... up to the old moov] [boxes after the old moov]
+        new_moov = relocate_moov(moov, mdat_box.offset, moov_box.offset)
+        ranges = [(0, mdat_box.offset), None, (mdat_box.offset, moov_box.offset), (moov_box.end, file_size)]
+
+        # Bulk data is streamed through one reusable buffer rather than through the
+        # mapping, so the copy doesn't pin the whole file in our resident set
+        digest = hashlib.sha256()
+        written = 0
+        buf = bytearray(COPY_CHUNK_SIZE)
+        view = memoryview(buf)
+        with open(dst_path, "wb") as out:
+            for r in ranges:
+                if r is None:
+                    out.write(new_moov)
+                    digest.update(new_moov)
+                    written += len(new_moov)
+                    continue
+                start, end = r
+                f.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    n = f.readinto(view[:min(COPY_CHUNK_SIZE, remaining)])
+                    if not n:
+                        raise Mp4Error("File shrank while copying")
+                    out.write(view[:n])
+                    digest.update(view[:n])
+                    written += n
+                    remaining -= n
+
+        info.faststart = True
+        info.rewritten = True
+        info.sha256 = digest.hexdigest()
+        info.size = written
+        return info
@@ -0,0 +1,181 @@
+"""
+Password hashing (SHA-256 pre-hash + bcrypt) on its own bounded executor.
+
+bcrypt is deliberately slow, so a login burst used to tie up the request
+threadpool that also serves generation and polling. Hashes now run on a
+dedicated thread pool (bcrypt releases the GIL):
+
+- AUTH_HASH_WORKERS        hashing threads (default: CPU count, max 2)
+- AUTH_HASH_MAX_PENDING    queued + running hashes before new ones are
+                           rejected with PasswordHasherBusy, answered as 429
+                           (default 4 x workers)
+
+The bcrypt cost is calibrated at startup to the highest number of rounds
+whose hash takes at most BCRYPT_TARGET_MS (default 250), between
+BCRYPT_MIN_ROUNDS (default and floor: 12, the previous fixed cost) and
+BCRYPT_MAX_ROUNDS (default 14). A slow machine therefore never weakens
+hashes. BCRYPT_ROUNDS pins the cost and skips calibration. Stored hashes
+below the cost are rehashed on the next successful login (needs_rehash);
+hashes above it are kept, so workers that calibrate differently don't undo
+each other's upgrades.
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+import bcrypt
+
+from env_config import env_int
+
+DEFAULT_ROUNDS = 12  # bcrypt.gensalt() default, used until calibrate() runs and never calibrated below
+CALIBRATION_ROUNDS = 10  # cost timed by calibrate(), then extrapolated
+
+
+class PasswordHasherBusy(RuntimeError):
+    """Too many password hashes are already queued."""
+
+
+def _prehash(password: str) -> bytes:
+    # SHA-256 hex first (64 chars), so bcrypt's 72-byte limit never applies
+    return hashlib.sha256(password.encode("utf-8")).hexdigest().encode("utf-8")
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(_prehash(password), bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+
+
+def _verify(password: str, hashed: str) -> bool:
+    try:
+        return bcrypt.checkpw(_prehash(password), hashed.encode("utf-8"))
+    except Exception:
+        return False
+
+
+def hash_rounds(hashed: str) -> Optional[int]:
+    """Cost factor of a "$2b$12$..." hash."""
+    parts = (hashed or "").split("$")
+    return int(parts[2]) if len(parts) > 3 and parts[2].isdigit() else None
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.workers = max(1, env_int("AUTH_HASH_WORKERS", min(2, os.cpu_count() or 1)))
+        self.max_pending = max(1, env_int("AUTH_HASH_MAX_PENDING", 4 * self.workers))
+        self.target_ms = max(1, env_int("BCRYPT_TARGET_MS", 250))
+        self.min_rounds = min(31, max(DEFAULT_ROUNDS, env_int("BCRYPT_MIN_ROUNDS", DEFAULT_ROUNDS)))
+        self.max_rounds = min(31, max(self.min_rounds, env_int("BCRYPT_MAX_ROUNDS", 14)))
+        pinned = env_int("BCRYPT_ROUNDS", 0)
+        self.pinned = 4 <= pinned <= 31
+        self.rounds = pinned if self.pinned else DEFAULT_ROUNDS
+        self.calibration: Optional[Dict[str, Any]] = None
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._stats = {
+            "hashes": 0,
+            "verifies": 0,
+            "rehashes": 0,
+            "rejected": 0,
+            "in_flight": 0,
+            "ms_total": 0.0,
+            "ms_max": 0.0,
+        }
+
+    def calibrate(self) -> int:
+        """Pick the bcrypt cost for target_ms on this machine (unless BCRYPT_ROUNDS is set)."""
+        if self.pinned:
+            return self.rounds
+        # Each extra round doubles the work: time a cheap cost, extrapolate
+        samples = []
+        for _ in range(3):
+            started = time.perf_counter()
+            _hash("calibration", CALIBRATION_ROUNDS)
+            samples.append((time.perf_counter() - started) * 1000)
+        base_ms = sorted(samples)[1]
+        rounds = self.min_rounds
+        while rounds < self.max_rounds and base_ms * 2 ** (rounds + 1 - CALIBRATION_ROUNDS) <= self.target_ms:
+            rounds += 1
+        self.rounds = rounds
+        self.calibration = {
+            "sample_rounds": CALIBRATION_ROUNDS,
+            "sample_ms": round(base_ms, 1),
+            "rounds": rounds,
+            "estimated_ms": round(base_ms * 2 ** (rounds - CALIBRATION_ROUNDS), 1),
+            "target_ms": self.target_ms,
+        }
+        print(
+            f"[Auth] bcrypt cost calibrated to {rounds} rounds "
+            f"(~{self.calibration['estimated_ms']:.0f} ms per hash, target {self.target_ms} ms)"
+        )
+        return rounds
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise PasswordHasherBusy(f"Password hashing queue is full ({self.max_pending} pending)")
+        try:
+            with self._lock:
+                self._stats["in_flight"] += 1
+            started = time.perf_counter()
+            result = self._executor.submit(fn, *args).result()
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self._stats["ms_total"] += elapsed
+                self._stats["ms_max"] = max(self._stats["ms_max"], elapsed)
+            return result
+        finally:
+            with self._lock:
+                self._stats["in_flight"] -= 1
+            self._slots.release()
+
+    def hash(self, password: str) -> str:
+        """bcrypt hash at the calibrated cost. Raises PasswordHasherBusy when the queue is full."""
+        result = self._run(_hash, password, self.rounds)
+        with self._lock:
+            self._stats["hashes"] += 1
+        return result
+
+    def verify(self, password: str, hashed: str) -> bool:
+        """Raises PasswordHasherBusy when the queue is full; any other problem is a mismatch."""
+        result = self._run(_verify, password, hashed)
+        with self._lock:
+            self._stats["verifies"] += 1
+        return result
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """Only upgrades: a hash stronger than this process's cost is left alone."""
+        rounds = hash_rounds(hashed)
+        return rounds is not None and rounds < self.rounds
+
+    def count_rehash(self) -> None:
+        with self._lock:
+            self._stats["rehashes"] += 1
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+        done = (s["hashes"] + s["verifies"]) or 1
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "rounds": self.rounds,
+            "calibration": self.calibration,
+            "hashes": s["hashes"],
+            "verifies": s["verifies"],
+            "rehashes": s["rehashes"],
+            "rejected": s["rejected"],
+            "in_flight": s["in_flight"],
+            "ms_avg": round(s["ms_total"] / done, 1),
+            "ms_max": round(s["ms_max"], 1),
+        }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,241 @@
+"""
+Rate limiting of the sign-in and password reset endpoints, by client IP and
+by account.
+
+Every attempt at these endpoints costs a bcrypt verify or an email, so they
+are checked before any of that work and answered with 429 + Retry-After when
+over the limit. Limits are "attempts/seconds" and allow that many attempts at
+once, then one per seconds/attempts (a token bucket, kept as a single
+"theoretical arrival time" per key, GCRA):
+
+- RATE_LIMIT_LOGIN_IP             default 30/300
+- RATE_LIMIT_LOGIN_ACCOUNT        default 10/300
+- RATE_LIMIT_FORGOT_IP            default 10/3600
+- RATE_LIMIT_FORGOT_ACCOUNT       default 3/900
+- RATE_LIMIT_RESET_IP             default 30/900   (verify-reset-code and both
+- RATE_LIMIT_RESET_ACCOUNT        default 10/900    reset-password endpoints)
+
+Set a limit to 0 to turn it off; RATE_LIMIT_ENABLED=false turns all of them off.
+
+Backends (RATE_LIMIT_BACKEND):
+- memory    per process (default), at most RATE_LIMIT_MAX_KEYS keys (default 100000)
+- database  shared by every worker and instance through the rate_limit_buckets table
+
+Behind a reverse proxy, RATE_LIMIT_PROXY_HOPS is the number of proxies that
+append to X-Forwarded-For; the client IP is taken that many entries from the
+right. With 0 (the default, for direct exposure) the header is ignored, as it
+can be forged. Without it behind a proxy every client would share the proxy's
+address and the per-IP limits would be site-wide, so the Procfile and
+railway.json set 1 for Railway's edge proxy, and a request arriving with
+X-Forwarded-For while it's 0 is logged once.
+"""
+import hashlib
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal
+from env_config import env_int, env_str
+from models import RateLimitBucket
+
+DEFAULT_LIMITS = {
+    "login": ("30/300", "10/300"),
+    "forgot": ("10/3600", "3/900"),
+    "reset": ("30/900", "10/900"),
+}
+
+
+def _parse_limit(name: str, default: str) -> Optional[Tuple[int, float]]:
+    """(attempts, seconds) from "attempts/seconds"; None when the limit is off."""
+    value = env_str(name, default)
+    if value.strip() == "0":
+        return None
+    try:
+        attempts, seconds = (int(p) for p in value.split("/", 1))
+    except ValueError:
+        print(f"[RateLimit] Invalid {name}={value!r}, using {default}")
+        attempts, seconds = (int(p) for p in default.split("/", 1))
+    if attempts <= 0 or seconds <= 0:
+        return None
+    return attempts, float(seconds)
+
+
+class RateLimited(Exception):
+    def __init__(self, wait_seconds: float):
+        self.retry_after = max(1, math.ceil(wait_seconds))  # whole seconds, for Retry-After
+        super().__init__(f"Rate limited, retry after {self.retry_after}s")
+
+
+class RateLimitBackend(ABC):
+    """Interface shared by all backends."""
+
+    name = "base"
+
+    @abstractmethod
+    def hit(self, key: str, interval: float, burst: int, now: float) -> float:
+        """
+        Count an attempt for key if it's within the limit and return 0, otherwise
+        return the seconds until it would be (the attempt is then not counted).
+        """
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+def _gcra(tat: Optional[float], interval: float, burst: int, now: float) -> Tuple[float, Optional[float]]:
+    """(seconds to wait, new theoretical arrival time or None when rejected)."""
+    new_tat = max(tat or now, now) + interval
+    allow_at = new_tat - burst * interval
+    if allow_at > now:
+        return allow_at - now, None
+    return 0.0, new_tat
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    name = "memory"
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._tats: Dict[str, float] = {}
+
+    def hit(self, key: str, interval: float, burst: int, now: float) -> float:
+        with self._lock:
+            wait, new_tat = _gcra(self._tats.get(key), interval, burst, now)
+            if new_tat is None:
+                return wait
+            self._tats[key] = new_tat
+            if len(self._tats) > self.max_keys:
+                # Keys whose arrival time has passed are back to a full bucket: same as absent
+                self._tats = {k: t for k, t in self._tats.items() if t > now}
+                while len(self._tats) > self.max_keys:
+                    self._tats.pop(next(iter(self._tats)))
+            return 0.0
+
+    def size(self) -> Optional[int]:
+        with self._lock:
+            return len(self._tats)
+
+
+class DatabaseRateLimitBackend(RateLimitBackend):
+    name = "database"
+    purge_interval_seconds = 600
+
+    def __init__(self):
+        self._last_purge = 0.0
+
+    def _purge(self, db, now: float) -> None:
+        if now - self._last_purge < self.purge_interval_seconds:
+            return
+        self._last_purge = now
+        db.query(RateLimitBucket).filter(RateLimitBucket.tat < now).delete(synchronize_session=False)
+        db.commit()
+
+    def hit(self, key: str, interval: float, burst: int, now: float) -> float:
+        db = SessionLocal()
+        try:
+            for _ in range(2):
+                # Row lock (Postgres) so concurrent workers update the same key one at a time
+                row = db.query(RateLimitBucket).filter(RateLimitBucket.key == key).with_for_update().first()
+                wait, new_tat = _gcra(row.tat if row is not None else None, interval, burst, now)
+                if new_tat is None:
+                    db.rollback()
+                    return wait
+                if row is None:
+                    db.add(RateLimitBucket(key=key, tat=new_tat))
+                else:
+                    row.tat = new_tat
+                try:
+                    db.commit()
+                    break
+                except IntegrityError:
+                    db.rollback()  # Another worker inserted the key first: read it again
+            self._purge(db, now)
+            return 0.0
+        finally:
+            db.close()
+
+
+class RateLimiter:
+    def __init__(self):
+        self.enabled = (env_str("RATE_LIMIT_ENABLED", "true") or "").lower() not in ("0", "false", "no", "off")
+        self.proxy_hops = max(0, env_int("RATE_LIMIT_PROXY_HOPS", 0))
+        self._warned_proxy = False
+        self.limits: Dict[str, Dict[str, Optional[Tuple[int, float]]]] = {
+            scope: {
+                "ip": _parse_limit(f"RATE_LIMIT_{scope.upper()}_IP", ip_default),
+                "account": _parse_limit(f"RATE_LIMIT_{scope.upper()}_ACCOUNT", account_default),
+            }
+            for scope, (ip_default, account_default) in DEFAULT_LIMITS.items()
+        }
+        backend = (env_str("RATE_LIMIT_BACKEND", "memory") or "memory").lower()
+        if backend == "database":
+            self.backend: RateLimitBackend = DatabaseRateLimitBackend()
+        else:
+            self.backend = MemoryRateLimitBackend(max(1, env_int("RATE_LIMIT_MAX_KEYS", 100000)))
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {scope: {"allowed": 0, "limited": 0} for scope in DEFAULT_LIMITS}
+        self.errors = 0
+
+    def client_ip(self, request) -> str:
+        forwarded = request.headers.get("x-forwarded-for", "")
+        if self.proxy_hops:
+            hops = [p.strip() for p in forwarded.split(",") if p.strip()]
+            if len(hops) >= self.proxy_hops:
+                return hops[-self.proxy_hops]
+        elif forwarded and not self._warned_proxy:
+            self._warned_proxy = True
+            print("[RateLimit] Requests carry X-Forwarded-For but RATE_LIMIT_PROXY_HOPS=0: "
+                  "per-IP limits see the proxy's address, set RATE_LIMIT_PROXY_HOPS to the number of proxies")
+        return request.client.host if request.client else "unknown"
+
+    def _hit(self, scope: str, kind: str, value: str, now: float) -> float:
+        limit = self.limits[scope][kind]
+        if limit is None:
+            return 0.0
+        attempts, seconds = limit
+        key = hashlib.sha256(f"{scope}:{kind}:{value}".encode("utf-8")).hexdigest()
+        try:
+            return self.backend.hit(key, seconds / attempts, attempts, now)
+        except Exception as e:
+            # A broken shared backend must not lock everyone out
+            with self._lock:
+                self.errors += 1
+            print(f"[RateLimit] {self.backend.name} backend failed, allowing the attempt: {e}")
+            return 0.0
+
+    def check(self, scope: str, request, account: Optional[str] = None) -> None:
+        """Count an attempt in scope for the request's IP and the account. Raises RateLimited when over a limit."""
+        if not self.enabled:
+            return
+        now = time.time()
+        wait = self._hit(scope, "ip", self.client_ip(request), now)
+        if not wait and account:
+            wait = self._hit(scope, "account", account.strip().lower(), now)
+        with self._lock:
+            self._stats[scope]["limited" if wait else "allowed"] += 1
+        if wait:
+            raise RateLimited(wait)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {scope: dict(s) for scope, s in self._stats.items()}
+            errors = self.errors
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend.name,
+            "keys": self.backend.size(),
+            "limits": {
+                scope: {kind: f"{l[0]}/{l[1]:g}" if l else None for kind, l in limits.items()}
+                for scope, limits in self.limits.items()
+            },
+            "scopes": stats,
+            "backend_errors": errors,
+        }
+
+
+rate_limiter = RateLimiter()
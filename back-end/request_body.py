@@ -0,0 +1,369 @@
+"""
+Request body size caps and streaming of inline (data URL) images.
+
+BodyLimitMiddleware is a plain ASGI middleware, so it sees the body chunk by
+chunk as the server receives it and never buffers it:
+
+- MAX_BODY_MB              cap for any request body (default 2)
+- MEDIA_JSON_BODY_MAX_MB   cap for the generation endpoints that take data URLs
+                           (default 32, a ~24 MB image in base64)
+- /assets/images           MEDIA_ASSET_MAX_MB (image_assets.py) + 1 MB for the
+                           multipart framing
+
+Requests over their cap get 413, up front from Content-Length or as soon as
+the streamed body crosses it.
+
+On the generation endpoints, the image fields (image_url / image_url2,
+image_urls[]) holding a "data:image/...;base64," string are base64-decoded
+while they stream in, in chunks, on a worker thread, into a SpooledTemporaryFile
+(kept in memory up to MEDIA_SPOOL_MEMORY_MB, default 1, then on disk) and
+replaced by "spool:<token>" before the endpoint parses the JSON. The endpoint
+resolves the token with spooled_image(); the files are closed when the
+request is done. So a 20 MB upload no longer exists at the same time as raw
+body, JSON string, decoded bytes and pixels.
+"""
+import base64
+import binascii
+import hashlib
+import re
+import secrets
+import tempfile
+import threading
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+
+import image_assets
+from env_config import env_int
+
+SPOOL_REF_PREFIX = "spool:"
+
+_DATA_PREFIX = b"data:image"
+_MAX_HEADER_BYTES = 64  # "data:image/png;base64" and friends
+_STRUCT = re.compile(rb'["{}\[\],:]')
+_HEADER_STOP = re.compile(rb'[,"]')
+_DATA_STOP = re.compile(rb'["\\]')
+_DECODE_CHUNK = 64 * 1024  # base64 characters decoded per step (multiple of 4)
+_JSON_ESCAPES = {ord("/"): b"/", ord("n"): b"", ord("r"): b"", ord("t"): b""}
+_SUFFIXES = {"image/jpeg": ".jpg", "image/jpg": ".jpg", "image/png": ".png", "image/webp": ".webp", "image/gif": ".gif"}
+
+
+class BodyTooLarge(HTTPException):
+    def __init__(self, limit: int):
+        super().__init__(
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+            detail=f"Request body is larger than {limit // (1024 * 1024)} MB",
+        )
+
+
+def _invalid_image() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid base64 image data")
+
+
+class SpooledImage:
+    """A decoded inline image of the current request; same read interface as image_assets.ResolvedImage."""
+
+    def __init__(self, content_type: str, memory_bytes: int):
+        self.token = secrets.token_urlsafe(16)
+        self.content_type = content_type
+        self.size = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=memory_bytes)
+        self._hash = hashlib.sha256()
+        self.sha256: Optional[str] = None
+
+    @property
+    def suffix(self) -> str:
+        return _SUFFIXES.get(self.content_type, ".png")
+
+    def write(self, data: bytes) -> None:
+        self._file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+
+    def finish(self) -> None:
+        self.sha256 = self._hash.hexdigest()
+
+    def read(self) -> bytes:
+        self._file.seek(0)
+        return self._file.read()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+_registry: Dict[str, SpooledImage] = {}
+_registry_lock = threading.Lock()
+_stats = {"rejected_too_large": 0, "spooled_images": 0, "spooled_bytes": 0}
+
+
+def is_spool_ref(value) -> bool:
+    return isinstance(value, str) and value.strip().startswith(SPOOL_REF_PREFIX)
+
+
+def spooled_image(ref: str) -> Optional[SpooledImage]:
+    """The image a "spool:<token>" reference stands for, while its request is running."""
+    with _registry_lock:
+        return _registry.get(ref.strip()[len(SPOOL_REF_PREFIX):])
+
+
+class _DataUrlSpooler:
+    """
+    Rewrites a JSON body stream, moving "data:image/...;base64,..." strings found
+    at the route's image fields (top-level keys, or arrays under them) into
+    SpooledImage files. Every other string, data URL or not, is passed on
+    untouched. feed() returns the bytes to pass on.
+    """
+
+    def __init__(self, memory_bytes: int, image_keys: Set[bytes]):
+        self.memory_bytes = memory_bytes
+        self.image_keys = image_keys
+        self.images: List[SpooledImage] = []
+        self._state = "struct"
+        self._stack: List[bytes] = []  # open containers, b"{" / b"["
+        self._expect_key = False
+        self._key = b""  # last top-level key (raw, as it appears in the body)
+        self._carry = b""  # key: the key so far; header: the start of an image string
+        self._b64 = bytearray()  # data: base64 characters not decoded yet
+        self._escape = False
+        self._image: Optional[SpooledImage] = None
+
+    def feed(self, chunk: bytes) -> bytes:
+        out = bytearray()
+        pos = 0
+        while pos < len(chunk):
+            if self._state == "struct":
+                pos = self._feed_struct(chunk, pos, out)
+            elif self._state in ("key", "string"):
+                pos = self._feed_string(chunk, pos, out)
+            elif self._state == "header":
+                pos = self._feed_header(chunk, pos, out)
+            else:
+                pos = self._feed_data(chunk, pos, out)
+        return bytes(out)
+
+    def _at_image_field(self) -> bool:
+        if self._key not in self.image_keys:
+            return False
+        return self._stack == [b"{"] or self._stack == [b"{", b"["]
+
+    def _feed_struct(self, data: bytes, pos: int, out: bytearray) -> int:
+        m = _STRUCT.search(data, pos)
+        end = m.start() if m else len(data)
+        out += data[pos:end]
+        if m is None:
+            return end
+        c = m.group()
+        out += c
+        if c == b'"':
+            if self._expect_key and self._stack[-1:] == [b"{"]:
+                self._state, self._carry = "key", b""
+            elif self._at_image_field():
+                self._state, self._carry = "header", b""
+            else:
+                self._state = "string"
+        elif c in (b"{", b"["):
+            self._stack.append(c)
+            self._expect_key = c == b"{"
+        elif c in (b"}", b"]"):
+            if self._stack:
+                self._stack.pop()
+            self._expect_key = False
+        elif c == b",":
+            self._expect_key = self._stack[-1:] == [b"{"]
+        else:  # ":"
+            self._expect_key = False
+        return end + 1
+
+    def _feed_string(self, data: bytes, pos: int, out: bytearray) -> int:
+        """Inside a key or a string that is passed on as is."""
+        if self._escape:
+            self._escape = False
+            out += data[pos:pos + 1]
+            if self._state == "key":
+                self._carry += data[pos:pos + 1]
+            return pos + 1
+        m = _DATA_STOP.search(data, pos)
+        end = m.start() if m else len(data)
+        out += data[pos:end]
+        if self._state == "key":
+            self._carry += data[pos:end]
+        if m is None:
+            return end
+        out += m.group()
+        if m.group() == b"\\":
+            self._escape = True
+            if self._state == "key":
+                self._carry += m.group()
+            return end + 1
+        if self._state == "key":
+            if len(self._stack) == 1:
+                self._key = self._carry
+            self._carry = b""
+        self._state = "struct"
+        return end + 1
+
+    def _feed_header(self, data: bytes, pos: int, out: bytearray) -> int:
+        window = data[pos:pos + _MAX_HEADER_BYTES + 1 - len(self._carry)]
+        m = _HEADER_STOP.search(window)
+        if m is None and len(self._carry) + len(window) <= _MAX_HEADER_BYTES:
+            self._carry += window  # header continues in the next chunk
+            return len(data)
+        stop = m.start() if m else len(window)
+        header, self._carry = self._carry + window[:stop], b""
+        plain = header.replace(b"\\/", b"/")  # some JSON encoders escape "/"
+        if (
+            m is None
+            or m.group() != b","
+            or not plain.startswith(_DATA_PREFIX + b"/")
+            or not plain.endswith(b";base64")
+        ):
+            # Not a base64 data URL: pass it on untouched, as a plain string
+            out += header
+            trailing = len(header) - len(header.rstrip(b"\\"))
+            self._escape = trailing % 2 == 1
+            self._state = "string"
+            return pos + stop
+        mime = plain[len(b"data:"):-len(b";base64")].decode("ascii", "replace").lower()
+        self._image = SpooledImage(mime, self.memory_bytes)
+        self.images.append(self._image)
+        self._state = "data"
+        return pos + stop + 1
+
+    def _feed_data(self, data: bytes, pos: int, out: bytearray) -> int:
+        if self._escape:
+            self._escape = False
+            if data[pos] not in _JSON_ESCAPES:
+                raise _invalid_image()
+            self._b64 += _JSON_ESCAPES[data[pos]]
+            return pos + 1
+        m = _DATA_STOP.search(data, pos)
+        end = m.start() if m else len(data)
+        self._b64 += data[pos:end]
+        self._decode(final=False)
+        if m is None:
+            return len(data)
+        if m.group() == b"\\":
+            self._escape = True
+            return end + 1
+        self._decode(final=True)
+        self._image.finish()
+        with _registry_lock:
+            _registry[self._image.token] = self._image
+            _stats["spooled_images"] += 1
+            _stats["spooled_bytes"] += self._image.size
+        out += f'{SPOOL_REF_PREFIX}{self._image.token}"'.encode("ascii")
+        self._image = None
+        self._state = "struct"
+        return end + 1
+
+    def _decode(self, final: bool) -> None:
+        if final:
+            self._b64 += b"=" * (-len(self._b64) % 4)  # tolerate missing padding
+            n = len(self._b64)
+        else:
+            n = len(self._b64) - len(self._b64) % 4
+            if n < _DECODE_CHUNK:
+                return
+        try:
+            for start in range(0, n, _DECODE_CHUNK):
+                self._image.write(base64.b64decode(bytes(self._b64[start:min(start + _DECODE_CHUNK, n)]), validate=True))
+        except (binascii.Error, ValueError):
+            raise _invalid_image()
+        del self._b64[:n]
+
+    def finish(self) -> bytes:
+        if self._state == "data":
+            raise _invalid_image()  # body ended inside a data URL
+        # Anything else unfinished is invalid JSON: pass it on for the endpoint to reject
+        out = self._carry if self._state == "header" else b""
+        self._carry = b""
+        return out
+
+    def close(self) -> None:
+        with _registry_lock:
+            for image in self.images:
+                _registry.pop(image.token, None)
+        for image in self.images:
+            image.close()
+
+
+class BodyLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+        mb = 1024 * 1024
+        self.default_limit = max(1, env_int("MAX_BODY_MB", 2)) * mb
+        json_limit = max(1, env_int("MEDIA_JSON_BODY_MAX_MB", 32)) * mb
+        # path -> (max body bytes, JSON keys whose data URLs are spooled)
+        self.routes: Dict[str, Tuple[int, FrozenSet[str]]] = {
+            "/image/image-to-image": (json_limit, frozenset({"image_url", "image_url2"})),
+            "/video/text-to-video": (json_limit, frozenset({"image_urls"})),
+            "/assets/images": (image_assets.max_upload_bytes() + mb, frozenset()),
+        }
+        self.spool_memory_bytes = max(0, env_int("MEDIA_SPOOL_MEMORY_MB", 1)) * mb
+
+    async def _reject(self, send, limit: int) -> None:
+        body = f'{{"detail":"Request body is larger than {limit // (1024 * 1024)} MB"}}'.encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status.HTTP_413_CONTENT_TOO_LARGE,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("ascii"))],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limit, image_keys = self.routes.get(scope["path"].rstrip("/") or "/", (self.default_limit, frozenset()))
+        content_length = dict(scope.get("headers") or []).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            with _registry_lock:
+                _stats["rejected_too_large"] += 1
+            await self._reject(send, limit)
+            return
+
+        spooler = _DataUrlSpooler(self.spool_memory_bytes, {k.encode("ascii") for k in image_keys}) if image_keys else None
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                received += len(body)
+                if received > limit:
+                    with _registry_lock:
+                        _stats["rejected_too_large"] += 1
+                    raise BodyTooLarge(limit)
+                if spooler is not None:
+                    # base64 decoding and spool file writes stay off the event loop
+                    body = await run_in_threadpool(spooler.feed, body)
+                    if not message.get("more_body", False):
+                        body += spooler.finish()
+                    message = dict(message, body=body)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except BodyTooLarge:
+            # Raised outside a route's body parsing (e.g. no matching route)
+            if response_started:
+                raise
+            await self._reject(send, limit)
+        finally:
+            if spooler is not None:
+                await run_in_threadpool(spooler.close)
+
+
+def metrics() -> Dict[str, Any]:
+    with _registry_lock:
+        return dict(_stats, active_spooled_images=len(_registry))
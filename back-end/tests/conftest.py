@@ -0,0 +1,38 @@
+"""
+Shared setup for the back-end tests: run from back-end/ with
+
+    python -m pytest -q tests
+
+Modules are imported flat (as uvicorn does), against a throwaway SQLite database.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+_tmp = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/test.db"
+
+
+@pytest.fixture(scope="session")
+def db_tables():
+    import models  # noqa: F401  registers the tables
+    from database import init_db
+
+    init_db()
+
+
+@pytest.fixture
+def db(db_tables):
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,109 @@
+import time
+from datetime import timedelta
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+import main
+from jwt_cache import TokenClaimsCache
+from models import User
+from user_cache import user_cache
+
+
+def test_token_cache_hit_and_miss():
+    cache = TokenClaimsCache()
+    claims = {"sub": "1", "exp": time.time() + 60}
+    assert cache.get("a") is None
+    cache.put("a", claims)
+    assert cache.get("a") is claims
+    assert cache.get("b") is None
+    assert (cache.metrics()["hits"], cache.metrics()["misses"]) == (1, 2)
+
+
+def test_token_cache_drops_expired_and_skips_tokens_without_exp():
+    cache = TokenClaimsCache()
+    cache.put("expired", {"sub": "1", "exp": time.time() - 1})
+    cache.put("no-exp", {"sub": "1"})
+    assert cache.get("expired") is None and cache.get("no-exp") is None
+    assert cache.metrics()["entries"] == 0
+
+
+def test_token_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setenv("AUTH_TOKEN_CACHE_SIZE", "2")
+    cache = TokenClaimsCache()
+    exp = time.time() + 60
+    cache.put("a", {"exp": exp})
+    cache.put("b", {"exp": exp})
+    cache.get("a")
+    cache.put("c", {"exp": exp})
+    assert cache.get("b") is None and cache.get("a") and cache.get("c")
+
+
+@pytest.fixture
+def user(db):
+    user = User(email=f"{uuid4().hex}@example.com", full_name="Before", hashed_password="x")
+    db.add(user)
+    db.commit()
+    yield user
+    user_cache.invalidate(user.id)
+
+
+def test_verified_token_skips_decoding_on_repeat(db, user, monkeypatch):
+    token = main.create_access_token({"sub": str(user.id)})
+    decode = main.jwt.decode
+    calls = []
+    monkeypatch.setattr(main.jwt, "decode", lambda *a, **kw: calls.append(1) or decode(*a, **kw))
+
+    assert main.get_user_from_token(token, db).id == user.id
+    assert main.get_user_from_token(token, db).id == user.id
+    assert len(calls) == 1
+
+
+def test_expired_token_is_rejected(db, user):
+    token = main.create_access_token({"sub": str(user.id)}, expires_delta=timedelta(seconds=-1))
+    with pytest.raises(HTTPException) as e:
+        main.get_user_from_token(token, db)
+    assert e.value.status_code == 401
+
+
+def test_user_cache_serves_repeat_lookups_without_a_query(db, user):
+    from database import SessionLocal
+
+    hits = user_cache.metrics()["hits"]
+    assert user_cache.get(db, user.id).full_name == "Before"
+    other = SessionLocal()
+    try:
+        cached = user_cache.get(other, user.id)
+        assert cached.full_name == "Before" and cached in other
+    finally:
+        other.close()
+    assert user_cache.metrics()["hits"] == hits + 1
+
+
+def test_user_cache_is_invalidated_when_the_user_changes(db, user):
+    from database import SessionLocal
+
+    user_cache.get(db, user.id)
+    user.full_name = "After"
+    db.flush()
+    other = SessionLocal()
+    try:
+        # Flushed but not committed: the cached copy still stands
+        assert user_cache.get(other, user.id).full_name == "Before"
+        db.commit()
+        other.expunge_all()
+        assert user_cache.get(other, user.id).full_name == "After"
+    finally:
+        other.close()
+
+
+def test_rolled_back_change_keeps_the_cache(db, user):
+    user_cache.get(db, user.id)
+    invalidations = user_cache.metrics()["invalidations"]
+    user.full_name = "Never saved"
+    db.flush()
+    db.rollback()
+    db.query(User).count()
+    db.commit()  # must not pick up the rolled back change
+    assert user_cache.metrics()["invalidations"] == invalidations
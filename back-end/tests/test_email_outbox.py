@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, update
+
+import email_outbox
+from debug_smtp import DebugSMTPServer
+from models import EmailOutbox
+
+
+@pytest.fixture
+def smtp():
+    server = DebugSMTPServer(port=0, quiet=True).start()
+    try:
+        yield server
+    finally:
+        server.stop()
+
+
+@pytest.fixture
+def outbox(db, monkeypatch):
+    db.execute(delete(EmailOutbox))
+    db.commit()
+    for name in ("MAILTRAP_API_TOKEN", "SENDGRID_API_KEY", "SMTP_USERNAME", "SMTP_PASSWORD"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setenv("SMTP_STARTTLS", "false")
+    return db
+
+
+def _dispatcher(monkeypatch, port, **env):
+    monkeypatch.setenv("SMTP_PORT", str(port))
+    for name, value in env.items():
+        monkeypatch.setenv(name, str(value))
+    return email_outbox.EmailDispatcher()
+
+
+def _enqueue(db, n):
+    for i in range(n):
+        email_outbox.enqueue(db, f"user{i}@example.com", f"Subject {i}", f"Body {i}")
+    db.commit()
+
+
+def _rows(db):
+    db.expire_all()
+    return db.query(EmailOutbox).order_by(EmailOutbox.id).all()
+
+
+def _make_due(db):
+    db.execute(update(EmailOutbox).values(next_attempt_at=datetime.utcnow() - timedelta(seconds=1)))
+    db.commit()
+
+
+def test_batch_goes_over_one_connection(outbox, smtp, monkeypatch):
+    dispatcher = _dispatcher(monkeypatch, smtp.port)
+    _enqueue(outbox, 3)
+    try:
+        assert dispatcher.run_once() == 3
+        assert [m["Subject"] for m in smtp.messages] == ["Subject 0", "Subject 1", "Subject 2"]
+        assert smtp.connections == 1
+
+        # The connection is kept for the next batch
+        _enqueue(outbox, 2)
+        assert dispatcher.run_once() == 2
+        assert smtp.connections == 1
+    finally:
+        dispatcher.stop()
+        dispatcher._loop()  # returns at once when stopped, and closes the transports
+
+    rows = _rows(outbox)
+    assert all(r.status == "sent" and r.transport == "smtp" for r in rows)
+    assert all(r.body is None and r.claim_token is None for r in rows)
+    metrics = dispatcher.metrics()
+    assert metrics["sent"] == 5 and metrics["batches"] == 2 and metrics["smtp_connections"] == 1
+
+
+def test_retries_with_backoff_then_fails(outbox, smtp, monkeypatch):
+    port = smtp.port
+    smtp.stop()  # nothing listens on the port any more
+    dispatcher = _dispatcher(monkeypatch, port, EMAIL_MAX_ATTEMPTS=3, EMAIL_RETRY_BASE_SECONDS=10)
+    _enqueue(outbox, 1)
+
+    delays = []
+    for attempt in (1, 2):
+        before = datetime.utcnow()
+        assert dispatcher.run_once() == 1
+        (row,) = _rows(outbox)
+        assert row.status == "pending" and row.attempts == attempt
+        assert row.last_error and row.claim_token is None
+        delays.append((row.next_attempt_at - before).total_seconds())
+        assert dispatcher.run_once() == 0  # not due yet
+        _make_due(outbox)
+
+    # 10 s then 20 s, with +-20% jitter
+    assert 8 <= delays[0] <= 12.5
+    assert 16 <= delays[1] <= 24.5
+
+    assert dispatcher.run_once() == 1
+    (row,) = _rows(outbox)
+    assert row.status == "failed" and row.attempts == 3 and row.last_error
+    assert row.body == "Body 0"
+    _make_due(outbox)
+    assert dispatcher.run_once() == 0
+
+    metrics = dispatcher.metrics()
+    assert metrics["retried"] == 2 and metrics["failed"] == 1 and metrics["sent"] == 0
+
+
+def test_claim_held_by_a_dead_process_is_reclaimed(outbox, smtp, monkeypatch):
+    dead = _dispatcher(monkeypatch, smtp.port)
+    dispatcher = _dispatcher(monkeypatch, smtp.port)
+    _enqueue(outbox, 1)
+
+    claimed = dead._claim(outbox)  # claimed, then never finished
+    assert len(claimed) == 1
+    assert dispatcher.run_once() == 0  # still leased
+    assert smtp.messages == []
+
+    _make_due(outbox)  # the lease ran out
+    assert dispatcher.run_once() == 1
+    (row,) = _rows(outbox)
+    assert row.status == "sent" and row.attempts == 2 and row.claim_token is None
+    assert len(smtp.messages) == 1
+
+
+def test_round_that_lost_its_claim_does_not_overwrite_the_result(outbox, smtp, monkeypatch):
+    slow = _dispatcher(monkeypatch, smtp.port)
+    dispatcher = _dispatcher(monkeypatch, smtp.port)
+    _enqueue(outbox, 1)
+
+    def send_after_lease_ran_out(message):
+        # While this round is stuck, its lease ends and another round sends the message
+        _make_due(outbox)
+        assert dispatcher.run_once() == 1
+        raise RuntimeError("smtp: timed out")
+
+    slow._send = send_after_lease_ran_out
+    assert slow.run_once() == 1
+
+    (row,) = _rows(outbox)
+    assert row.status == "sent" and row.last_error is None and row.claim_token is None
+    assert slow.metrics()["retried"] == 0
@@ -0,0 +1,20 @@
+from env_config import env_float, env_int, env_str
+
+
+def test_quoted_values_are_unwrapped(monkeypatch):
+    monkeypatch.setenv("TEST_ENV_VALUE", ' "42" ')
+    assert env_int("TEST_ENV_VALUE", 1) == 42
+    assert env_float("TEST_ENV_VALUE", 1.0) == 42.0
+    assert env_str("TEST_ENV_VALUE") == "42"
+    monkeypatch.setenv("TEST_ENV_VALUE", "'0.75'")
+    assert env_float("TEST_ENV_VALUE", 1.0) == 0.75
+
+
+def test_unset_empty_or_invalid_values_give_the_default(monkeypatch):
+    monkeypatch.delenv("TEST_ENV_VALUE", raising=False)
+    assert env_int("TEST_ENV_VALUE", 7) == 7 and env_str("TEST_ENV_VALUE", "x") == "x"
+    for value in ("", '""', "seven", "0.5"):
+        monkeypatch.setenv("TEST_ENV_VALUE", value)
+        assert env_int("TEST_ENV_VALUE", 7) == 7
+    monkeypatch.setenv("TEST_ENV_VALUE", "1e3")
+    assert env_float("TEST_ENV_VALUE", 2.0) == 1000.0
@@ -0,0 +1,94 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+import image_preprocess
+from image_preprocess import ImagePreprocessPool, fit_exact, probe
+
+
+def _encode(width, height, fmt="PNG"):
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 80, 30)).save(out, format=fmt)
+    return out.getvalue()
+
+
+def _size(data):
+    with Image.open(io.BytesIO(data)) as img:
+        return img.format, img.size
+
+
+def test_probe_reads_header_only():
+    data = _encode(640, 360, "JPEG")
+    assert probe(data) == ("JPEG", 640, 360)
+    # The header alone is enough: the pixel data is never read
+    assert probe(_encode(64, 48)[:64]) == ("PNG", 64, 48)
+
+
+def test_fit_exact_passes_matching_image_through():
+    data = _encode(1280, 720, "JPEG")
+    prepared = fit_exact(data, 1280, 720)
+    assert prepared.data is data and not prepared.resized and prepared.format == "JPEG"
+
+
+@pytest.mark.parametrize("fmt", ["PNG", "JPEG"])
+@pytest.mark.parametrize("gap", ["2", "0"])
+def test_fit_exact_resizes_to_exact_size(monkeypatch, fmt, gap):
+    monkeypatch.setenv("MEDIA_IMAGE_REDUCING_GAP", gap)
+    prepared = fit_exact(_encode(4000, 3000, fmt), 1280, 720)
+    assert prepared.resized and (prepared.original_width, prepared.original_height) == (4000, 3000)
+    assert _size(prepared.data) == ("PNG", (1280, 720))
+
+
+def test_pool_skips_workers_for_matching_image():
+    pool = ImagePreprocessPool()
+    data = _encode(720, 1280)
+    prepared = pool.fit_exact(data, 720, 1280)
+    assert prepared.data is data and not prepared.resized
+    metrics = pool.metrics()
+    assert metrics["passthrough"] == 1 and metrics["submitted"] == 0 and not metrics["started"]
+
+
+def test_pool_resizes_in_worker_process():
+    pool = ImagePreprocessPool()
+    try:
+        prepared = pool.fit_exact(_encode(300, 200, "JPEG"), 1280, 720)
+    finally:
+        pool.shutdown()
+    assert prepared.resized and _size(prepared.data) == ("PNG", (1280, 720))
+    assert pool.metrics()["completed"] == 1
+
+
+def test_pool_rejects_when_queue_is_full(monkeypatch):
+    monkeypatch.setenv("MEDIA_IMAGE_PROCESS_MAX_PENDING", "1")
+    pool = ImagePreprocessPool()
+    assert pool._slots.acquire(blocking=False)  # one job already pending
+    with pytest.raises(image_preprocess.ImagePoolBusy):
+        pool.fit_exact(_encode(300, 200), 1280, 720)
+    assert pool.metrics()["rejected"] == 1
+
+
+def test_pool_keeps_slot_until_timed_out_job_finishes(monkeypatch):
+    monkeypatch.setenv("MEDIA_IMAGE_PROCESS_MAX_PENDING", "1")
+    pool = ImagePreprocessPool()
+    pool.timeout_seconds = 0.05
+    release = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(pool, "start", lambda: executor)
+    monkeypatch.setattr(image_preprocess, "fit_exact", lambda *args: release.wait(5))
+    try:
+        with pytest.raises(FuturesTimeout):
+            pool.fit_exact(_encode(300, 200), 1280, 720)
+        # The worker is still busy with the timed-out job: no new job is queued behind it
+        with pytest.raises(image_preprocess.ImagePoolBusy):
+            pool.fit_exact(_encode(300, 200), 1280, 720)
+        assert pool.metrics()["in_flight"] == 1
+    finally:
+        release.set()
+        executor.shutdown(wait=True)
+    assert pool.metrics()["in_flight"] == 0
+    assert pool._slots.acquire(blocking=False)
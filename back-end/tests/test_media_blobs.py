@@ -0,0 +1,106 @@
+import hashlib
+import os
+
+import pytest
+from sqlalchemy import update
+
+import media_blobs
+from media_storage import LocalMediaStorage, set_media_storage
+from models import MediaBlob
+
+
+@pytest.fixture
+def storage(tmp_path):
+    set_media_storage(LocalMediaStorage(tmp_path / "store"))
+    yield tmp_path
+    set_media_storage(None)
+
+
+def _commit(db, tmp_path, content: bytes) -> MediaBlob:
+    path = tmp_path / f"{os.urandom(4).hex()}.part"
+    path.write_bytes(content)
+    return media_blobs.commit_blob(db, path, hashlib.sha256(content).hexdigest(), len(content), ext=".bin")
+
+
+def _ref_count(db, sha256):
+    db.expire_all()
+    blob = db.get(MediaBlob, sha256)
+    return None if blob is None else blob.ref_count
+
+
+def test_same_content_shares_one_blob(db, storage):
+    content = os.urandom(1000)
+    first = _commit(db, storage, content)
+    second = _commit(db, storage, content)
+    assert first.file_path == second.file_path and _ref_count(db, first.sha256) == 2
+
+    assert media_blobs.release_ref(db, first.sha256) == 0
+    assert os.path.exists(first.file_path)
+    assert media_blobs.release_ref(db, first.sha256) == 1000
+    assert not os.path.exists(first.file_path) and _ref_count(db, first.sha256) is None
+
+
+def test_reference_is_not_added_to_a_dying_blob(db, storage):
+    blob = _commit(db, storage, os.urandom(100))
+    # Another worker dropped the last reference and hasn't deleted the row yet
+    db.execute(update(MediaBlob).where(MediaBlob.sha256 == blob.sha256).values(ref_count=0))
+    db.commit()
+    assert not media_blobs.add_ref(db, blob.sha256)
+    assert _ref_count(db, blob.sha256) == 0
+
+
+def test_only_one_release_deletes_the_file(db, storage, monkeypatch):
+    blob = _commit(db, storage, os.urandom(100))
+    deleted = []
+    local = LocalMediaStorage(storage / "store")
+    monkeypatch.setattr(local, "delete", lambda location: deleted.append(location) or 100)
+    monkeypatch.setattr(media_blobs, "storage_for_location", lambda location: local)
+
+    assert media_blobs.release_ref(db, blob.sha256) == 100
+    # A second release for the same (already deleted) blob must not delete anything
+    assert media_blobs.release_ref(db, blob.sha256) == 0
+    assert deleted == [blob.file_path]
+
+
+def test_release_refs_deletes_blobs_that_reach_zero(db, storage):
+    shared = os.urandom(10)
+    a = _commit(db, storage, shared)
+    _commit(db, storage, shared)
+    b = _commit(db, storage, os.urandom(20))
+    removed = []
+
+    def delete_files(locations):
+        removed.extend(locations)
+        return len(locations)
+
+    assert media_blobs.release_refs(db, {a.sha256: 1, b.sha256: 1}, delete_files) == 1
+    assert removed == [b.file_path]
+    assert _ref_count(db, a.sha256) == 1 and _ref_count(db, b.sha256) is None
+
+
+def test_delete_orphan_file_keeps_live_blobs(db, storage):
+    blob = _commit(db, storage, os.urandom(50))
+    assert media_blobs.delete_orphan_file(db, blob.sha256, blob.file_path) == 0
+    assert os.path.exists(blob.file_path)
+
+    # Zero-reference row left behind (crash between the decrement and the delete)
+    db.execute(update(MediaBlob).where(MediaBlob.sha256 == blob.sha256).values(ref_count=0))
+    db.commit()
+    assert media_blobs.delete_orphan_file(db, blob.sha256, blob.file_path) == 50
+    assert not os.path.exists(blob.file_path) and _ref_count(db, blob.sha256) is None
+
+
+def test_downloaded_video_is_removed_when_storing_fails(db, storage, monkeypatch):
+    import main
+
+    tmp = storage / "download.part"
+    tmp.write_bytes(b"not an mp4")
+    monkeypatch.setattr(main.media_fetch, "download_to_temp", lambda resp: (tmp, "0" * 64, 10))
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(main.media_blobs, "commit_blob", fail)
+    with pytest.raises(RuntimeError):
+        main._store_video_stream(db, 1, "task-1", None, None)
+    assert not tmp.exists()
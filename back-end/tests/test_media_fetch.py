@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import media_fetch
+
+BODY = os.urandom(3 * 1024 * 1024 + 123)
+ETAG = '"v1"'
+
+
+class _Upstream(BaseHTTPRequestHandler):
+    """Serves BODY; honors Range unless told otherwise and can cut responses short."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.headers.get("Range"))
+            cut = server.cuts.pop(0) if server.cuts else None
+        start, end = 0, len(BODY) - 1
+        rng = self.headers.get("Range")
+        if rng and server.ranges and self.headers.get("If-Range", ETAG) == ETAG:
+            first, _, last = rng[len("bytes="):].partition("-")
+            start, end = int(first), int(last) if last else len(BODY) - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(BODY)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end + 1 - start))
+        self.send_header("ETag", ETAG)
+        if server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        data = BODY[start:end + 1]
+        if cut is not None:
+            self.wfile.write(data[:cut])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def upstream(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_fetch, "temp_dir", lambda: tmp_path)
+    monkeypatch.setenv("MEDIA_FETCH_BACKOFF_SECONDS", "0")
+    monkeypatch.setenv("MEDIA_FETCH_MIN_PARALLEL_MB", "1")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Upstream)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.cuts = []  # bytes sent by the next responses before the connection drops
+    server.ranges = True
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/video.mp4"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _download(url):
+    path, sha256, size = media_fetch.download_to_temp(requests.get(url, stream=True, timeout=10))
+    try:
+        return path.read_bytes(), sha256, size
+    finally:
+        path.unlink()
+
+
+def test_parallel_ranges(upstream, monkeypatch):
+    monkeypatch.setenv("MEDIA_FETCH_CONNECTIONS", "4")
+    data, sha256, size = _download(upstream.url)
+    assert data == BODY and size == len(BODY)
+    assert sha256 == hashlib.sha256(BODY).hexdigest()
+    # The first response serves range 0; the other three are ranged requests
+    assert upstream.requests[0] is None
+    assert len(upstream.requests) == 4 and all(r.startswith("bytes=") for r in upstream.requests[1:])
+    assert media_fetch.metrics()["last_download"]["connections"] == 4
+
+
+def test_dropped_connection_resumes_from_last_byte(upstream, monkeypatch):
+    monkeypatch.setenv("MEDIA_FETCH_CONNECTIONS", "1")
+    upstream.cuts = [1024 * 1024]
+    before = media_fetch.metrics()["retries"]
+
+    data, _, _ = _download(upstream.url)
+
+    assert data == BODY
+    assert media_fetch.metrics()["retries"] == before + 1
+    resumed_from = int(upstream.requests[1][len("bytes="):].partition("-")[0])
+    assert 0 < resumed_from <= 1024 * 1024
+
+
+def test_falls_back_to_single_stream_when_ranges_ignored(upstream, monkeypatch):
+    monkeypatch.setenv("MEDIA_FETCH_CONNECTIONS", "4")
+    upstream.ranges = False  # answers every request with the full 200 body...
+    before = media_fetch.metrics()
+
+    # ...but advertises ranges on the first response, so the download is split
+    original = _Upstream.end_headers
+
+    def advertise_once(handler):
+        if len(upstream.requests) == 1:
+            handler.send_header("Accept-Ranges", "bytes")
+        original(handler)
+
+    monkeypatch.setattr(_Upstream, "end_headers", advertise_once)
+    data, _, size = _download(upstream.url)
+
+    assert data == BODY and size == len(BODY)
+    after = media_fetch.metrics()
+    assert after["parallel_fallbacks"] == before["parallel_fallbacks"] + 1
+    assert after["single_stream_downloads"] == before["single_stream_downloads"] + 1
+
+
+def test_failed_download_keeps_checkpoint_for_next_attempt(upstream, monkeypatch, tmp_path):
+    monkeypatch.setenv("MEDIA_FETCH_CONNECTIONS", "1")
+    monkeypatch.setenv("MEDIA_FETCH_RETRIES", "0")
+    monkeypatch.setattr(media_fetch, "CHECKPOINT_EVERY_BYTES", 64 * 1024)
+    upstream.cuts = [1024 * 1024]
+
+    with pytest.raises(requests.RequestException):
+        _download(upstream.url)
+    assert list(tmp_path.glob("*.part")) and list(tmp_path.glob("*.part.json"))
+
+    before = media_fetch.metrics()["resumed_downloads"]
+    data, _, _ = _download(upstream.url)
+
+    assert data == BODY
+    assert media_fetch.metrics()["resumed_downloads"] == before + 1
+    assert upstream.requests[-1].startswith("bytes=") and not upstream.requests[-1].startswith("bytes=0-")
+    assert not list(tmp_path.glob("*.part*"))
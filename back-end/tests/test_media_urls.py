@@ -0,0 +1,52 @@
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+def _params(url):
+    return {k: v[0] for k, v in parse_qs(urlparse(url).query).items()}
+
+
+def test_signed_url_is_stable_within_a_ttl_window(monkeypatch):
+    monkeypatch.setenv("MEDIA_URL_TTL_SECONDS", "600")
+    window_start = 600 * 1_666_667
+    monkeypatch.setattr(main.time, "time", lambda: window_start + 1)
+    first = main._sign_media_url("http://api/image/kling/t1/download", 7, "image/t1")
+    monkeypatch.setattr(main.time, "time", lambda: window_start + 599)
+    assert main._sign_media_url("http://api/image/kling/t1/download", 7, "image/t1") == first
+    monkeypatch.setattr(main.time, "time", lambda: window_start + 601)
+    assert main._sign_media_url("http://api/image/kling/t1/download", 7, "image/t1") != first
+
+    exp = int(_params(first)["exp"])
+    assert 600 <= exp - (window_start + 599) and exp - (window_start + 1) <= 1200
+
+
+def test_signed_url_verifies_and_expires(monkeypatch):
+    monkeypatch.setenv("MEDIA_URL_TTL_SECONDS", "600")
+    params = _params(main._sign_media_url("http://api/video/sora2/v1/download", 7, "v1"))
+    assert main._verify_media_signature("v1", params["uid"], params["exp"], params["sig"]) == 7
+
+    with pytest.raises(HTTPException) as e:
+        main._verify_media_signature("v2", params["uid"], params["exp"], params["sig"])
+    assert e.value.status_code == 403
+
+    monkeypatch.setattr(main.time, "time", lambda: int(params["exp"]) + 1)
+    with pytest.raises(HTTPException) as e:
+        main._verify_media_signature("v1", params["uid"], params["exp"], params["sig"])
+    assert e.value.status_code == 401
+
+
+def test_image_urls_use_the_short_media_ttl(monkeypatch):
+    monkeypatch.setenv("MEDIA_URL_TTL_SECONDS", "600")
+    job = {
+        "status": "succeeded",
+        "provider": "kling",
+        "provider_task_id": "t1",
+        "user_id": 7,
+        "image_url": f"{main._backend_url()}/image/kling/t1/download",
+    }
+    exp = int(_params(main._client_image_url(job))["exp"])
+    assert exp - main.time.time() <= 1200
@@ -0,0 +1,99 @@
+import struct
+
+import pytest
+
+import mp4_faststart
+from mp4_faststart import Mp4Error, iter_boxes, process_file, relocate_moov
+
+CHUNKS = [b"chunk-one|", b"chunk-two-is-longer|", b"chunk-three|"]
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def moov(offsets, timescale=1000, duration=4000, width=640, height=360, table=b"stco") -> bytes:
+    mvhd = box(b"mvhd", b"\0" * 12 + struct.pack(">II", timescale, duration) + b"\0" * 80)
+    tkhd = box(b"tkhd", b"\0" * 76 + struct.pack(">II", width << 16, height << 16))
+    hdlr = box(b"hdlr", b"\0" * 8 + b"vide" + b"\0" * 13)
+    fmt = ">I" if table == b"stco" else ">Q"
+    entries = b"".join(struct.pack(fmt, o) for o in offsets)
+    stbl = box(b"stbl", box(table, b"\0" * 4 + struct.pack(">I", len(offsets)) + entries))
+    mdia = box(b"mdia", hdlr + box(b"minf", stbl))
+    return box(b"moov", mvhd + box(b"trak", tkhd + mdia))
+
+
+def chunk_offsets(data: bytes):
+    top = {b.type: b for b in iter_boxes(data, 0, len(data))}
+    stco = data.index(b"stco") - 4
+    count = struct.unpack_from(">I", data, stco + 12)[0]
+    return top, list(struct.unpack_from(f">{count}I", data, stco + 16))
+
+
+def late_moov_file(path):
+    ftyp = box(b"ftyp", b"isom\0\0\0\0isomavc1")
+    mdat_start = len(ftyp)
+    offsets, pos = [], mdat_start + 8
+    for chunk in CHUNKS:
+        offsets.append(pos)
+        pos += len(chunk)
+    data = ftyp + box(b"mdat", b"".join(CHUNKS)) + moov(offsets)
+    path.write_bytes(data)
+    return data
+
+
+def test_moves_moov_to_front_and_shifts_chunk_offsets(tmp_path):
+    src, dst = tmp_path / "late.mp4", tmp_path / "fast.mp4"
+    late_moov_file(src)
+
+    info = process_file(src, dst)
+
+    out = dst.read_bytes()
+    assert [b.type for b in iter_boxes(out, 0, len(out))] == [b"ftyp", b"moov", b"mdat"]
+    top, offsets = chunk_offsets(out)
+    assert [out[o:o + len(c)] for o, c in zip(offsets, CHUNKS)] == CHUNKS
+    assert info.rewritten and info.faststart
+    assert info.size == len(out) == src.stat().st_size
+    assert (info.duration_seconds, info.width, info.height) == (4.0, 640, 360)
+
+
+def test_rewrite_streams_mdat_through_small_buffer(tmp_path, monkeypatch):
+    monkeypatch.setattr(mp4_faststart, "COPY_CHUNK_SIZE", 7)
+    src, dst = tmp_path / "late.mp4", tmp_path / "fast.mp4"
+    late_moov_file(src)
+
+    process_file(src, dst)
+
+    out = dst.read_bytes()
+    _, offsets = chunk_offsets(out)
+    assert [out[o:o + len(c)] for o, c in zip(offsets, CHUNKS)] == CHUNKS
+
+
+def test_already_faststart_is_left_alone(tmp_path):
+    ftyp = box(b"ftyp", b"isom\0\0\0\0")
+    head = moov([0])  # offsets don't matter: nothing is rewritten
+    src, dst = tmp_path / "fast.mp4", tmp_path / "copy.mp4"
+    src.write_bytes(ftyp + head + box(b"mdat", b"data"))
+
+    info = process_file(src, dst)
+
+    assert info.faststart and not info.rewritten
+    assert not dst.exists()
+
+
+def test_not_an_mp4(tmp_path):
+    src = tmp_path / "junk.mp4"
+    src.write_bytes(b"not an mp4" * 10)
+    with pytest.raises(Mp4Error):
+        process_file(src, tmp_path / "out.mp4")
+
+
+def test_offsets_past_4gb_upgrade_stco_to_co64():
+    original = moov([0xFFFFFFF0, 100])
+    relocated = relocate_moov(original, 50, 0xFFFFFFFF + 1)
+
+    assert b"co64" in relocated and b"stco" not in relocated
+    p = relocated.index(b"co64") + 4
+    assert struct.unpack_from(">I", relocated, p + 4)[0] == 2
+    shifted = struct.unpack_from(">2Q", relocated, p + 8)
+    assert shifted == (0xFFFFFFF0 + len(relocated), 100 + len(relocated))
@@ -0,0 +1,154 @@
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import main
+import rate_limit
+from database import SessionLocal
+from models import RateLimitBucket
+from rate_limit import DatabaseRateLimitBackend, MemoryRateLimitBackend, RateLimitBackend, RateLimited, RateLimiter
+
+
+def _request(ip="10.0.0.1", forwarded=None):
+    headers = {"x-forwarded-for": forwarded} if forwarded else {}
+    return SimpleNamespace(headers=headers, client=SimpleNamespace(host=ip))
+
+
+def test_backend_interface_is_abstract():
+    with pytest.raises(TypeError):
+        RateLimitBackend()
+
+
+def test_gcra_allows_burst_then_refills_one_per_interval():
+    backend = MemoryRateLimitBackend(max_keys=100)
+    # 3 attempts per 30 s: a burst of 3, then one every 10 s
+    assert [backend.hit("k", 10.0, 3, 1000.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert backend.hit("k", 10.0, 3, 1000.0) == pytest.approx(10.0)
+    assert backend.hit("k", 10.0, 3, 1004.0) == pytest.approx(6.0)
+    assert backend.hit("k", 10.0, 3, 1010.0) == 0.0
+    assert backend.hit("k", 10.0, 3, 1010.0) == pytest.approx(10.0)
+    # A long pause refills the whole burst, not more
+    assert [backend.hit("k", 10.0, 3, 2000.0) for _ in range(4)][-1] == pytest.approx(10.0)
+
+
+def test_rejected_attempts_are_not_counted():
+    backend = MemoryRateLimitBackend(max_keys=100)
+    backend.hit("k", 10.0, 1, 0.0)
+    for _ in range(5):
+        backend.hit("k", 10.0, 1, 1.0)
+    assert backend.hit("k", 10.0, 1, 10.0) == 0.0
+
+
+def test_retry_after_is_whole_seconds():
+    assert RateLimited(0.2).retry_after == 1
+    assert RateLimited(6.01).retry_after == 7
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_LOGIN_IP", "5/60")
+    monkeypatch.setenv("RATE_LIMIT_LOGIN_ACCOUNT", "2/60")
+    monkeypatch.setenv("RATE_LIMIT_FORGOT_IP", "0")
+    monkeypatch.setenv("RATE_LIMIT_RESET_IP", "100/900")
+    monkeypatch.setenv("RATE_LIMIT_RESET_ACCOUNT", "2/900")
+    monkeypatch.setenv("RATE_LIMIT_PROXY_HOPS", "0")
+    return RateLimiter()
+
+
+def test_account_limit_applies_across_ips(limiter):
+    limiter.check("login", _request("10.0.0.1"), "Alice@example.com")
+    limiter.check("login", _request("10.0.0.2"), "alice@example.com ")
+    with pytest.raises(RateLimited):
+        limiter.check("login", _request("10.0.0.3"), "alice@example.com")
+    limiter.check("login", _request("10.0.0.3"), "bob@example.com")
+
+
+def test_ip_limit_applies_across_accounts(limiter):
+    for i in range(5):
+        limiter.check("login", _request(), f"user{i}@example.com")
+    with pytest.raises(RateLimited) as e:
+        limiter.check("login", _request(), "someone-else@example.com")
+    assert e.value.retry_after == 12
+    limiter.check("login", _request("10.0.0.9"), "someone-else@example.com")
+    assert limiter.metrics()["scopes"]["login"] == {"allowed": 6, "limited": 1}
+
+
+def test_scopes_have_separate_budgets_and_zero_turns_a_limit_off(limiter):
+    for _ in range(5):
+        limiter.check("login", _request())
+    for _ in range(50):
+        limiter.check("forgot", _request())  # FORGOT_IP=0: off
+    limiter.check("reset", _request())
+    assert limiter.metrics()["limits"]["forgot"]["ip"] is None
+
+
+def test_reset_endpoints_share_one_budget(limiter, monkeypatch):
+    monkeypatch.setattr(main, "rate_limiter", limiter)
+    client = TestClient(main.app)
+    email = f"{uuid4().hex}@example.com"
+
+    assert client.post("/auth/verify-reset-code", json={"email": email, "code": "1"}).status_code == 400
+    resp = client.post("/auth/reset-password-with-code", json={"email": email, "code": "1", "password": "x" * 12})
+    assert resp.status_code == 400
+    resp = client.post("/auth/verify-reset-code", json={"email": email, "code": "1"})
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) == 450
+
+
+@pytest.mark.parametrize("hops, forwarded, expected", [
+    (0, None, "10.0.0.1"),
+    (0, "6.6.6.6", "10.0.0.1"),  # header ignored without a configured proxy
+    (1, "203.0.113.7", "203.0.113.7"),
+    (1, "6.6.6.6, 203.0.113.7", "203.0.113.7"),  # client-supplied entries on the left are ignored
+    (2, "6.6.6.6, 203.0.113.7, 10.1.1.1", "203.0.113.7"),
+    (2, "203.0.113.7", "10.0.0.1"),  # fewer entries than proxies: fall back to the peer
+])
+def test_client_ip(monkeypatch, hops, forwarded, expected):
+    monkeypatch.setenv("RATE_LIMIT_PROXY_HOPS", str(hops))
+    assert RateLimiter().client_ip(_request("10.0.0.1", forwarded)) == expected
+
+
+def test_spoofed_forwarded_for_does_not_get_a_fresh_budget(limiter, monkeypatch):
+    monkeypatch.setattr(limiter, "proxy_hops", 1)
+    for i in range(5):
+        limiter.check("login", _request("10.9.9.9", f"1.1.1.{i}, 203.0.113.7"))
+    with pytest.raises(RateLimited):
+        limiter.check("login", _request("10.9.9.9", "1.1.1.99, 203.0.113.7"))
+
+
+def test_database_backend_retries_after_concurrent_insert(db_tables, monkeypatch):
+    key = uuid4().hex
+
+    def session_with_racing_insert():
+        session = SessionLocal()
+
+        @event.listens_for(session, "before_flush", once=True)
+        def other_worker_inserts_first(*args):
+            other = SessionLocal()
+            other.add(RateLimitBucket(key=key, tat=1005.0))
+            other.commit()
+            other.close()
+
+        return session
+
+    monkeypatch.setattr(rate_limit, "SessionLocal", session_with_racing_insert)
+    backend = DatabaseRateLimitBackend()
+
+    # burst 1: the other worker's attempt (tat 1005) used it, so this one is over the limit
+    assert backend.hit(key, 10.0, 1, 1000.0) == pytest.approx(5.0)
+    check = SessionLocal()
+    try:
+        assert check.get(RateLimitBucket, key).tat == 1005.0
+    finally:
+        check.close()
+
+
+def test_database_backend_counts_attempts(db_tables):
+    backend = DatabaseRateLimitBackend()
+    key = uuid4().hex
+    assert backend.hit(key, 10.0, 2, 1000.0) == 0.0
+    assert backend.hit(key, 10.0, 2, 1000.0) == 0.0
+    assert backend.hit(key, 10.0, 2, 1000.0) == pytest.approx(10.0)
@@ -0,0 +1,120 @@
+import base64
+import json
+import os
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+import request_body
+from request_body import BodyLimitMiddleware, _DataUrlSpooler, spooled_image
+
+IMAGE = os.urandom(200 * 1024 + 7)
+DATA_URL = "data:image/png;base64," + base64.b64encode(IMAGE).decode("ascii")
+
+
+def _spool(body: bytes, chunk_size: int, keys=(b"image_url", b"image_url2")):
+    spooler = _DataUrlSpooler(1024, set(keys))
+    out = b"".join(spooler.feed(body[i:i + chunk_size]) for i in range(0, len(body), chunk_size))
+    return spooler, out + spooler.finish()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 17, 4096, 10 ** 7])
+def test_image_field_is_spooled_at_any_chunk_size(chunk_size):
+    body = json.dumps({"prompt": "a cat", "image_url": DATA_URL, "n": [1, 2]}).encode()
+    spooler, out = _spool(body, chunk_size)
+    try:
+        parsed = json.loads(out)
+        assert parsed["prompt"] == "a cat" and parsed["n"] == [1, 2]
+        image = spooled_image(parsed["image_url"])
+        assert image.read() == IMAGE and image.content_type == "image/png" and image.size == len(IMAGE)
+    finally:
+        spooler.close()
+    assert spooled_image(parsed["image_url"]) is None
+
+
+def test_other_strings_pass_through_untouched():
+    body = json.dumps({
+        "prompt": f'use "{DATA_URL[:80]}" as reference',
+        "extra": DATA_URL,
+        "nested": {"image_url": DATA_URL},
+        "image_url2": "https://example.com/a.png",
+    }).encode()
+    spooler, out = _spool(body, 1000)
+    assert out == body and not spooler.images
+
+
+def test_escaped_slashes_and_image_arrays():
+    escaped = DATA_URL.replace("/", "\\/")
+    body = ('{"image_urls": ["%s", "https://example.com/b.png", "%s"]}' % (escaped, DATA_URL)).encode()
+    spooler, out = _spool(body, 33, keys=(b"image_urls",))
+    try:
+        first, url, last = json.loads(out)["image_urls"]
+        assert url == "https://example.com/b.png"
+        assert spooled_image(first).read() == IMAGE and spooled_image(last).read() == IMAGE
+    finally:
+        spooler.close()
+
+
+def test_invalid_base64_is_rejected():
+    body = b'{"image_url": "data:image/png;base64,not*base64"}'
+    spooler = _DataUrlSpooler(1024, {b"image_url"})
+    with pytest.raises(HTTPException) as e:
+        spooler.feed(body)
+    assert e.value.status_code == 400
+    spooler.close()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("MAX_BODY_MB", "1")
+    monkeypatch.setenv("MEDIA_JSON_BODY_MAX_MB", "2")
+    app = FastAPI()
+
+    @app.post("/image/image-to-image")
+    async def image_to_image(request: Request):
+        payload = await request.json()
+        image = spooled_image(payload["image_url"])
+        return {"size": image.size, "prompt": payload["prompt"]}
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return {"size": len(await request.body())}
+
+    app.add_middleware(BodyLimitMiddleware)
+    return TestClient(app)
+
+
+def test_middleware_spools_route_images(client):
+    before = request_body.metrics()
+    resp = client.post("/image/image-to-image", json={"prompt": "x", "image_url": DATA_URL})
+    assert resp.status_code == 200
+    assert resp.json() == {"size": len(IMAGE), "prompt": "x"}
+    after = request_body.metrics()
+    assert after["spooled_images"] == before["spooled_images"] + 1
+    assert after["active_spooled_images"] == 0
+
+
+def test_middleware_rejects_by_content_length(client):
+    resp = client.post("/echo", content=b"x" * (1024 * 1024 + 1))
+    assert resp.status_code == 413
+    assert resp.json() == {"detail": "Request body is larger than 1 MB"}
+    assert client.post("/echo", content=b"x" * 1024).json() == {"size": 1024}
+
+
+def test_middleware_rejects_streamed_body_over_limit(client):
+    def chunks():
+        for _ in range(3):
+            yield b"x" * (512 * 1024)
+
+    before = request_body.metrics()["rejected_too_large"]
+    resp = client.post("/echo", content=chunks())
+    assert resp.status_code == 413
+    assert request_body.metrics()["rejected_too_large"] == before + 1
+
+
+def test_middleware_uses_route_limit(client):
+    big = "data:image/png;base64," + base64.b64encode(os.urandom(1024 * 1024)).decode("ascii")
+    assert client.post("/image/image-to-image", json={"prompt": "x", "image_url": big}).status_code == 200
+    bigger = "data:image/png;base64," + base64.b64encode(os.urandom(2 * 1024 * 1024)).decode("ascii")
+    assert client.post("/image/image-to-image", json={"prompt": "x", "image_url": bigger}).status_code == 413
@@ -0,0 +1,95 @@
+import time
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from fastapi.testclient import TestClient
+
+import main
+import media_storage
+from media_storage import MediaStorage, S3MediaStorage, set_media_storage, storage_for_location
+from models import StoredVideo, User
+
+BUCKET = "media-test"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        storage = S3MediaStorage(BUCKET, client=client, key_prefix="media", presign_expire_seconds=120)
+        set_media_storage(storage)
+        yield storage
+        set_media_storage(None)
+        media_storage._s3_by_bucket.clear()
+
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        MediaStorage()
+
+
+def test_put_exists_size_delete(s3, tmp_path):
+    src = tmp_path / "clip.part"
+    src.write_bytes(b"x" * 1234)
+
+    location = s3.put_file(src, "blobs/ab/abc.mp4", "video/mp4")
+
+    assert location == f"s3://{BUCKET}/media/blobs/ab/abc.mp4"
+    assert not src.exists()  # moved, like the local backend
+    assert s3.exists(location) and s3.size(location) == 1234
+    assert s3.open(location).read() == b"x" * 1234
+    head = s3.client.head_object(Bucket=BUCKET, Key="media/blobs/ab/abc.mp4")
+    assert head["ContentType"] == "video/mp4"
+
+    assert s3.delete(location) == 1234
+    assert not s3.exists(location) and s3.size(location) is None
+
+
+def test_rows_in_other_buckets_reuse_one_client(s3):
+    assert storage_for_location(f"s3://{BUCKET}/media/a.mp4") is s3
+    other = storage_for_location("s3://older-bucket/a.mp4")
+    assert other is not s3 and other.bucket == "older-bucket"
+    assert storage_for_location("s3://older-bucket/b.mp4") is other
+
+
+def test_download_redirects_to_presigned_url(s3, db, tmp_path):
+    user = User(email=f"{uuid4().hex}@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    src = tmp_path / "clip.part"
+    src.write_bytes(b"\0" * 2048)
+    location = s3.put_file(src, "blobs/cd/cdef.mp4", "video/mp4")
+    db.add(StoredVideo(
+        user_id=user.id,
+        provider_task_id="video_s3test",
+        file_path=location,
+        file_size=2048,
+        expires_at=datetime.utcnow() + timedelta(hours=1),
+    ))
+    db.commit()
+    token = main.create_access_token({"sub": str(user.id)})
+
+    resp = TestClient(main.app).get(
+        "/video/sora2/video_s3test/download",
+        headers={"Authorization": f"Bearer {token}"},
+        follow_redirects=False,
+    )
+
+    assert resp.status_code == 302
+    assert resp.headers["cache-control"] == "private, no-cache"
+    url = urlparse(resp.headers["location"])
+    query = parse_qs(url.query)
+    assert url.path.endswith("/media/blobs/cd/cdef.mp4") and BUCKET in url.netloc + url.path
+    assert "Signature" in query
+    assert 0 < int(query["Expires"][0]) - time.time() <= 120
+    assert query["response-content-type"] == ["video/mp4"]
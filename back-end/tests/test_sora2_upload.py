@@ -0,0 +1,74 @@
+import base64
+import io
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+import main
+from image_cache import PreparedImageCache
+from image_preprocess import ImagePreprocessPool
+
+
+class _Response:
+    status_code = 200
+    content = b'{"id": "video_1"}'
+
+    def json(self):
+        return {"id": "video_1"}
+
+
+def _data_url(width, height, fmt="PNG"):
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (10, 120, 240)).save(out, format=fmt)
+    return f"data:image/{fmt.lower()};base64," + base64.b64encode(out.getvalue()).decode("ascii")
+
+
+@pytest.fixture
+def posts(monkeypatch, tmp_path):
+    monkeypatch.setenv("SORA2_API_KEY", "test-key")
+    monkeypatch.setattr(main, "prepared_image_cache", PreparedImageCache(tmp_path))
+    pool = ImagePreprocessPool()
+    monkeypatch.setattr(main, "image_pool", pool)
+    calls = []
+
+    def fake_post(url, **kwargs):
+        calls.append(kwargs)
+        return _Response()
+
+    monkeypatch.setattr(main.requests, "post", fake_post)
+    yield calls
+    pool.shutdown()
+
+
+def _uploaded(calls):
+    assert len(calls) == 1
+    filename, body, mime_type = calls[0]["files"]["input_reference"]
+    assert isinstance(body, bytes)  # built from memory, not from a file on disk
+    return filename, body, mime_type
+
+
+def test_matching_image_is_uploaded_as_is(posts):
+    url = _data_url(1280, 720, "JPEG")
+    assert main._sora2_create_task("a boat", "16:9", "sd", [url], None, None) == {"id": "video_1"}
+    filename, body, mime_type = _uploaded(posts)
+    assert (filename, mime_type) == ("image.jpg", "image/jpeg")
+    assert body == base64.b64decode(url.split(",", 1)[1])
+    assert posts[0]["data"]["size"] == "1280x720"
+
+
+def test_other_sizes_are_resized_before_upload(posts):
+    main._sora2_create_task("a boat", "portrait", "sd", [_data_url(300, 300, "JPEG")], None, None)
+    filename, body, mime_type = _uploaded(posts)
+    assert (filename, mime_type) == ("image.png", "image/png")
+    with Image.open(io.BytesIO(body)) as img:
+        assert img.size == (720, 1280)
+
+
+def test_prepared_image_is_reused_from_cache(posts):
+    url = _data_url(300, 300)
+    main._sora2_create_task("a boat", "16:9", "sd", [url], None, None)
+    main._sora2_create_task("a boat", "16:9", "sd", [url], None, None)
+    assert posts[0]["files"] == posts[1]["files"]
+    assert main.image_pool.metrics()["completed"] == 1
+    assert main.prepared_image_cache.metrics()["memory_hits"] == 1
@@ -0,0 +1,115 @@
+"""
+Per-process cache of authenticated User rows.
+
+Every authenticated request (status polls, media downloads, ...) resolves the
+token's user. Cached users are attached to the request's session with
+Session.merge(load=False), which copies the cached state without a SELECT, so
+the endpoint gets a normal persistent User it can read and modify.
+
+- AUTH_USER_CACHE_TTL_SECONDS   how long an entry is reused (default 60)
+- AUTH_USER_CACHE_SIZE          max cached users, least recently used are
+                                dropped first (default 10000)
+
+Entries are invalidated when a session that changed or deleted the user
+commits (password reset, reset codes, profile changes, rehash on login), so
+the TTL only bounds staleness from other processes.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from env_config import env_int
+from models import User
+
+_COLUMNS = [c.key for c in User.__table__.columns]
+
+
+class UserCache:
+    def __init__(self):
+        self.ttl_seconds = max(0, env_int("AUTH_USER_CACHE_TTL_SECONDS", 60))
+        self.max_entries = max(1, env_int("AUTH_USER_CACHE_SIZE", 10000))
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, Tuple[float, User]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, db: Session, user_id: int) -> Optional[User]:
+        """The user attached to `db`, from the cache or the database. None if there's no such user."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                snapshot = entry[1]
+            else:
+                snapshot = None
+                self.misses += 1
+        if snapshot is not None:
+            return db.merge(snapshot, load=False)
+
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is not None and self.ttl_seconds:
+            self._put(user)
+        return user
+
+    def _put(self, user: User) -> None:
+        # Detached copy: the cached object is never bound to a session or changed by one
+        snapshot = User(**{key: getattr(user, key) for key in _COLUMNS})
+        make_transient_to_detached(snapshot)
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl_seconds, snapshot)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "invalidations": self.invalidations,
+            }
+
+
+user_cache = UserCache()
+
+
+# Invalidate on commit, not on flush: between the two, another request could
+# still read (and cache) the old row.
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    changed = session.info.setdefault("user_cache_changed", set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            changed.add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop("user_cache_changed", ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session):
+    session.info.pop("user_cache_changed", None)
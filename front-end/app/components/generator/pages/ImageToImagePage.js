@@ -272,6 +272,7 @@ export default function ImageToImagePage({ onGenerate, onNavigateToMyImages }) {
               const imageData = {
                 id: Date.now().toString(),
                 url: job.image_url,
+                thumbnailUrl: job.thumbnails?.['640'] || null,
                 prompt: prompt || 'Restyle transformation',
                 type: 'image-to-image',
                 createdAt: new Date().toISOString(),
@@ -267,9 +267,10 @@ export default function MyImagesPage() {
               className="group relative aspect-square bg-gray-800/50 rounded-xl border border-gray-700 overflow-hidden hover:border-purple-500/50 transition-all"
             >
               <img
-                src={image.url}
+                src={image.thumbnailUrl || image.url}
                 alt={image.prompt || 'Generated image'}
                 className="w-full h-full object-cover"
+                loading="lazy"
               />
               
               {/* Overlay on hover */}
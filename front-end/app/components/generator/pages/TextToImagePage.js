@@ -183,6 +183,7 @@ export default function TextToImagePage({ onGenerate, onNavigateToMyImages, init
               const imageData = {
                 id: Date.now().toString(),
                 url: job.image_url,
+                thumbnailUrl: job.thumbnails?.['640'] || null,
                 prompt: prompt,
                 type: 'text-to-image',
                 createdAt: new Date().toISOString(),
@@ -313,6 +313,7 @@ export const normalizeVideoUrl = (url) => {
 /**
  * Add authentication token to video URL for download endpoints.
  * This is needed because video tags cannot send Authorization headers.
+ * Signed media URLs (uid/exp/sig) from the backend are used as-is until they expire.
  */
 export const addTokenToVideoUrl = (url) => {
   if (!url) return url;
@@ -321,11 +322,22 @@ export const addTokenToVideoUrl = (url) => {
   const normalizedUrl = normalizeVideoUrl(url);
   
   const token = getAuthToken();
-  if (!token) return normalizedUrl;
-  
+
   // Check if token is already in the URL
   try {
     const urlObj = new URL(normalizedUrl);
+    if (urlObj.searchParams.has('sig')) {
+      // Signed media URL from the backend: use it while it's valid, no JWT in the URL
+      const exp = Number(urlObj.searchParams.get('exp'));
+      if (!token || exp * 1000 > Date.now() + 30 * 1000) {
+        return normalizedUrl;
+      }
+      // Expired (e.g. saved in My Videos): drop the signature and use the token instead
+      ['uid', 'exp', 'sig'].forEach((key) => urlObj.searchParams.delete(key));
+      urlObj.searchParams.set('token', token);
+      return urlObj.toString();
+    }
+    if (!token) return normalizedUrl;
     if (urlObj.searchParams.has('token')) {
       // Token already exists, return as is
       return normalizedUrl;
@@ -333,12 +345,56 @@ export const addTokenToVideoUrl = (url) => {
   } catch {
     // If URL parsing fails, continue with string manipulation
   }
-  
+  if (!token) return normalizedUrl;
+
   // Check if URL already has query parameters
   const separator = normalizedUrl.includes('?') ? '&' : '?';
   return `${normalizedUrl}${separator}token=${encodeURIComponent(token)}`;
 };
 
+// ==============================
+// Reference image assets
+// ==============================
+
+export const uploadImageAsset = async (blob) => {
+  const formData = new FormData();
+  formData.append('file', blob, 'reference');
+  const response = await fetch(`${API_BASE_URL}/assets/images`, {
+    method: 'POST',
+    headers: {
+      ...getAuthHeaders(),
+    },
+    body: formData,
+  });
+  return await handleResponse(response);
+};
+
+// data URL -> Promise<"asset:<id>">, so the same image is uploaded once per page session
+const imageAssetRefs = new Map();
+
+/**
+ * Replace a base64 data URL with an uploaded asset reference ("asset:<id>").
+ * Other values (http URLs, existing refs, empty) are returned unchanged.
+ * Falls back to sending the data URL inline if the upload fails.
+ */
+export const toImageRef = async (value) => {
+  if (typeof value !== 'string' || !value.startsWith('data:image/')) return value;
+  if (!imageAssetRefs.has(value)) {
+    const pending = fetch(value)
+      .then((res) => res.blob())
+      .then(uploadImageAsset)
+      .then((asset) => asset.ref);
+    imageAssetRefs.set(value, pending);
+    pending.catch(() => imageAssetRefs.delete(value));
+  }
+  try {
+    return await imageAssetRefs.get(value);
+  } catch (error) {
+    console.warn('Image asset upload failed, sending the image inline:', error);
+    return value;
+  }
+};
+
 export const createTextToVideoJob = async ({
   prompt,
   model,
@@ -352,6 +408,7 @@ export const createTextToVideoJob = async ({
   watermark,
 }) => {
   try {
+    const imageRefs = image_urls ? await Promise.all(image_urls.map(toImageRef)) : image_urls;
     const response = await fetch(`${API_BASE_URL}/video/text-to-video`, {
       method: 'POST',
       headers: {
@@ -366,7 +423,7 @@ export const createTextToVideoJob = async ({
         duration_seconds,
         resolution,
         quality,
-        image_urls,
+        image_urls: imageRefs,
         callback_url,
         watermark,
       }),
@@ -437,6 +494,7 @@ export const createImageToImageJob = async ({
   aspect_ratio,
 }) => {
   try {
+    const [imageRef, imageRef2] = await Promise.all([toImageRef(image_url), toImageRef(image_url2)]);
     const response = await fetch(`${API_BASE_URL}/image/image-to-image`, {
       method: 'POST',
       headers: {
@@ -445,8 +503,8 @@ export const createImageToImageJob = async ({
       },
       body: JSON.stringify({
         prompt,
-        image_url,
-        image_url2,
+        image_url: imageRef,
+        image_url2: imageRef2,
         model,
         mode,
         aspect_ratio,